@@ -1,7 +1,10 @@
 """
 ASGI config for app project.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
+It exposes the ASGI callable as a module-level variable named ``application``:
+Django, behind the stream of change notifications, see core/events.py.
+scripts/run.sh serves it with SERVER=asgi, on gunicorn with uvicorn
+workers: `gunicorn -k uvicorn.workers.UvicornWorker app.asgi`.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +16,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from core.events import EventStream  # noqa: E402
+
+application = EventStream(django_application)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'rest_framework.authtoken',
@@ -50,6 +52,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,9 +88,37 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # seconds a connection is reused, set by gunicorn.conf.py for production
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
     }
 }
 
+# read replicas, see core/routers.py. DB_REPLICA_HOSTS is a comma
+# separated list of hosts sharing the primary's name and credentials.
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'PIN_SECONDS': int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5)),
+    'MAX_LAG_SECONDS': int(os.environ.get('DB_REPLICA_MAX_LAG_SECONDS', 5)),
+    'CHECK_INTERVAL': 5,
+}
+for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'OPTIONS': {'connect_timeout': 2},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS['ALIASES'].append(alias)
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# hash partitions of the recipe tables on PostgreSQL, 0 keeps them plain.
+# Applied by migration core 0012 or later with manage.py partition_recipes,
+# see core/partitioning.py
+RECIPE_PARTITIONS = int(os.environ.get('RECIPE_PARTITIONS', 0))
+RECIPE_PARTITION_BATCH_SIZE = 10000
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -103,6 +134,21 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing runs in a separate process pool, see core/hashing.py
+PASSWORD_HASHING_POOL = {
+    'WORKERS': int(os.environ.get('PASSWORD_HASHING_WORKERS', max(1, (os.cpu_count() or 2) // 2))),
+    'MAX_PENDING': int(os.environ.get('PASSWORD_HASHING_MAX_PENDING', 16)),
+    'QUEUE_TIMEOUT': 2,
+}
+
+# Expiring API tokens, see core/models.py AuthToken
+AUTH_TOKEN = {
+    'TTL': timedelta(days=int(os.environ.get('AUTH_TOKEN_TTL_DAYS', 7))),
+    'SLIDING': True,
+    'RENEW_AFTER': timedelta(hours=1),
+    'PURGE_BATCH_SIZE': 1000,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -123,6 +169,18 @@ MEDIA_URL = '/static/media/'
 STATIC_ROOT = '/vol/web/static/' # در محیط تولید جمع اوری فایل ها در کجا باشه
 MEDIA_ROOT = '/vol/web/media/'
 
+# media URLs are signed and served by core.views.serve_media, see core/media.py
+DEFAULT_FILE_STORAGE = 'core.media.SignedMediaStorage'
+MEDIA_SERVING = {
+    # python, x-accel (nginx) or x-sendfile (apache, lighttpd)
+    'BACKEND': os.environ.get('MEDIA_SERVING_BACKEND', 'python'),
+    'INTERNAL_PREFIX': '/protected-media/',
+    'SIGNED': True,
+    'SIGNED_URL_TTL': 6 * 3600,
+    # uploads get a fresh uuid name, so their content never changes
+    'IMMUTABLE_PATTERN': r'^uploads/',
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -130,7 +188,110 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'core.User'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # token buckets shared by the workers of a host, see core/throttling.py
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.IPBucketThrottle',
+        'core.throttling.BucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'ip': os.environ.get('THROTTLE_RATE_IP', '1200/min'),
+        'user': os.environ.get('THROTTLE_RATE_USER', '600/min'),
+        'anon': os.environ.get('THROTTLE_RATE_ANON', '60/min'),
+        'token': os.environ.get('THROTTLE_RATE_TOKEN', '10/min'),
+        'recipe-write': os.environ.get('THROTTLE_RATE_RECIPE_WRITE', '120/min'),
+    },
+    # proxies in front of the app, the client IP is read from X-Forwarded-For
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+}
+
+THROTTLE = {
+    'SLOTS': 65536,
+}
+
+# replayed responses of writes sent with an Idempotency-Key, see core/idempotency.py
+IDEMPOTENCY = {
+    'TTL': timedelta(hours=24),
+    # seconds a duplicate waits for the request it repeats
+    'LOCK_TIMEOUT': 10,
+    'MAX_BODY_SIZE': 64 * 1024,
+    'PURGE_BATCH_SIZE': 1000,
+}
+
+# per-user change log served by /api/recipe/changes/, see core/changes.py
+CHANGES = {
+    # older entries are dropped, clients behind them resync
+    'RETENTION': timedelta(days=int(os.environ.get('CHANGES_RETENTION_DAYS', 30))),
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 2000,
+    'COMPACT_BATCH_SIZE': 1000,
 }
+
+# change notifications streamed by app/asgi.py, see core/events.py
+EVENTS = {
+    # 'postgres' reaches the streams of every process, 'local' only this one's
+    # and publishes nothing where no stream is served. scripts/run.sh picks
+    # 'postgres' when serving app.asgi, set it for every process then.
+    'BACKEND': os.environ.get('EVENTS_BACKEND', 'local'),
+    'PATH': '/api/recipe/events/',
+    'CHANNEL': 'recipe_events',
+    'HEARTBEAT': 15,
+    'MAX_CONNECTIONS': int(os.environ.get('EVENTS_MAX_CONNECTIONS', 10000)),
+    # seconds a stream ticket stays valid
+    'TICKET_TTL': 60,
+}
+
+# drops stale entries of in-process caches in every process, see core/invalidation.py
+INVALIDATION = {
+    'BACKEND': os.environ.get('INVALIDATION_BACKEND', 'postgres'),
+    'CHANNEL': 'cache_invalidation',
+}
+
+# identical concurrent list requests share one computation, see core/singleflight.py
+SINGLE_FLIGHT = {
+    # the workers of a host share too, through lock files on tmpfs
+    'SHARED': os.environ.get('SINGLE_FLIGHT_SHARED', '0') == '1',
+    'PATH': os.environ.get('SINGLE_FLIGHT_PATH', '/dev/shm/recipe-single-flight'),
+    'TIMEOUT': 10,
+}
+
+# isolates the throttle buckets, see core/test_runner.py
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# Facet results are keyed by the user's data version, see core/versions.py
+RECIPE_FACETS_CACHE_TIMEOUT = 300
+
+# counts above this are planner estimates, see core/counting.py
+COUNT_ESTIMATE_THRESHOLD = int(os.environ.get('COUNT_ESTIMATE_THRESHOLD', 10000))
+
+# background job queue, see core/jobs.py
+JOBS = {
+    'CONCURRENCY': int(os.environ.get('JOB_WORKER_CONCURRENCY', 2)),
+    'MODE': os.environ.get('JOB_WORKER_MODE', 'threads'),
+    'POLL_INTERVAL': 1.0,
+    'BACKOFF_BASE': 10,
+    'BACKOFF_MAX': 3600,
+    # running jobs without a heartbeat for this long are retried
+    'STALE_AFTER': timedelta(minutes=10),
+    'HEARTBEAT_INTERVAL': 60,
+    'KEEP_FINISHED': timedelta(days=7),
+}
+
+# Users whose ingredient coverage index is kept in memory, see recipe/coverage.py
+RECIPE_COVERAGE_MAX_USERS = 256
+
+# Tag and ingredient name suggestions, see recipe/autocomplete.py
+AUTOCOMPLETE = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 25,
+    'FUZZY_MIN_LENGTH': 3,
+    'TIMEOUT_MS': 50,
+    'CACHE_TIMEOUT': 60,
+}
+
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST':True,
-}
\ No newline at end of file
+}
+
+# The schema is rendered once per code version, see core/schema.py
+CODE_VERSION = os.environ.get('CODE_VERSION', '')
+OPENAPI_SCHEMA_DIR = os.environ.get('OPENAPI_SCHEMA_DIR', '/vol/web/schema')
@@ -16,16 +16,14 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import (
-SpectacularAPIView,
-SpectacularSwaggerView,
-)
-from django.conf.urls.static import static
+from drf_spectacular.views import SpectacularSwaggerView
 from django.conf import settings
 
+from core.views import CachedSchemaView, serve_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
+    path('api/schema/', CachedSchemaView.as_view(), name='api-schema'),
     path(
         'api/docs/',
         SpectacularSwaggerView.as_view(url_name='api-schema'),
@@ -35,8 +33,5 @@ urlpatterns = [
         'api/user/', include('user.urls'),
     ),
     path('api/recipe/', include('recipe.urls')),
-
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', serve_media, name='media'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,12 +1,90 @@
-from django.contrib import admin
+import csv
+
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from core import models
+from django import forms
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from core import jobs, models
+from core.counting import EstimatedCountPaginator
 from django.utils.translation import gettext_lazy as _
 
+# ids per background job queued by the bulk actions
+ACTION_BATCH_SIZE = 500
+
+
+def queue_in_batches(task, queryset, **kwargs):
+    """queue task over the queryset's ids in batches, return the id count."""
+    ids = queryset.order_by().values_list('pk', flat=True).iterator(chunk_size=ACTION_BATCH_SIZE)
+    batch, total = [], 0
+    for pk in ids:
+        batch.append(pk)
+        if len(batch) == ACTION_BATCH_SIZE:
+            jobs.enqueue(task, {'ids': batch, **kwargs})
+            total += len(batch)
+            batch = []
+    if batch:
+        jobs.enqueue(task, {'ids': batch, **kwargs})
+        total += len(batch)
+    return total
+
+
+class Echo:
+    """file-like object handing csv rows straight to the response"""
+
+    def write(self, value):
+        return value
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """
+    Changelist that doesn't count the whole table, with bulk actions that
+    run as background jobs instead of loading the selected objects.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    export_fields = ('id',)
+    actions = ['delete_in_background', 'export_csv']
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # its confirmation page collects every related object
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(permissions=['delete'], description=_('Delete selected in the background'))
+    def delete_in_background(self, request, queryset):
+        count = queue_in_batches('core.tasks.delete_objects', queryset,
+                                 model=self.model._meta.label)
+        self.message_user(request, _('%d rows queued for deletion.') % count, messages.SUCCESS)
+
+    @admin.action(description=_('Export selected as CSV'))
+    def export_csv(self, request, queryset):
+        writer = csv.writer(Echo())
+        rows = queryset.order_by('pk').values_list(*self.export_fields).iterator(chunk_size=2000)
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in _with_header(self.export_fields, rows)),
+            content_type='text/csv',
+        )
+        name = self.model._meta.model_name
+        response['Content-Disposition'] = f'attachment; filename="{name}s.csv"'
+        return response
+
+
+def _with_header(header, rows):
+    yield header
+    yield from rows
+
 
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # prefix search served by the upper(email) index, see migration 0014
+    search_fields = ['^email']
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (
@@ -34,7 +112,73 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class RetagForm(forms.Form):
+    name = forms.CharField(max_length=255, label=_('Tag name'))
+    remove = forms.BooleanField(required=False, label=_('Remove the tag instead'))
+
+
+class RecipeAdmin(ScalableModelAdmin):
+    list_display = ['id', 'title', 'user', 'price', 'time_minutes']
+    list_select_related = ['user']
+    ordering = ['-id']
+    autocomplete_fields = ['user', 'tags', 'ingredients']
+    search_fields = ['^title']
+    export_fields = ('id', 'user__email', 'title', 'time_minutes', 'price', 'link')
+    actions = ScalableModelAdmin.actions + ['retag']
+
+    def get_search_results(self, request, queryset, search_term):
+        """an id, an owner's email or a title prefix, each on its own index"""
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        if '@' in term:
+            return queryset.filter(user__email__iexact=term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    @admin.action(permissions=['change'], description=_('Add or remove a tag in the background'))
+    def retag(self, request, queryset):
+        form = RetagForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            count = queue_in_batches(
+                'core.tasks.retag_recipes', queryset,
+                name=form.cleaned_data['name'], remove=form.cleaned_data['remove'],
+            )
+            self.message_user(request, _('%d recipes queued for retagging.') % count,
+                              messages.SUCCESS)
+            return None
+        return TemplateResponse(request, 'admin/core/recipe/retag.html', {
+            **self.admin_site.each_context(request),
+            'title': _('Retag recipes'),
+            'opts': self.model._meta,
+            'form': form,
+            'action': 'retag',
+            'select_across': request.POST.get('select_across', '0'),
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        })
+
+
+class RecipeAttrAdmin(ScalableModelAdmin):
+    list_display = ['id', 'name', 'user', 'recipe_count']
+    list_select_related = ['user']
+    ordering = ['-id']
+    autocomplete_fields = ['user']
+    # prefix search served by the upper(name) index, see migration 0014
+    search_fields = ['^name']
+    readonly_fields = ['recipe_count']
+    export_fields = ('id', 'user__email', 'name', 'recipe_count')
+
+
+class JobAdmin(ScalableModelAdmin):
+    list_display = ['id', 'name', 'status', 'priority', 'run_at', 'attempts', 'finished_at']
+    list_filter = ['status']
+    ordering = ['-id']
+    search_fields = ['=name']
+    readonly_fields = [field.name for field in models.Job._meta.fields]
+    export_fields = ('id', 'name', 'status', 'attempts', 'created', 'finished_at', 'last_error')
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.Tag, RecipeAttrAdmin)
+admin.site.register(models.Ingredient, RecipeAttrAdmin)
+admin.site.register(models.Job, JobAdmin)
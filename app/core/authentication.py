@@ -0,0 +1,38 @@
+"""
+Authentication classes for the API.
+"""
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from core.models import AuthToken, token_settings
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """Token authentication that rejects expired tokens."""
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        tokens = AuthToken.objects.select_related('user')
+        try:
+            token = tokens.get(key=key)
+        except AuthToken.DoesNotExist:
+            # a token issued moments ago may not have reached the replica yet
+            token = None
+            if tokens.db != DEFAULT_DB_ALIAS:
+                token = tokens.using(DEFAULT_DB_ALIAS).filter(key=key).first()
+            if token is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        now = timezone.now()
+        if token.is_expired(now):
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        if token_settings()['SLIDING']:
+            token.renew(now)
+
+        return (token.user, token)
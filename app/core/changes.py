@@ -0,0 +1,174 @@
+"""
+Per-user change log for incremental sync.
+
+Every create, update and delete of a user's recipes, tags, ingredients and
+recipe links appends an entry to the user's log in the same transaction as
+the change: deletes are kept as tombstones. Sequence numbers come from the
+user's ChangeLog row, incremented with an upsert that holds its row lock
+until commit, so a user's entries become visible in sequence order and a
+reader never skips one that commits later. Writes of different users don't
+contend.
+
+Clients read the entries after their cursor, collapsed to the last entry
+per object. The compact_changes job drops entries superseded by a later
+one for the same object, and entries older than CHANGES['RETENTION'] after
+raising the user's floor: a cursor below the floor can't be served any
+more and the client is told to resync.
+
+Deleting a tag or ingredient removes its links without logging them, its
+tombstone implies them.
+"""
+import threading
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef, Subquery
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Change, ChangeLog, Ingredient, Recipe, Tag, User, changes_settings
+from core.signals import changes_logged, recipe_links_changed
+
+KINDS = {Recipe: Change.RECIPE, Tag: Change.TAG, Ingredient: Change.INGREDIENT}
+LINK_KINDS = {'tags': Change.RECIPE_TAG, 'ingredients': Change.RECIPE_INGREDIENT}
+
+ChangePage = namedtuple('ChangePage', 'entries cursor more resync')
+
+# users being deleted, their cascading deletes aren't logged
+_deleting = threading.local()
+
+
+def _reserve(user_id, count):
+    """the next count sequence numbers of the user's log."""
+    table = connection.ops.quote_name(ChangeLog._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, seq, floor) VALUES (%s, %s, 0) '
+            f'ON CONFLICT (user_id) DO UPDATE SET seq = {table}.seq + excluded.seq '
+            f'RETURNING seq',
+            [user_id, count],
+        )
+        last = cursor.fetchone()[0]
+    return range(last - count + 1, last + 1)
+
+
+def record(user_id, entries):
+    """append (kind, object_id, target_id, deleted) entries to the user's log."""
+    if not entries or user_id in getattr(_deleting, 'users', ()):
+        return
+    with transaction.atomic():
+        now = timezone.now()
+        Change.objects.bulk_create([
+            Change(
+                user_id=user_id, seq=seq, kind=kind, object_id=object_id,
+                target_id=target_id, deleted=deleted, created=now,
+            )
+            for seq, (kind, object_id, target_id, deleted)
+            in zip(_reserve(user_id, len(entries)), entries)
+        ])
+        changes_logged.send(
+            sender=Change, user_id=user_id, kinds={kind for kind, *_ in entries},
+        )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def log_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record(instance.user_id, [(KINDS[sender], instance.pk, 0, False)])
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def log_deleted(sender, instance, **kwargs):
+    record(instance.user_id, [(KINDS[sender], instance.pk, 0, True)])
+
+
+@receiver(recipe_links_changed)
+def log_links(sender, user_id, field, added=(), removed=(), **kwargs):
+    kind = LINK_KINDS[field]
+    record(user_id, [
+        *((kind, recipe_id, target_id, False) for recipe_id, target_id in added),
+        *((kind, recipe_id, target_id, True) for recipe_id, target_id in removed),
+    ])
+
+
+@receiver(pre_delete, sender=User)
+def start_user_delete(sender, instance, **kwargs):
+    if not hasattr(_deleting, 'users'):
+        _deleting.users = set()
+    _deleting.users.add(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def end_user_delete(sender, instance, **kwargs):
+    getattr(_deleting, 'users', set()).discard(instance.pk)
+
+
+def position(user_id):
+    """the sequence number of the user's last change, 0 before any."""
+    return ChangeLog.objects.filter(
+        user_id=user_id,
+    ).values_list('seq', flat=True).first() or 0
+
+
+def read(user_id, since, limit):
+    """
+    the user's entries after the cursor since, at most limit of them and
+    the last one per object, as a ChangePage.
+    """
+    entries = list(
+        Change.objects.filter(user_id=user_id, seq__gt=since).order_by('seq')[:limit + 1]
+    )
+    # after the entries: compaction raises the floor before deleting any
+    latest, floor = ChangeLog.objects.filter(
+        user_id=user_id,
+    ).values_list('seq', 'floor').first() or (0, 0)
+    if since < floor or since > latest:
+        return ChangePage([], latest, False, True)
+
+    more = len(entries) > limit
+    entries = entries[:limit]
+    last = {}
+    for entry in entries:
+        key = (entry.kind, entry.object_id, entry.target_id)
+        # keep the position of the object's last change
+        last.pop(key, None)
+        last[key] = entry
+    cursor = entries[-1].seq if entries else since
+    return ChangePage(list(last.values()), cursor, more, False)
+
+
+def _delete_in_batches(queryset, batch_size):
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Change.objects.filter(pk__in=ids).delete()[0]
+
+
+def compact(now=None):
+    """drop superseded and expired entries, return the number deleted."""
+    conf = changes_settings()
+    batch_size = conf['COMPACT_BATCH_SIZE']
+    newer = Change.objects.filter(
+        user=OuterRef('user'), kind=OuterRef('kind'), object_id=OuterRef('object_id'),
+        target_id=OuterRef('target_id'), seq__gt=OuterRef('seq'),
+    )
+    deleted = _delete_in_batches(Change.objects.filter(Exists(newer)), batch_size)
+
+    expired = Change.objects.filter(created__lt=(now or timezone.now()) - conf['RETENTION'])
+    last_expired = (
+        expired.filter(user=OuterRef('user'))
+        .values('user')
+        .annotate(last=Max('seq'))
+        .values('last')
+    )
+    ChangeLog.objects.filter(
+        Exists(expired.filter(user=OuterRef('user'))),
+    ).update(floor=Subquery(last_expired))
+    return deleted + _delete_in_batches(expired, batch_size)
@@ -0,0 +1,98 @@
+"""
+Denormalized recipe counts on users, tags and ingredients.
+"""
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Recipe, User
+from core.signals import recipe_links_changed
+
+
+def get_relation(field):
+    """return (through model, target model, target column) for a recipe m2m."""
+    m2m = Recipe._meta.get_field(field)
+    return (
+        m2m.remote_field.through,
+        m2m.related_model,
+        m2m.m2m_reverse_name(),
+    )
+
+
+def adjust_counts(model, deltas):
+    """apply {pk: delta} with one UPDATE per distinct delta."""
+    by_delta = {}
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(pk)
+    for delta, ids in by_delta.items():
+        model.objects.filter(pk__in=ids).update(
+            recipe_count=F('recipe_count') + delta,
+        )
+
+
+@receiver(recipe_links_changed)
+def update_usage_counts(sender, field, added=(), removed=(), **kwargs):
+    """keep recipe_count in step with the link changes."""
+    deltas = Counter(target_id for _, target_id in added)
+    deltas.subtract(target_id for _, target_id in removed)
+    adjust_counts(get_relation(field)[1], deltas)
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust_counts(User, {instance.user_id: 1})
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, **kwargs):
+    adjust_counts(User, {instance.user_id: -1})
+
+
+def reconcile(field, batch_size=1000):
+    """repair drifted tag or ingredient counts, return the number fixed."""
+    through, model, column = get_relation(field)
+    actual = (
+        through.objects.filter(**{column: OuterRef('pk')})
+        .values(column)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return _reconcile(model, actual, batch_size)
+
+
+def reconcile_recipe_counts(batch_size=1000):
+    """repair drifted per-user recipe counts, return the number fixed."""
+    actual = (
+        Recipe.objects.filter(user=OuterRef('pk'))
+        .values('user')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return _reconcile(User, actual, batch_size)
+
+
+def _reconcile(model, actual, batch_size):
+    """compare recipe_count with the actual subquery in id batches."""
+    fixed = 0
+    last_id = 0
+    while True:
+        # counts are compared with the primary, a lagging replica would undo writes
+        batch = list(
+            model.objects.using(DEFAULT_DB_ALIAS).filter(pk__gt=last_id)
+            .order_by('pk')
+            .annotate(actual=Coalesce(Subquery(actual), Value(0)))
+            .values_list('pk', 'recipe_count', 'actual')[:batch_size]
+        )
+        if not batch:
+            return fixed
+        last_id = batch[-1][0]
+        drifted = {pk: real - count for pk, count, real in batch if real != count}
+        with transaction.atomic():
+            adjust_counts(model, drifted)
+        fixed += len(drifted)
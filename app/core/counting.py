@@ -0,0 +1,54 @@
+"""
+Cheap row counts for large querysets.
+
+An exact COUNT(*) reads every matching row. `count_rows` only counts
+exactly up to COUNT_ESTIMATE_THRESHOLD, by counting a LIMITed subquery, and
+above that returns the PostgreSQL planner's row estimate for the same
+query, flagged as an estimate.
+"""
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def planner_estimate(queryset):
+    """rows the planner expects the queryset to return, None if unknown."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(queryset, threshold=None):
+    """return (count, is_estimate) for the queryset."""
+    if threshold is None:
+        threshold = settings.COUNT_ESTIMATE_THRESHOLD
+    queryset = queryset.order_by()
+    bounded = queryset[:threshold + 1].count()
+    if bounded <= threshold:
+        return bounded, False
+    estimate = planner_estimate(queryset)
+    if estimate is None:
+        return queryset.count(), False
+    return max(estimate, threshold + 1), True
+
+
+class EstimatedCountPaginator(Paginator):
+    """paginator counting exactly up to the threshold and estimating above."""
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list)
+        count, self.count_is_estimate = count_rows(self.object_list)
+        return count
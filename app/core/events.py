@@ -0,0 +1,381 @@
+"""
+Push notifications of recipe changes over Server-Sent Events.
+
+app/asgi.py serves EVENTS['PATH'] with EventStream, in front of Django.
+A signed in client keeps one request open and gets an event each time its
+change log grows:
+
+    event: changes
+    data: {"kinds": ["recipe", "recipe_tag"]}
+
+and then reads the entries from /api/recipe/changes/. Clients that can set
+headers open the stream with their `Authorization: Token` header. A
+browser's EventSource can't, it POSTs to /api/recipe/events/ticket/ first
+and opens the stream with `?ticket=`: a signed ticket valid for
+EVENTS['TICKET_TTL'] seconds, so the API token never ends up in access
+logs. A stream is a
+coroutine waiting on its Subscription, so idle clients cost no thread and
+no timer: one ticker per process wakes them all for the heartbeat.
+Notifications for a client that reads slower than they arrive are merged
+into the one not sent yet, so a slow consumer holds at most one pending
+event and never slows down the others.
+
+Brokers carry the notifications from the writing process to the streams:
+
+- 'local' delivers in process after the transaction commits, for a
+  single process serving both the API and the streams. A process without
+  streams publishes nothing,
+- 'postgres' sends NOTIFY in the writing transaction, so it is delivered
+  on commit to every process, each LISTENing on one connection of its
+  own. Identical notifications of a transaction are delivered once. After
+  losing that connection a process tells all its clients to sync, they
+  may have missed something.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections, transaction
+from django.dispatch import receiver
+from rest_framework import exceptions
+
+from core import invalidation
+from core.authentication import ExpiringTokenAuthentication
+from core.models import Change
+from core.signals import changes_logged
+
+logger = logging.getLogger(__name__)
+
+TICKET_SALT = 'core.events.ticket'
+
+ALL_KINDS = [kind for kind, _ in Change.KINDS]
+
+
+def events_settings():
+    """return EVENTS settings merged with the defaults"""
+    defaults = {
+        'BACKEND': 'local',
+        'PATH': '/api/recipe/events/',
+        'CHANNEL': 'recipe_events',
+        'HEARTBEAT': 15,
+        'MAX_CONNECTIONS': 10000,
+        'RECONNECT_DELAY': 1,
+        'TICKET_TTL': 60,
+    }
+    return {**defaults, **getattr(settings, 'EVENTS', {})}
+
+
+class Subscription:
+    """a client's stream, the kinds changed since its last event."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.kinds = set()
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    def notify(self, kinds):
+        self.kinds.update(kinds)
+        self._ready.set()
+
+    def ping(self):
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self):
+        """
+        wait for the next event: the sorted changed kinds, [] for a
+        heartbeat, None once closed.
+        """
+        await self._ready.wait()
+        self._ready.clear()
+        if self.closed:
+            return None
+        kinds, self.kinds = sorted(self.kinds), set()
+        return kinds
+
+
+class LocalBroker:
+    """delivers notifications to this process's subscriptions."""
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.subscriptions = defaultdict(set)
+        self.count = 0
+        self.loop = None
+        self._tasks = []
+
+    def start(self):
+        """run the heartbeat on the current event loop."""
+        self.loop = asyncio.get_running_loop()
+        self._tasks.append(self.loop.create_task(self._heartbeat()))
+
+    def subscribe(self, user_id):
+        if self.loop is None:
+            self.start()
+        subscription = Subscription(user_id)
+        self.subscriptions[user_id].add(subscription)
+        self.count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subs = self.subscriptions.get(subscription.user_id)
+        if subs is not None and subscription in subs:
+            subs.remove(subscription)
+            self.count -= 1
+            if not subs:
+                del self.subscriptions[subscription.user_id]
+
+    def publish(self, user_id, kinds):
+        """notify the user's streams once the current transaction commits."""
+        if self.loop is None:
+            # no stream was ever opened in this process
+            return
+        transaction.on_commit(lambda: self.deliver(user_id, kinds))
+
+    def deliver(self, user_id, kinds):
+        """notify the user's streams in this process, from any thread."""
+        if self.loop is None or user_id not in self.subscriptions:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._dispatch, user_id, kinds)
+        except RuntimeError:
+            # the loop was closed on shutdown
+            pass
+
+    def _dispatch(self, user_id, kinds):
+        for subscription in self.subscriptions.get(user_id, ()):
+            subscription.notify(kinds)
+
+    def _dispatch_all(self, kinds):
+        for subs in self.subscriptions.values():
+            for subscription in subs:
+                subscription.notify(kinds)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.conf['HEARTBEAT'])
+            for subs in list(self.subscriptions.values()):
+                for subscription in list(subs):
+                    subscription.ping()
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for subs in self.subscriptions.values():
+            for subscription in subs:
+                subscription.close()
+        self.loop = None
+
+
+class PostgresBroker(LocalBroker):
+    """delivers notifications to every process through LISTEN/NOTIFY."""
+
+    def start(self):
+        super().start()
+        self._tasks.append(self.loop.create_task(self._listen()))
+
+    def publish(self, user_id, kinds):
+        # queued with the transaction and delivered when it commits
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [
+                self.conf['CHANNEL'], f'{user_id} {",".join(sorted(kinds))}',
+            ])
+
+    def _connect(self):
+        params = connections[DEFAULT_DB_ALIAS].get_connection_params()
+        conn = psycopg2.connect(**params)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {connection.ops.quote_name(self.conf["CHANNEL"])}')
+        return conn
+
+    async def _listen(self):
+        connected_before = False
+        while True:
+            conn = None
+            lost = self.loop.create_future()
+            try:
+                conn = await self.loop.run_in_executor(None, self._connect)
+                fd = conn.fileno()
+                self.loop.add_reader(fd, self._read, conn, lost)
+                if connected_before:
+                    self._dispatch_all(ALL_KINDS)
+                connected_before = True
+                await lost
+            except (psycopg2.Error, OSError) as exc:
+                logger.warning('lost the event listener connection: %s', exc)
+            finally:
+                if conn is not None:
+                    self.loop.remove_reader(fd)
+                    conn.close()
+            await asyncio.sleep(self.conf['RECONNECT_DELAY'])
+
+    def _read(self, conn, lost):
+        try:
+            conn.poll()
+        except psycopg2.Error as exc:
+            if not lost.done():
+                lost.set_exception(exc)
+            return
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            user_id, _, kinds = notify.payload.partition(' ')
+            self._dispatch(int(user_id), kinds.split(','))
+
+
+BACKENDS = {'local': LocalBroker, 'postgres': PostgresBroker}
+
+_broker = None
+
+
+def get_broker():
+    """return this process's broker."""
+    global _broker
+    if _broker is None:
+        conf = events_settings()
+        _broker = BACKENDS[conf['BACKEND']](conf)
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'EVENTS' and _broker is not None:
+        _broker.close()
+        _broker = None
+
+
+@receiver(changes_logged)
+def publish_changes(sender, user_id, kinds, **kwargs):
+    get_broker().publish(user_id, kinds)
+
+
+def issue_ticket(user):
+    """a signed ticket opening the user's stream for TICKET_TTL seconds."""
+    return signing.dumps(user.pk, salt=TICKET_SALT)
+
+
+def _ticket_user(ticket):
+    """the id of the user the ticket was issued to, None once expired."""
+    try:
+        user_id = signing.loads(ticket, salt=TICKET_SALT, max_age=events_settings()['TICKET_TTL'])
+    except signing.BadSignature:
+        return None
+    if get_user_model().objects.filter(pk=user_id, is_active=True).exists():
+        return user_id
+    return None
+
+
+def authenticate(scope):
+    """
+    the id of the user of the request's Authorization token or ticket
+    parameter, or None.
+    """
+    headers = dict(scope.get('headers', []))
+    words = headers.get(b'authorization', b'').decode('latin-1').split()
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    ticket = query.get('ticket', [None])[0]
+    close_old_connections()
+    try:
+        if len(words) == 2 and words[0].lower() == 'token':
+            user, _ = ExpiringTokenAuthentication().authenticate_credentials(words[1])
+            return user.pk
+        if ticket:
+            return _ticket_user(ticket)
+        return None
+    except exceptions.AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+
+
+class EventStream:
+    """ASGI app streaming a user's change notifications, Django for the rest."""
+
+    def __init__(self, app):
+        self.app = app
+        self.path = events_settings()['PATH']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            return await self.stream(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                invalidation.get_bus().start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                get_broker().close()
+                invalidation.get_bus().stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def respond(self, send, status, detail):
+        await send({
+            'type': 'http.response.start', 'status': status,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', 'body': json.dumps({'detail': detail}).encode()})
+
+    async def stream(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            return await self.respond(send, 405, 'Method not allowed.')
+        user_id = await sync_to_async(authenticate)(scope)
+        if user_id is None:
+            return await self.respond(send, 401, 'Authentication credentials were not provided.')
+        broker = get_broker()
+        if broker.count >= broker.conf['MAX_CONNECTIONS']:
+            return await self.respond(send, 503, 'Too many open streams, retry later.')
+
+        subscription = broker.subscribe(user_id)
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, subscription))
+        try:
+            await send({
+                'type': 'http.response.start', 'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    # don't let a proxy buffer the stream
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+            while True:
+                kinds = await subscription.get()
+                if kinds is None:
+                    break
+                if kinds:
+                    body = f'event: changes\ndata: {json.dumps({"kinds": kinds})}\n\n'
+                else:
+                    body = ': ping\n\n'
+                # waits while the client's buffers are full, its notifications merge meanwhile
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            broker.unsubscribe(subscription)
+
+    async def _watch_disconnect(self, receive, subscription):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                subscription.close()
+                return
@@ -0,0 +1,195 @@
+"""
+Bounded worker pool for password hashing and verification.
+
+PBKDF2 is deliberately slow, so hashing in the request thread lets a burst
+of logins pin every worker on CPU. The helpers here run the hasher in a
+small process pool instead and refuse new work once too many calls are
+already waiting for a free worker.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    get_hasher,
+    identify_hasher,
+    is_password_usable,
+    make_password as _make_password,
+)
+from django.db import connections
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WORKERS': max(1, (os.cpu_count() or 2) // 2),
+    'MAX_PENDING': None,
+    'QUEUE_TIMEOUT': 2,
+    'START_METHOD': 'spawn',
+}
+
+
+class PasswordHashingBusy(APIException):
+    """raised when the hashing pool queue is full."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many concurrent sign-ins, please retry shortly.')
+    default_code = 'password_hashing_busy'
+    wait = 1
+
+
+def _setup_worker(settings_module):
+    """configure django inside a freshly started pool process."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    if not apps.ready:
+        django.setup()
+
+
+def _hash(raw_password):
+    return _make_password(raw_password)
+
+
+def _verify(raw_password, encoded):
+    """return (is_correct, must_update) the same way django checks passwords."""
+    preferred = get_hasher('default')
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False, False
+
+    is_correct = hasher.verify(raw_password, encoded)
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    if not is_correct and not hasher_changed and must_update:
+        hasher.harden_runtime(raw_password, encoded)
+    return is_correct, must_update
+
+
+class HashingPool:
+    """process pool with a cap on running plus queued hashing calls."""
+
+    def __init__(self, workers, max_pending=None, queue_timeout=2,
+                 start_method='spawn'):
+        self.workers = workers
+        self.max_pending = workers * 4 if max_pending is None else max_pending
+        self.queue_timeout = queue_timeout
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # a pool inherited through fork() has no live workers, start a new one
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_setup_worker,
+                    initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'app.settings'),),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn, *args):
+        """schedule fn in the pool, raising PasswordHashingBusy when full."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHashingBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        return self.submit(fn, *args).result()
+
+    async def arun(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_rehash_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+
+
+def get_pool():
+    """return the process-wide hashing pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                conf = {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING_POOL', {})}
+                _pool = HashingPool(
+                    workers=conf['WORKERS'],
+                    max_pending=conf['MAX_PENDING'],
+                    queue_timeout=conf['QUEUE_TIMEOUT'],
+                    start_method=conf['START_METHOD'],
+                )
+    return _pool
+
+
+def make_password(raw_password):
+    """hash a password in the pool."""
+    if raw_password is None:
+        return _make_password(None)
+    return get_pool().run(_hash, raw_password)
+
+
+def verify_password(raw_password, encoded):
+    """check a password in the pool, returning (is_correct, must_update)."""
+    if raw_password is None or not is_password_usable(encoded):
+        return False, False
+    return get_pool().run(_verify, raw_password, encoded)
+
+
+async def amake_password(raw_password):
+    if raw_password is None:
+        return _make_password(None)
+    return await get_pool().arun(_hash, raw_password)
+
+
+async def averify_password(raw_password, encoded):
+    if raw_password is None or not is_password_usable(encoded):
+        return False, False
+    return await get_pool().arun(_verify, raw_password, encoded)
+
+
+def _rehash(user_model, user_id, raw_password, old_encoded):
+    try:
+        new_encoded = make_password(raw_password)
+        # only replace the hash we verified, a concurrent password change wins
+        user_model._default_manager.filter(
+            pk=user_id, password=old_encoded,
+        ).update(password=new_encoded)
+    except Exception:
+        logger.exception('Failed to upgrade password hash for user %s', user_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_rehash(user, raw_password):
+    """upgrade an outdated password hash without blocking the login."""
+    return _rehash_executor.submit(
+        _rehash, type(user), user.pk, raw_password, user.password,
+    )
@@ -0,0 +1,176 @@
+"""
+Idempotency keys for API writes.
+
+A client that sends a write with an `Idempotency-Key` header gets the same
+response for every retry with that key within IDEMPOTENCY['TTL'], and the
+write happens once. The request runs in a transaction that first inserts
+the key's row and then stores the response in it, so a concurrent duplicate
+blocks on the unique index until the first request commits, then replays
+its response. When the first request fails with a server error its
+transaction rolls back, the key is free again and the duplicate runs.
+
+Keys are scoped to the signed in user. Reusing a key for a different
+request (method, path or payload) is refused with 422. Responses larger
+than MAX_BODY_SIZE are replayed without their body, and expired keys are
+deleted by the purge_idempotency_keys job.
+"""
+import hashlib
+import json
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from core.models import IdempotencyKey, idempotency_settings
+
+HEADER = 'Idempotency-Key'
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# response headers kept for the replay
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'ETag')
+
+
+class Replay(Exception):
+    """carries the stored response of an already handled key"""
+
+    def __init__(self, response):
+        self.response = response
+
+
+class KeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = _('A request with this Idempotency-Key is still in progress.')
+    default_code = 'idempotency_key_in_use'
+
+
+class KeyMismatch(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = _('This Idempotency-Key was used for a different request.')
+    default_code = 'idempotency_key_mismatch'
+
+
+def fingerprint(request):
+    """hash of what the request asks for, stable across retries."""
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    data = request.data
+    if hasattr(data, 'lists'):
+        fields = {name: values for name, values in data.lists() if name not in request.FILES}
+    else:
+        fields = data
+    digest.update(json.dumps(fields, sort_keys=True, default=str).encode())
+    # multipart boundaries change between retries, hash the files' content
+    for name in sorted(request.FILES):
+        for upload in request.FILES.getlist(name):
+            digest.update(name.encode())
+            for chunk in upload.chunks():
+                digest.update(chunk)
+            upload.seek(0)
+    return digest.hexdigest()
+
+
+def replay(record):
+    response = HttpResponse(record.body, status=record.status_code)
+    for name, value in record.headers.items():
+        response[name] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _set_lock_timeout(seconds):
+    # a duplicate waits on the first request's row at most this long
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            if seconds is None:
+                cursor.execute('SET LOCAL lock_timeout TO DEFAULT')
+            else:
+                cursor.execute('SET LOCAL lock_timeout = %s', [f'{int(seconds * 1000)}ms'])
+
+
+def claim(scope, key, request_fingerprint):
+    """
+    insert the key's row in the current transaction and return it, or
+    raise Replay with the response stored by an earlier request.
+    """
+    conf = idempotency_settings()
+    keys = IdempotencyKey.objects.using(DEFAULT_DB_ALIAS)
+    _set_lock_timeout(conf['LOCK_TIMEOUT'])
+    try:
+        for attempt in range(2):
+            now = timezone.now()
+            try:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    return keys.create(
+                        scope=scope, key=key, fingerprint=request_fingerprint,
+                        expires=now + conf['TTL'],
+                    )
+            except IntegrityError:
+                record = keys.get(scope=scope, key=key)
+            if record.expires > now:
+                break
+            # expired and not purged yet, the key is free
+            record.delete()
+    except OperationalError:
+        raise KeyInUse()
+    finally:
+        _set_lock_timeout(None)
+    if record.fingerprint != request_fingerprint:
+        raise KeyMismatch()
+    if record.status_code is None:
+        raise KeyInUse()
+    raise Replay(replay(record))
+
+
+def store(record, response):
+    """save the rendered response in the claimed row."""
+    body = response.content
+    if len(body) > idempotency_settings()['MAX_BODY_SIZE']:
+        body = b''
+    record.status_code = response.status_code
+    record.headers = {
+        name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)
+    }
+    record.body = body
+    record.save(update_fields=['status_code', 'headers', 'body'])
+
+
+class IdempotentMixin:
+    """
+    Honour the Idempotency-Key header on the view's writes, see
+    core/idempotency.py.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in UNSAFE_METHODS and request.headers.get(HEADER):
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                return super().dispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.idempotency_record = None
+        key = request.headers.get(HEADER)
+        if request.method not in UNSAFE_METHODS or not key:
+            return
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            raise ValidationError({HEADER: _('Keep the key under 256 characters.')})
+        user = request.user
+        scope = f'user:{user.pk}' if user and user.is_authenticated else 'anonymous'
+        self.idempotency_record = claim(scope, key, fingerprint(request))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        record = getattr(self, 'idempotency_record', None)
+        if record is not None and response.status_code < 500:
+            response.render()
+            store(record, response)
+        elif record is not None:
+            # roll back the claim with the write, a retry runs again
+            transaction.set_rollback(True, using=DEFAULT_DB_ALIAS)
+        return response
@@ -0,0 +1,247 @@
+"""
+Cache invalidation bus between worker processes.
+
+In-process caches (the per-user data versions in the local memory cache,
+the coverage indexes) only see the writes of their own process. Writes
+publish a compact `topic:key` message once their transaction commits, and
+every other process drops that key from its caches for the topic.
+
+With INVALIDATION['BACKEND'] = 'postgres' each process runs one thread
+holding one connection: it LISTENs on INVALIDATION['CHANNEL'] and sends
+the messages queued by the request threads as NOTIFYs, as many per
+notification as fit, so a burst of writes costs a few notifications. The
+messages received while the thread was busy are applied together, each
+topic's handler called once with the set of keys. A process ignores its
+own messages, it applied them when publishing. After reconnecting, every
+topic is resynced: anything could have been missed meanwhile.
+
+The 'local' backend is for a single process, where there's nobody to tell.
+
+Caches subscribe with `subscribe(topic, handler, resync)`, several of
+them can share a topic. The 'user' topic is for everything a process keeps
+about a user, published by `invalidate()` when their profile changes.
+"""
+import logging
+import os
+import select
+import threading
+import uuid
+from collections import deque
+
+import psycopg2
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must stay under 8000 bytes
+MAX_PAYLOAD = 7900
+
+_handlers = {}
+
+
+def invalidation_settings():
+    """return INVALIDATION settings merged with the defaults"""
+    defaults = {
+        'BACKEND': 'local',
+        'CHANNEL': 'cache_invalidation',
+        'POLL_TIMEOUT': 5,
+        'RECONNECT_DELAY': 1,
+    }
+    return {**defaults, **getattr(settings, 'INVALIDATION', {})}
+
+
+def subscribe(topic, handler, resync):
+    """
+    call handler(keys) with the keys other processes invalidated, and
+    resync() when some may have been missed.
+    """
+    _handlers.setdefault(topic, []).append((handler, resync))
+
+
+def apply(messages):
+    """run each topic's handler once for its keys."""
+    keys = {}
+    for message in messages:
+        topic, _, key = message.partition(':')
+        keys.setdefault(topic, set()).add(key)
+    for topic, topic_keys in keys.items():
+        for handler, _ in _handlers.get(topic, ()):
+            handler(topic_keys)
+
+
+def resync():
+    resyncs = {topic_resync for handlers in _handlers.values() for _, topic_resync in handlers}
+    for topic_resync in resyncs:
+        topic_resync()
+
+
+class LocalBus:
+    """bus of a single process, publishing goes nowhere."""
+
+    def __init__(self, conf):
+        self.conf = conf
+
+    def start(self):
+        pass
+
+    def send(self, messages):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PostgresBus(LocalBus):
+    """bus over LISTEN/NOTIFY, one thread and one connection per process."""
+
+    def __init__(self, conf):
+        super().__init__(conf)
+        self.origin = uuid.uuid4().hex[:12]
+        self.outbox = deque()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """start the process's thread, again in a forked child."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._wake_read, self._wake_write = os.pipe()
+            os.set_blocking(self._wake_read, False)
+            os.set_blocking(self._wake_write, False)
+            self._thread = threading.Thread(
+                target=self._run, name='cache-invalidation', daemon=True,
+            )
+            self._thread.start()
+
+    def send(self, messages):
+        self.start()
+        self.outbox.extend(messages)
+        self._wake()
+
+    def stop(self):
+        if self._pid == os.getpid():
+            self._stopping.set()
+            self._wake()
+            self._thread.join(timeout=5)
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+            self._pid = None
+
+    def _wake(self):
+        try:
+            os.write(self._wake_write, b'.')
+        except BlockingIOError:
+            # already woken
+            pass
+
+    def _connect(self):
+        params = connections[DEFAULT_DB_ALIAS].get_connection_params()
+        conn = psycopg2.connect(**params)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.conf["CHANNEL"]}"')
+        return conn
+
+    def _run(self):
+        connected_before = False
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                if connected_before:
+                    resync()
+                connected_before = True
+                self._serve(conn)
+            except psycopg2.Error as exc:
+                logger.warning('cache invalidation connection lost: %s', exc)
+                self._stopping.wait(self.conf['RECONNECT_DELAY'])
+            except Exception:
+                logger.exception('cache invalidation failed')
+                self._stopping.wait(self.conf['RECONNECT_DELAY'])
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _serve(self, conn):
+        while not self._stopping.is_set():
+            readable, _, _ = select.select(
+                [conn, self._wake_read], [], [], self.conf['POLL_TIMEOUT'],
+            )
+            if self._wake_read in readable:
+                try:
+                    while os.read(self._wake_read, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            self._flush(conn)
+            conn.poll()
+            received = []
+            while conn.notifies:
+                origin, _, payload = conn.notifies.pop(0).payload.partition(' ')
+                if origin != self.origin:
+                    received.extend(payload.split())
+            if received:
+                apply(received)
+
+    def _flush(self, conn):
+        """send the queued messages, as few notifications as fit them."""
+        messages = set()
+        while self.outbox:
+            messages.add(self.outbox.popleft())
+        payloads, payload = [], self.origin
+        for message in sorted(messages):
+            if len(payload) + len(message) + 1 > MAX_PAYLOAD:
+                payloads.append(payload)
+                payload = self.origin
+            payload = f'{payload} {message}'
+        if payload != self.origin:
+            payloads.append(payload)
+        try:
+            with conn.cursor() as cursor:
+                for payload in payloads:
+                    cursor.execute('SELECT pg_notify(%s, %s)', [self.conf['CHANNEL'], payload])
+        except psycopg2.Error:
+            # keep them for the next connection
+            self.outbox.extendleft(messages)
+            raise
+
+
+BACKENDS = {'local': LocalBus, 'postgres': PostgresBus}
+
+_bus = None
+
+
+def get_bus():
+    """return this process's bus."""
+    global _bus
+    if _bus is None:
+        conf = invalidation_settings()
+        _bus = BACKENDS[conf['BACKEND']](conf)
+    return _bus
+
+
+@receiver(setting_changed)
+def reset_bus(setting, **kwargs):
+    global _bus
+    if setting == 'INVALIDATION' and _bus is not None:
+        _bus.stop()
+        _bus = None
+
+
+def publish(topic, key):
+    """invalidate key of topic in the other processes once the transaction commits."""
+    message = f'{topic}:{key}'
+    transaction.on_commit(lambda: get_bus().send([message]))
+
+
+def invalidate(topic, key):
+    """invalidate key of topic in this process and the others once the transaction commits."""
+    transaction.on_commit(lambda: apply([f'{topic}:{key}']))
+    publish(topic, key)
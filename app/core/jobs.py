@@ -0,0 +1,348 @@
+"""
+Background jobs stored in the database.
+
+Functions registered with `@task` are queued with `enqueue` and run by
+`manage.py run_worker`. Workers claim jobs with SELECT ... FOR UPDATE SKIP
+LOCKED, highest priority and earliest run_at first, so any number of them
+can share the table without a broker. Because a job is a row, enqueueing
+inside a transaction only makes the job visible if the transaction commits.
+
+A failing job is retried with exponential backoff until max_attempts. While
+a worker runs jobs it renews their heartbeat_at every
+JOBS['HEARTBEAT_INTERVAL'] seconds, and a job whose heartbeat is older than
+JOBS['STALE_AFTER'] had its worker die and is queued again. Periodic
+tasks (`@periodic`) keep exactly one pending run, keyed 'periodic:<name>',
+which schedules the next one when it finishes.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (
+    DatabaseError, IntegrityError, connections, transaction,
+)
+from django.db.models import Avg, Count, F, Min, Q
+from django.utils import timezone
+
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+_tasks = {}
+_periodic = {}
+
+
+class Task:
+    def __init__(self, func, name, priority, max_attempts):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def enqueue(self, **kwargs):
+        return enqueue(self.name, **kwargs)
+
+
+def job_settings():
+    conf = {
+        'CONCURRENCY': 2,
+        'MODE': 'threads',
+        'POLL_INTERVAL': 1.0,
+        'BACKOFF_BASE': 10,
+        'BACKOFF_MAX': 3600,
+        'STALE_AFTER': timedelta(minutes=10),
+        'HEARTBEAT_INTERVAL': 60,
+        'KEEP_FINISHED': timedelta(days=7),
+    }
+    conf.update(getattr(settings, 'JOBS', {}))
+    return conf
+
+
+def task(name=None, priority=0, max_attempts=5):
+    """register a function as a job task, called with the job's kwargs."""
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        _tasks[task_name] = Task(func, task_name, priority, max_attempts)
+        return _tasks[task_name]
+    return register
+
+
+def periodic(every, name=None, priority=0, max_attempts=1):
+    """register a task that runs every `every` (a timedelta)."""
+    def register(func):
+        registered = task(name, priority, max_attempts)(func)
+        _periodic[registered.name] = every
+        return registered
+    return register
+
+
+def get_task(name):
+    return _tasks[name]
+
+
+def enqueue(name, kwargs=None, priority=None, run_at=None, delay=None, key=None):
+    """
+    Queue a run of the named task and return its Job. With a key, an
+    already pending job with that key is returned instead.
+    """
+    registered = get_task(name)
+    if run_at is None:
+        run_at = timezone.now() + (delay or timedelta())
+    job = Job(
+        name=name,
+        kwargs=kwargs or {},
+        key=key,
+        priority=registered.priority if priority is None else priority,
+        max_attempts=registered.max_attempts,
+        run_at=run_at,
+    )
+    if key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+        return job
+    except IntegrityError:
+        return Job.objects.get(key=key, status__in=[Job.QUEUED, Job.RUNNING])
+
+
+def schedule_periodic():
+    """make sure every periodic task has a pending run."""
+    for name in _periodic:
+        enqueue(name, key=f'periodic:{name}')
+
+
+def claim(worker, limit=1):
+    """lock and mark running the next due jobs."""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_at__lte=now)
+            .order_by('-priority', 'run_at', 'id')[:limit]
+        )
+        if not jobs:
+            return []
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.RUNNING, locked_by=worker, started_at=now, heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+    for job in jobs:
+        job.status, job.locked_by, job.started_at, job.heartbeat_at = (
+            Job.RUNNING, worker, now, now,
+        )
+        job.attempts += 1
+    return jobs
+
+
+def backoff(attempts):
+    """seconds to wait before retry number `attempts`, with jitter."""
+    conf = job_settings()
+    delay = min(conf['BACKOFF_MAX'], conf['BACKOFF_BASE'] * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run(job):
+    """run a claimed job and record the outcome."""
+    fields = {'finished_at': None, 'locked_by': ''}
+    try:
+        get_task(job.name)(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('job %s failed (attempt %s/%s)', job, job.attempts, job.max_attempts)
+        fields['last_error'] = error
+        if job.attempts < job.max_attempts and job.name in _tasks:
+            fields['status'] = Job.QUEUED
+            fields['run_at'] = timezone.now() + timedelta(seconds=backoff(job.attempts))
+        else:
+            fields['status'] = Job.FAILED
+            fields['finished_at'] = timezone.now()
+    else:
+        fields['status'] = Job.DONE
+        fields['finished_at'] = timezone.now()
+
+    with transaction.atomic():
+        Job.objects.filter(pk=job.pk).update(**fields)
+        for name, value in fields.items():
+            setattr(job, name, value)
+        if job.name in _periodic and job.status != Job.QUEUED:
+            enqueue(job.name, run_at=job.started_at + _periodic[job.name], key=job.key)
+    return job
+
+
+def release_connections(close=False):
+    """close broken or too old connections, or all of them, like a request end."""
+    for connection in connections.all():
+        if connection.in_atomic_block:
+            continue
+        if close:
+            connection.close()
+        else:
+            connection.close_if_unusable_or_obsolete()
+
+
+def recover_stale():
+    """queue again the jobs whose worker stopped while running them."""
+    cutoff = timezone.now() - job_settings()['STALE_AFTER']
+    stale = Job.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status=Job.RUNNING,
+    )
+    retry = stale.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.QUEUED, locked_by='', last_error='worker lost',
+    )
+    failed = stale.update(
+        status=Job.FAILED, locked_by='', last_error='worker lost',
+        finished_at=timezone.now(),
+    )
+    return retry + failed
+
+
+def purge_finished(batch_size=1000):
+    """delete done and failed jobs older than KEEP_FINISHED."""
+    cutoff = timezone.now() - job_settings()['KEEP_FINISHED']
+    finished = Job.objects.filter(status__in=[Job.DONE, Job.FAILED], finished_at__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(finished.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Job.objects.filter(pk__in=ids).delete()[0]
+
+
+def metrics():
+    """queue depth, lag and per task outcomes."""
+    now = timezone.now()
+    counts = dict(
+        Job.objects.values_list('status').annotate(total=Count('id')).order_by()
+    )
+    oldest = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).aggregate(
+        oldest=Min('run_at'))['oldest']
+    per_task = {}
+    rows = (
+        Job.objects.values('name')
+        .annotate(
+            done=Count('id', filter=Q(status=Job.DONE)),
+            failed=Count('id', filter=Q(status=Job.FAILED)),
+            retried=Count('id', filter=Q(attempts__gt=1)),
+            avg_seconds=Avg(F('finished_at') - F('started_at'), filter=Q(status=Job.DONE)),
+        )
+        .order_by('name')
+    )
+    for row in rows:
+        name, avg = row.pop('name'), row['avg_seconds']
+        per_task[name] = {
+            **row,
+            'avg_seconds': round(avg.total_seconds(), 3) if avg is not None else None,
+        }
+    return {
+        **{status: counts.get(status, 0) for status, _ in Job.STATUS_CHOICES},
+        'lag_seconds': round((now - oldest).total_seconds(), 3) if oldest else 0,
+        'tasks': per_task,
+    }
+
+
+class Worker:
+    """claims and runs jobs on `concurrency` threads until stopped."""
+
+    def __init__(self, concurrency=1, poll_interval=None, name=None):
+        conf = job_settings()
+        self.concurrency = concurrency
+        self.poll_interval = conf['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self.heartbeat_interval = conf['HEARTBEAT_INTERVAL']
+        self.processed = 0
+        self.running = set()
+        self._count_lock = threading.Lock()
+        self._active = 0
+        self._finished = threading.Event()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def maintain(self):
+        recover_stale()
+        schedule_periodic()
+
+    def run_once(self, worker):
+        """run one due job, False when there was none."""
+        release_connections()
+        jobs = claim(worker)
+        for job in jobs:
+            with self._count_lock:
+                self.running.add(job.pk)
+            try:
+                run(job)
+            finally:
+                with self._count_lock:
+                    self.running.discard(job.pk)
+                    self.processed += 1
+        return bool(jobs)
+
+    def beat(self):
+        """renew the heartbeat of the jobs running on this worker."""
+        with self._count_lock:
+            running = list(self.running)
+        if running:
+            Job.objects.filter(
+                pk__in=running, status=Job.RUNNING, locked_by__startswith=f'{self.name}/',
+            ).update(heartbeat_at=timezone.now())
+
+    def _heartbeat(self):
+        # until the last loop exits, a stopping worker still finishes its jobs
+        while not self._finished.wait(self.heartbeat_interval):
+            try:
+                self.beat()
+                release_connections()
+            except DatabaseError:
+                logger.exception('worker %s could not renew its heartbeat', self.name)
+                release_connections(close=True)
+        release_connections(close=True)
+
+    def _loop(self, index, burst):
+        worker = f'{self.name}/{index}'
+        next_maintenance = 0
+        while not self.stopping.is_set():
+            try:
+                if index == 0 and time.monotonic() >= next_maintenance:
+                    self.maintain()
+                    next_maintenance = time.monotonic() + 30 * self.poll_interval
+                if not self.run_once(worker):
+                    if burst:
+                        break
+                    self.stopping.wait(self.poll_interval)
+            except DatabaseError:
+                logger.exception('worker %s lost the database', worker)
+                release_connections(close=True)
+                self.stopping.wait(self.poll_interval)
+        release_connections(close=True)
+        with self._count_lock:
+            self._active -= 1
+            if not self._active:
+                self._finished.set()
+
+    def run(self, burst=False):
+        """work until stop(), or until the queue is empty with burst."""
+        threads = [
+            threading.Thread(target=self._loop, args=(index, burst), name=f'job-worker-{index}')
+            for index in range(self.concurrency)
+        ]
+        self._active = self.concurrency
+        self._finished.clear()
+        threads.append(threading.Thread(target=self._heartbeat, name='job-heartbeat'))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.processed
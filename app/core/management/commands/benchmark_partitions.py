@@ -0,0 +1,133 @@
+import random
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core import partitioning
+from core.models import Recipe
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare per-user recipe query latency before and after hash '
+        'partitioning on synthetic data. Everything, including the '
+        'conversion, is rolled back; the recipe tables stay locked while it '
+        'runs, so use a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes-per-user', type=int, default=200)
+        parser.add_argument('--partitions', type=int, default=16)
+        parser.add_argument('--queries', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL.')
+        if partitioning.is_partitioned(connection, partitioning.RECIPE_TABLE):
+            raise CommandError('The recipe tables are already partitioned.')
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                users = self._synthetic_data(options['users'], options['recipes_per_user'])
+                sample = [random.choice(users) for _ in range(options['queries'])]
+                plain = self._benchmark(sample)
+                start = time.perf_counter()
+                partitioning.partition(
+                    connection, options['partitions'], batch_size=100000, log=lambda line: None,
+                )
+                self.stdout.write(f'Partitioned in {time.perf_counter() - start:.1f}s')
+                self._analyze()
+                partitioned = self._benchmark(sample)
+                self._report(plain, partitioned)
+                self.stdout.write('Plan: ' + self._plan(sample[0]))
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def _synthetic_data(self, users, per_user):
+        tag = f'benchmark-{time.time_ns()}'
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO core_user (password, is_superuser, email, name, is_active, is_staff)
+                SELECT '!', false, %s || '-' || g || '@example.com', '', true, false
+                FROM generate_series(1, %s) g RETURNING id
+            """, [tag, users])
+            user_ids = [row[0] for row in cursor.fetchall()]
+            # interleave users like recipes written over time would be
+            cursor.execute("""
+                INSERT INTO core_recipe (user_id, title, time_minutes, price, description, link, image)
+                SELECT u, 'recipe ' || g, 1 + (random() * 120)::int,
+                       round((random() * 50)::numeric, 2), '', '', ''
+                FROM generate_series(1, %s) g, unnest(%s::int[]) u
+                ORDER BY g, u
+            """, [per_user, user_ids])
+            cursor.execute("""
+                INSERT INTO core_ingredient (user_id, name, recipe_count)
+                SELECT u, 'ingredient ' || g, 0
+                FROM generate_series(1, 20) g, unnest(%s::int[]) u
+            """, [user_ids])
+            cursor.execute("""
+                INSERT INTO core_recipe_ingredients (recipe_id, ingredient_id)
+                SELECT r.id, i.id
+                FROM core_recipe r JOIN core_ingredient i ON i.user_id = r.user_id
+                WHERE r.user_id = ANY(%s) AND random() < 0.25
+            """, [user_ids])
+        self._analyze()
+        self.stdout.write(
+            f'Generated {users * per_user} recipes for {users} users '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
+        return user_ids
+
+    def _analyze(self):
+        with connection.cursor() as cursor:
+            for table, _ in partitioning.TABLES:
+                cursor.execute(f'ANALYZE {table}')
+
+    def _queries(self, user_id):
+        through = Recipe.ingredients.through
+        return {
+            'latest': lambda: list(Recipe.objects.filter(user_id=user_id).order_by('-id')[:20]),
+            'cheapest': lambda: list(
+                Recipe.objects.filter(user_id=user_id, time_minutes__lte=30)
+                .order_by('price', 'time_minutes', 'id')[:20]
+            ),
+            'links': lambda: list(
+                through.objects.filter(recipe__user_id=user_id)
+                .values_list('recipe_id', 'ingredient_id')
+            ),
+        }
+
+    def _benchmark(self, sample):
+        timings = {}
+        for user_id in sample:
+            for name, query in self._queries(user_id).items():
+                start = time.perf_counter()
+                query()
+                timings.setdefault(name, []).append(time.perf_counter() - start)
+        return timings
+
+    def _report(self, plain, partitioned):
+        def ms(values):
+            values = sorted(values)
+            p95 = values[int(len(values) * 0.95) - 1]
+            return f'p50 {statistics.median(values) * 1000:6.2f}ms  p95 {p95 * 1000:6.2f}ms'
+
+        for name in plain:
+            self.stdout.write(f'{name:9} plain       {ms(plain[name])}')
+            self.stdout.write(f'{"":9} partitioned {ms(partitioned[name])}')
+
+    def _plan(self, user_id):
+        plan = Recipe.objects.filter(user_id=user_id).order_by('-id')[:20].explain()
+        scanned = sorted(set(re.findall(r'\bcore_recipe_p\d+\b', plan)))
+        return f'{len(scanned)} partition(s) scanned: {", ".join(scanned)}'
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from core.routers import replica_lag, replica_settings
+
+
+class Command(BaseCommand):
+    help = 'Report the replication lag of each read replica'
+
+    def handle(self, *args, **options):
+        conf = replica_settings()
+        if not conf['ALIASES']:
+            self.stdout.write('No replicas configured.')
+            return
+        unhealthy = 0
+        for alias in conf['ALIASES']:
+            try:
+                lag = replica_lag(alias)
+            except DatabaseError as exc:
+                unhealthy += 1
+                self.stdout.write(self.style.ERROR(f'{alias}: unavailable ({exc})'))
+                continue
+            if lag > conf['MAX_LAG_SECONDS']:
+                unhealthy += 1
+                self.stdout.write(self.style.WARNING(f'{alias}: {lag:.1f}s behind'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{alias}: {lag:.1f}s behind'))
+        if unhealthy:
+            raise CommandError(f'{unhealthy} replica(s) out of rotation.')
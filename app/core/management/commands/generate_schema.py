@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core import schema
+
+
+class Command(BaseCommand):
+    help = 'Render and store the OpenAPI schema for the current code version'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Keep the schemas stored for other code versions',
+        )
+
+    def handle(self, *args, **options):
+        version = schema.code_version()
+        documents = schema.generate(version)
+        sizes = ', '.join(
+            f'{fmt} {len(doc.body)} bytes ({len(doc.gzipped)} gzipped)'
+            for fmt, doc in documents.items()
+        )
+        self.stdout.write(f'Schema {version}: {sizes}')
+        if not options['keep_old']:
+            removed = schema.clean(version)
+            if removed:
+                self.stdout.write(f'Removed {removed} old schema files')
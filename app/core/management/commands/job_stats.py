@@ -0,0 +1,12 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = 'Print background job queue metrics as JSON'
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(jobs.metrics(), indent=2))
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core import partitioning
+
+
+class Command(BaseCommand):
+    help = 'Hash partition the recipe tables by user online, or undo it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions', type=int, default=settings.RECIPE_PARTITIONS or 16,
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.RECIPE_PARTITION_BATCH_SIZE,
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='seconds to sleep between batches',
+        )
+        parser.add_argument(
+            '--undo', action='store_true',
+            help='convert the tables back to plain tables',
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL.')
+        if options['undo']:
+            partitioning.unpartition(
+                connection, batch_size=options['batch_size'],
+                pause=options['pause'], log=self.stdout.write,
+            )
+        else:
+            partitioning.partition(
+                connection, options['partitions'], batch_size=options['batch_size'],
+                pause=options['pause'], log=self.stdout.write,
+            )
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.models import AuthToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired auth tokens in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='seconds to sleep between batches',
+        )
+
+    def handle(self, *args, **options):
+        deleted = AuthToken.objects.purge_expired(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired tokens.'))
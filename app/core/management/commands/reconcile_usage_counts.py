@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute user, tag and ingredient recipe counts and repair any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for field in ('tags', 'ingredients'):
+            fixed = counters.reconcile(field, batch_size=options['batch_size'])
+            self.stdout.write(f'{field}: repaired {fixed} counts')
+        fixed = counters.reconcile_recipe_counts(batch_size=options['batch_size'])
+        self.stdout.write(f'users: repaired {fixed} counts')
+        self.stdout.write(self.style.SUCCESS('Usage counts reconciled.'))
@@ -0,0 +1,68 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.jobs import Worker, job_settings
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        conf = job_settings()
+        parser.add_argument('--concurrency', type=int, default=conf['CONCURRENCY'])
+        parser.add_argument(
+            '--mode', choices=['threads', 'processes'], default=conf['MODE'],
+            help='run jobs on threads of this process or on child processes',
+        )
+        parser.add_argument('--poll-interval', type=float, default=conf['POLL_INTERVAL'])
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='exit once no job is due instead of waiting for more',
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('concurrency must be at least 1.')
+        if options['mode'] == 'processes' and options['concurrency'] > 1:
+            processed = self._run_processes(options)
+        else:
+            processed = self._run_worker(options['concurrency'], options)
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs.'))
+
+    def _run_worker(self, concurrency, options):
+        worker = Worker(concurrency, options['poll_interval'])
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        self.stdout.write(f'Worker {worker.name} running {concurrency} thread(s).')
+        return worker.run(burst=options['burst'])
+
+    def _run_processes(self, options):
+        # children must not share the parent's database sockets
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.SimpleQueue()
+        children = [
+            context.Process(target=self._child, args=(options, results))
+            for _ in range(options['concurrency'])
+        ]
+        for child in children:
+            child.start()
+
+        def stop(*args):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for child in children:
+            child.join()
+        processed = 0
+        while not results.empty():
+            processed += results.get()
+        return processed
+
+    def _child(self, options, results):
+        results.put(self._run_worker(1, options))
@@ -0,0 +1,147 @@
+"""
+Serving uploaded media.
+
+Media URLs carry an expiry and an HMAC of the file name and expiry, added
+by `SignedMediaStorage.url`, so the API hands a recipe's image URL only to
+users allowed to see the recipe and the media view checks access with no
+database query. Expiries are rounded up to SIGNED_URL_TTL buckets, so a
+file keeps the same URL for a while and stays cacheable.
+
+MEDIA_SERVING['BACKEND'] picks who sends the bytes:
+  python      the file is streamed by the app server; gunicorn passes it to
+              sendfile(), ranges included
+  x-accel     nginx, through an internal location:
+                  location /protected-media/ { internal; alias /vol/web/media/; }
+  x-sendfile  Apache mod_xsendfile or lighttpd, with the absolute path
+The proxies answer Range and conditional requests themselves; with python
+the view does.
+"""
+import os
+import re
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import parse_http_date_safe
+
+SALT = 'core.media'
+
+range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_settings():
+    conf = {
+        'BACKEND': 'python',
+        'INTERNAL_PREFIX': '/protected-media/',
+        'SIGNED': True,
+        'SIGNED_URL_TTL': 6 * 3600,
+        'IMMUTABLE_PATTERN': r'^uploads/',
+    }
+    conf.update(getattr(settings, 'MEDIA_SERVING', {}))
+    return conf
+
+
+def signature(name, expires):
+    value = f'{name}\n{expires}'
+    return salted_hmac(SALT, value, algorithm='sha256').hexdigest()[:32]
+
+
+def signed_query(name, now=None):
+    """query string granting access to the file until the end of the next bucket."""
+    ttl = media_settings()['SIGNED_URL_TTL']
+    now = int(time.time() if now is None else now)
+    expires = (now // ttl + 2) * ttl
+    return urlencode({'e': expires, 's': signature(name, expires)})
+
+
+def check_signature(name, expires, sig, now=None):
+    """seconds the signed URL stays valid, None if it is invalid or expired."""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return None
+    remaining = expires - int(time.time() if now is None else now)
+    if remaining <= 0 or not constant_time_compare(signature(name, expires), sig or ''):
+        return None
+    return remaining
+
+
+class SignedMediaStorage(FileSystemStorage):
+    """file system storage whose URLs carry an access signature."""
+
+    def url(self, name):
+        url = super().url(name)
+        if url is None or not media_settings()['SIGNED']:
+            return url
+        return f'{url}?{signed_query(name.replace(os.sep, "/"))}'
+
+
+def is_immutable(name):
+    """uploads get a fresh uuid name each time, their content never changes."""
+    return re.search(media_settings()['IMMUTABLE_PATTERN'], name) is not None
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single byte range, None to send the whole
+    file, or False when the range can't be satisfied.
+    """
+    match = range_re.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        # multiple or malformed ranges, the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(header, etag, last_modified):
+    """whether the partial response may be sent for an If-Range header."""
+    if not header:
+        return True
+    if header.startswith('"'):
+        return header == etag
+    return parse_http_date_safe(header) == int(last_modified)
+
+
+class FileRange:
+    """
+    a file positioned at a range start that reads no further than its end,
+    still exposing fileno() so the server can sendfile() it
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # used by socket.sendfile() to leave the file where it found it
+        return self.file.seek(offset, whence)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,69 @@
+"""
+Middleware for the API.
+"""
+import hashlib
+import time
+
+from django.core import signing
+from core.models import ReplicaPin
+from core.routers import replica_settings, use_primary
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'db_pin'
+PIN_SALT = 'core.middleware.pin'
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pin a client to the primary database for PIN_SECONDS after it writes.
+
+    Clients are told apart by their Authorization header, then the session
+    cookie, then their address, which covers both the token and the session
+    API clients before authentication has run. The pin's deadline goes back
+    to the client in a signed cookie, so it holds on whichever worker serves
+    the next request without a lookup. Clients that drop cookies, such as
+    most token clients, find it in the ReplicaPin table on the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def pin_key(request):
+        identity = (
+            request.META.get('HTTP_AUTHORIZATION')
+            or request.COOKIES.get('sessionid')
+            or request.META.get('REMOTE_ADDR', '')
+        )
+        return 'db-pin:' + hashlib.sha1(identity.encode()).hexdigest()
+
+    def __call__(self, request):
+        conf = replica_settings()
+        if not conf['ALIASES']:
+            return self.get_response(request)
+
+        key = self.pin_key(request)
+        writing = request.method not in SAFE_METHODS
+        pinned = writing or self.pinned_until(request, key) > time.time()
+        with use_primary(pinned):
+            response = self.get_response(request)
+        if writing and response.status_code < 500:
+            deadline = time.time() + conf['PIN_SECONDS']
+            ReplicaPin.objects.pin(key, deadline)
+            response.set_signed_cookie(
+                PIN_COOKIE, f'{key}:{deadline}', salt=PIN_SALT,
+                max_age=conf['PIN_SECONDS'], httponly=True, samesite='Lax',
+            )
+        return response
+
+    @staticmethod
+    def pinned_until(request, key):
+        """the client's pin deadline from its cookie or the primary, 0 without one."""
+        try:
+            value = request.get_signed_cookie(PIN_COOKIE, salt=PIN_SALT)
+            cookie_key, _, deadline = value.rpartition(':')
+            if cookie_key == key:
+                return float(deadline)
+        except (KeyError, signing.BadSignature, ValueError):
+            pass
+        return ReplicaPin.objects.until(key)
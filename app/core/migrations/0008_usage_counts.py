@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:36
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_counts(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    for field, model_name in (('tags', 'Tag'), ('ingredients', 'Ingredient')):
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field).through
+        column = Recipe._meta.get_field(field).m2m_reverse_name()
+        counts = through.objects.values(column).annotate(total=Count('*'))
+        for row in counts.iterator():
+            model.objects.filter(pk=row[column]).update(recipe_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_authtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(('recipe_count__gt', 0)), fields=['user', 'name'], name='ingredient_assigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(condition=models.Q(('recipe_count__gt', 0)), fields=['user', 'name'], name='tag_assigned_idx'),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import migrations
+
+from core import partitioning
+
+
+def partition_recipes(apps, schema_editor):
+    partitions = getattr(settings, 'RECIPE_PARTITIONS', 0)
+    if schema_editor.connection.vendor != 'postgresql' or not partitions:
+        return
+    partitioning.partition(
+        schema_editor.connection, partitions,
+        batch_size=settings.RECIPE_PARTITION_BATCH_SIZE,
+    )
+
+
+def unpartition_recipes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    partitioning.unpartition(
+        schema_editor.connection, batch_size=settings.RECIPE_PARTITION_BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+    # every copy batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('core', '0011_recipe_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_recipes, unpartition_recipes, atomic=False),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# the admin's ^field search compiles to UPPER(column) LIKE 'TERM%'
+INDEXES = (
+    ('core_user', 'email'),
+    ('core_recipe', 'title'),
+    ('core_tag', 'name'),
+    ('core_ingredient', 'name'),
+)
+
+
+def create_admin_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_{column}_upper_idx '
+            f'ON {table} (upper({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_admin_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_upper_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_admin_indexes, drop_admin_indexes),
+    ]
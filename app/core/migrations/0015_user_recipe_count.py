@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:03
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_recipe_counts(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    User = apps.get_model('core', 'User')
+    counts = Recipe.objects.values('user').annotate(total=Count('*')).order_by()
+    for row in counts.iterator():
+        User.objects.filter(pk=row['user']).update(recipe_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_recipe_counts, migrations.RunPython.noop),
+    ]
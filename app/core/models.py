@@ -3,14 +3,20 @@ from django.conf import settings
 """
 Database models.
 """
+import binascii
 import uuid
 import os
+import time
+from datetime import timedelta
 
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, models
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser, BaseUserManager, PermissionsMixin
 )
 
+from core import hashing
+
 
 def recipe_image_file_path(instance, filename):
     """generates the file path for a new recipe image"""
@@ -19,6 +25,22 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('uploads/recipe/', filename)
 
 
+def generate_token_key():
+    """generates a random key for a new auth token"""
+    return binascii.hexlify(os.urandom(20)).decode()
+
+
+def token_settings():
+    """return AUTH_TOKEN settings merged with the defaults"""
+    defaults = {
+        'TTL': timedelta(days=7),
+        'SLIDING': True,
+        'RENEW_AFTER': timedelta(hours=1),
+        'PURGE_BATCH_SIZE': 1000,
+    }
+    return {**defaults, **getattr(settings, 'AUTH_TOKEN', {})}
+
+
 class UserManager(BaseUserManager):
     """manager for users"""
 
@@ -48,9 +70,43 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    recipe_count = models.PositiveIntegerField(default=0)
     objects = UserManager()
     USERNAME_FIELD = 'email'
 
+    def set_password(self, raw_password):
+        """hash the password in the shared hashing pool."""
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """verify in the hashing pool and upgrade old hashes in the background."""
+        is_correct, must_update = hashing.verify_password(raw_password, self.password)
+        if is_correct and must_update:
+            hashing.schedule_rehash(self, raw_password)
+        return is_correct
+
+
+class StaleVersion(DatabaseError):
+    """the recipe's stored version isn't the one the write expected"""
+
+
+class RecipeManager(models.Manager):
+    """manager for recipes"""
+
+    def bump_versions(self, ids, expected=None):
+        """
+        bump the recipes' versions in one UPDATE. With expected, only a
+        recipe still at that version is bumped, StaleVersion otherwise.
+        """
+        queryset = self.filter(pk__in=ids)
+        if expected is None:
+            return queryset.update(version=models.F('version') + 1)
+        updated = queryset.filter(version=expected).update(version=expected + 1)
+        if updated < len(ids):
+            raise StaleVersion()
+        return updated
+
 
 class Recipe(models.Model):
     """Recipe object"""
@@ -66,10 +122,46 @@ class Recipe(models.Model):
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # bumped by every API write, compared with If-Match to refuse lost updates
+    version = models.PositiveIntegerField(default=1)
+    objects = RecipeManager()
+
+    class Meta:
+        # one index per supported list ordering, see recipe.views.RECIPE_ORDERINGS
+        indexes = [
+            models.Index(fields=['user', 'id'], name='recipe_user_id_idx'),
+            models.Index(fields=['user', 'price', 'time_minutes', 'id'], name='recipe_user_price_idx'),
+            models.Index(fields=['user', 'time_minutes', 'price', 'id'], name='recipe_user_time_idx'),
+            models.Index(fields=['user', 'title', 'id'], name='recipe_user_title_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save_versioned(self, update_fields, expected=None):
+        """
+        save update_fields and bump the version in the same UPDATE. With
+        expected, the UPDATE only matches the row while its version is
+        still that, and StaleVersion is raised when it doesn't.
+        """
+        if expected is None:
+            self.version = models.F('version') + 1
+        else:
+            self.version = expected + 1
+            self._expected_version = expected
+        self.save(update_fields=[*update_fields, 'version'])
+        if expected is None:
+            self.refresh_from_db(fields=['version'])
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = self.__dict__.pop('_expected_version', None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        base_qs = base_qs.filter(version=expected)
+        if not super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update):
+            raise StaleVersion()
+        return True
+
 
 class Tag(models.Model):
     """Tag for filtering recipes"""
@@ -78,6 +170,16 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'name'],
+                condition=models.Q(recipe_count__gt=0),
+                name='tag_assigned_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -89,6 +191,311 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'name'],
+                condition=models.Q(recipe_count__gt=0),
+                name='ingredient_assigned_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class AuthTokenManager(models.Manager):
+    """manager for auth tokens"""
+
+    def issue(self, user, device=''):
+        """return a live token for the user's device, rotating an expired one."""
+        now = timezone.now()
+        expires = now + token_settings()['TTL']
+        token, created = self.get_or_create(
+            user=user, device=device,
+            defaults={'key': generate_token_key(), 'expires': expires},
+        )
+        if not created:
+            if token.expires <= now:
+                token.key = generate_token_key()
+            token.expires = expires
+            token.save(update_fields=['key', 'expires'])
+        return token
+
+    def purge_expired(self, batch_size=None, pause=0):
+        """delete expired tokens in short batches, return the number deleted."""
+        batch_size = batch_size or token_settings()['PURGE_BATCH_SIZE']
+        deleted = 0
+        while True:
+            ids = list(
+                self.filter(expires__lte=timezone.now())
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return deleted
+            deleted += self.filter(pk__in=ids).delete()[0]
+            if pause:
+                time.sleep(pause)
+
+
+class AuthToken(models.Model):
+    """Expiring auth token, one per user and device"""
+    key = models.CharField(max_length=40, unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='auth_tokens',
+        on_delete=models.CASCADE,
+    )
+    device = models.CharField(max_length=64, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True)
+    objects = AuthTokenManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device'], name='unique_token_per_device'),
+        ]
+
+    def __str__(self):
+        return self.key
+
+    def is_expired(self, now=None):
+        return self.expires <= (now or timezone.now())
+
+    def renew(self, now=None):
+        """slide the expiry forward, at most once per RENEW_AFTER"""
+        conf = token_settings()
+        now = now or timezone.now()
+        expires = now + conf['TTL']
+        if expires - self.expires < conf['RENEW_AFTER']:
+            return False
+        AuthToken.objects.filter(pk=self.pk).update(expires=expires)
+        self.expires = expires
+        return True
+
+
+def idempotency_settings():
+    """return IDEMPOTENCY settings merged with the defaults"""
+    defaults = {
+        'TTL': timedelta(hours=24),
+        'LOCK_TIMEOUT': 10,
+        'MAX_BODY_SIZE': 64 * 1024,
+        'PURGE_BATCH_SIZE': 1000,
+    }
+    return {**defaults, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+class IdempotencyKeyManager(models.Manager):
+    """manager for idempotency keys"""
+
+    def purge_expired(self, batch_size=None):
+        """delete expired keys in short batches, return the number deleted."""
+        batch_size = batch_size or idempotency_settings()['PURGE_BATCH_SIZE']
+        deleted = 0
+        while True:
+            ids = list(
+                self.filter(expires__lte=timezone.now())
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return deleted
+            deleted += self.filter(pk__in=ids).delete()[0]
+
+
+class IdempotencyKey(models.Model):
+    """the response to a write sent with an Idempotency-Key header"""
+    scope = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    headers = models.JSONField(default=dict)
+    body = models.BinaryField(default=bytes)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True)
+    objects = IdempotencyKeyManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.scope}:{self.key}'
+
+
+class RecipeSignature(models.Model):
+    """MinHash signature of a recipe's tag and ingredient set"""
+    recipe = models.OneToOneField(
+        Recipe,
+        primary_key=True,
+        related_name='signature',
+        on_delete=models.CASCADE,
+    )
+    minhash = models.BinaryField()
+
+
+class RecipeBucket(models.Model):
+    """LSH band bucket a recipe's signature falls into"""
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='buckets',
+        on_delete=models.CASCADE,
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'bucket'], name='recipe_bucket_lookup_idx'),
+        ]
+
+
+class Job(models.Model):
+    """a unit of background work, see core/jobs.py"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    key = models.CharField(max_length=100, null=True, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # renewed by the worker while it runs the job, see jobs.recover_stale
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # claim order of the queued jobs, see jobs.claim
+            models.Index(
+                fields=['-priority', 'run_at', 'id'],
+                condition=models.Q(status='queued'),
+                name='job_queue_idx',
+            ),
+            models.Index(fields=['status', 'finished_at'], name='job_status_idx'),
+        ]
+        constraints = [
+            # one pending run per key, e.g. per periodic job
+            models.UniqueConstraint(
+                fields=['key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_pending_job_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+
+def changes_settings():
+    """return CHANGES settings merged with the defaults"""
+    defaults = {
+        'RETENTION': timedelta(days=30),
+        'PAGE_SIZE': 500,
+        'MAX_PAGE_SIZE': 2000,
+        'COMPACT_BATCH_SIZE': 1000,
+    }
+    return {**defaults, **getattr(settings, 'CHANGES', {})}
+
+
+class ChangeLog(models.Model):
+    """
+    a user's change log position: the last sequence number handed out and
+    the floor below which entries were compacted away
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        primary_key=True,
+        on_delete=models.CASCADE,
+    )
+    seq = models.BigIntegerField(default=0)
+    floor = models.BigIntegerField(default=0)
+
+
+class Change(models.Model):
+    """an entry of a user's change log, see core/changes.py"""
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    RECIPE_TAG = 'recipe_tag'
+    RECIPE_INGREDIENT = 'recipe_ingredient'
+    KINDS = [
+        (RECIPE, 'recipe'),
+        (TAG, 'tag'),
+        (INGREDIENT, 'ingredient'),
+        (RECIPE_TAG, 'recipe tag link'),
+        (RECIPE_INGREDIENT, 'recipe ingredient link'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=32, choices=KINDS)
+    object_id = models.BigIntegerField()
+    # the tag or ingredient of a link, 0 otherwise
+    target_id = models.BigIntegerField(default=0)
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='unique_change_seq'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'kind', 'object_id', 'target_id'], name='change_object_idx',
+            ),
+        ]
+
+
+class ReplicaPinManager(models.Manager):
+    """manager for replica pins, kept on the primary"""
+
+    def pin(self, key, until):
+        """pin key to the primary until the given time."""
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (key, until) VALUES (%s, %s) '
+                f'ON CONFLICT (key) DO UPDATE SET until = excluded.until',
+                [key, until],
+            )
+
+    def until(self, key):
+        """the time key is pinned until, 0 when it isn't."""
+        return self.using(DEFAULT_DB_ALIAS).filter(key=key).values_list(
+            'until', flat=True,
+        ).first() or 0
+
+    def purge_expired(self):
+        return self.filter(until__lt=time.time()).delete()[0]
+
+
+class ReplicaPin(models.Model):
+    """a client reading from the primary after a write, see core/middleware.py"""
+    key = models.CharField(max_length=64, primary_key=True)
+    until = models.FloatField()
+    objects = ReplicaPinManager()
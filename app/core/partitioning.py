@@ -0,0 +1,217 @@
+"""
+Optional hash partitioning of the recipe tables in PostgreSQL.
+
+core_recipe is partitioned on user_id, so every per-user query is pruned
+to one partition. The recipe/tag and recipe/ingredient through tables are
+partitioned on recipe_id: Django's m2m inserts only carry recipe_id and
+tag_id/ingredient_id, and a partition key can't be filled in by a trigger,
+so recipe_id is the closest key that keeps a recipe's links together.
+
+A partitioned table needs the partition key in every unique constraint,
+so core_recipe's primary key becomes (id, user_id) and no table can keep a
+foreign key to core_recipe(id). Those foreign keys are dropped on
+conversion, and Django's delete collector still cascades to the rows
+that referenced the recipe. `unpartition` restores them.
+
+Conversion is online:
+
+1. create the partitioned copy with the same columns, indexes and
+   outgoing foreign keys,
+2. mirror every write to the old table into the copy with a trigger,
+3. copy the existing rows in id batches, each batch its own transaction
+   and locking its source rows so a concurrent update can't be lost,
+4. swap the tables under a short ACCESS EXCLUSIVE lock.
+"""
+import time
+
+from django.apps import apps
+from django.db import transaction
+
+TABLES = (
+    ('core_recipe', 'user_id'),
+    ('core_recipe_tags', 'recipe_id'),
+    ('core_recipe_ingredients', 'recipe_id'),
+)
+RECIPE_TABLE = 'core_recipe'
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def _fetch(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def _indexes(cursor, table):
+    """(name, definition) of the secondary indexes of table."""
+    return _fetch(cursor, """
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+    """, [table])
+
+
+def _foreign_keys(cursor, table):
+    """(name, definition, target is partitioned) of the outgoing foreign keys."""
+    return _fetch(cursor, """
+        SELECT c.conname, pg_get_constraintdef(c.oid), t.relkind = 'p'
+        FROM pg_constraint c JOIN pg_class t ON t.oid = c.confrelid
+        WHERE c.conrelid = %s::regclass AND c.contype = 'f'
+    """, [table])
+
+
+def _referencing_foreign_keys(cursor, table):
+    """(table, name) of the foreign keys pointing at table."""
+    return _fetch(cursor, """
+        SELECT c.conrelid::regclass::text, c.conname
+        FROM pg_constraint c
+        WHERE c.confrelid = %s::regclass AND c.contype = 'f'
+    """, [table])
+
+
+def _create_copy(cursor, table, new, key, partitions):
+    if partitions:
+        cursor.execute(
+            f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY HASH ({key})'
+        )
+        cursor.execute(f'ALTER TABLE {new} ADD PRIMARY KEY (id, {key})')
+        for remainder in range(partitions):
+            cursor.execute(
+                f'CREATE TABLE {table}_p{remainder} PARTITION OF {new} '
+                f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+            )
+    else:
+        cursor.execute(f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'ALTER TABLE {new} ADD PRIMARY KEY (id)')
+
+    for name, definition in _indexes(cursor, table):
+        definition = definition.replace(f'INDEX {name} ON', f'INDEX {name}_new ON', 1)
+        cursor.execute(definition.replace(f' ONLY public.{table} ', f' {new} ').replace(
+            f' public.{table} ', f' {new} '))
+    for name, definition, to_partitioned in _foreign_keys(cursor, table):
+        if not to_partitioned:
+            cursor.execute(f'ALTER TABLE {new} ADD CONSTRAINT {name}_new {definition}')
+
+
+def _install_trigger(cursor, table, new, key):
+    cursor.execute(f"""
+        CREATE FUNCTION {table}_mirror() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM {new} WHERE id = OLD.id AND {key} = OLD.{key};
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO {new} SELECT NEW.* ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute(
+        f'CREATE TRIGGER {table}_mirror AFTER INSERT OR UPDATE OR DELETE ON {table} '
+        f'FOR EACH ROW EXECUTE FUNCTION {table}_mirror()'
+    )
+
+
+def _copy_rows(connection, table, new, batch_size, pause, log):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT min(id), max(id) FROM {table}')
+        low, high = cursor.fetchone()
+    if low is None:
+        return 0
+    copied = 0
+    for start in range(low, high + 1, batch_size):
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # FOR SHARE makes concurrent updates wait, their trigger then sees our copy
+            cursor.execute(
+                f'INSERT INTO {new} SELECT * FROM {table} '
+                f'WHERE id >= %s AND id < %s FOR SHARE ON CONFLICT DO NOTHING',
+                [start, start + batch_size],
+            )
+            copied += cursor.rowcount
+        log(f'{table}: copied up to id {min(start + batch_size - 1, high)}')
+        if pause:
+            time.sleep(pause)
+    return copied
+
+
+def _swap(connection, table, new):
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'DROP TRIGGER {table}_mirror ON {table}')
+        cursor.execute(f'DROP FUNCTION {table}_mirror()')
+        for referencing, name in _referencing_foreign_keys(cursor, table):
+            cursor.execute(f'ALTER TABLE {referencing} DROP CONSTRAINT {name}')
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        indexes = [name for name, _ in _indexes(cursor, table)]
+        foreign_keys = [name for name, _, _ in _foreign_keys(cursor, new)]
+        # the new table's id default already uses it, keep it alive
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {new}.id')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {new} RENAME TO {table}')
+        for name in indexes:
+            cursor.execute(f'ALTER INDEX IF EXISTS {name}_new RENAME TO {name}')
+        for name in foreign_keys:
+            cursor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {name} TO {name[:-len("_new")]}')
+        cursor.execute(f'ANALYZE {table}')
+
+
+def convert(connection, table, key, partitions, batch_size=10000, pause=0, log=print):
+    """rebuild table hash partitioned on key, or plain when partitions is 0."""
+    new = f'{table}_new'
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        _create_copy(cursor, table, new, key, partitions)
+        _install_trigger(cursor, table, new, key)
+    copied = _copy_rows(connection, table, new, batch_size, pause, log)
+    _swap(connection, table, new)
+    log(f'{table}: {copied} rows moved')
+    return copied
+
+
+def restore_foreign_keys(connection):
+    """add back the foreign keys to core_recipe dropped by `partition`."""
+    Recipe = apps.get_model('core', 'Recipe')
+    with connection.schema_editor(atomic=True) as editor, connection.cursor() as cursor:
+        existing = {
+            (referencing, definition)
+            for referencing, definition in _fetch(cursor, """
+                SELECT conrelid::regclass::text, pg_get_constraintdef(oid)
+                FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'
+            """, [RECIPE_TABLE])
+        }
+        for model in apps.get_models(include_auto_created=True):
+            for field in model._meta.local_fields:
+                if field.remote_field is None or field.remote_field.model is not Recipe:
+                    continue
+                if not field.db_constraint:
+                    continue
+                column = f'FOREIGN KEY ({field.column})'
+                if any(t == model._meta.db_table and d.startswith(column) for t, d in existing):
+                    continue
+                editor.execute(editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+
+
+def partition(connection, partitions, batch_size=10000, pause=0, log=print):
+    """hash partition the recipe tables into the given number of partitions."""
+    if partitions < 2:
+        raise ValueError('partitions must be at least 2.')
+    for table, key in TABLES:
+        if is_partitioned(connection, table):
+            log(f'{table}: already partitioned')
+            continue
+        convert(connection, table, key, partitions, batch_size, pause, log)
+
+
+def unpartition(connection, batch_size=10000, pause=0, log=print):
+    """turn the recipe tables back into plain tables."""
+    for table, key in reversed(TABLES):
+        if is_partitioned(connection, table):
+            convert(connection, table, key, 0, batch_size, pause, log)
+    restore_foreign_keys(connection)
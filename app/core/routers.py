@@ -0,0 +1,137 @@
+"""
+Read replica routing with read-your-writes consistency.
+
+Writes always go to the primary ('default'). Reads go round-robin to the
+replicas listed in DATABASE_REPLICAS['ALIASES'] unless:
+
+* the current request is not a safe method, or the client wrote less than
+  PIN_SECONDS ago (see core.middleware.ReadYourWritesMiddleware),
+* the code runs inside `use_primary()` or an atomic block on the primary,
+* no replica is healthy.
+
+Each replica is probed at most every CHECK_INTERVAL seconds. A replica
+whose replay lag is above MAX_LAG_SECONDS, or that fails to answer, is out
+of rotation until a later probe finds it caught up.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+_primary = ContextVar('use_primary', default=False)
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def replica_settings():
+    conf = {
+        'ALIASES': [],
+        'PIN_SECONDS': 5,
+        'MAX_LAG_SECONDS': 5,
+        'CHECK_INTERVAL': 5,
+    }
+    conf.update(getattr(settings, 'DATABASE_REPLICAS', {}))
+    return conf
+
+
+@contextmanager
+def use_primary(enabled=True):
+    """send every read in the block to the primary."""
+    token = _primary.set(_primary.get() or enabled)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+def replica_lag(alias):
+    """seconds the replica is behind the primary, raises if it's unreachable."""
+    connection = connections[alias]
+    try:
+        if connection.vendor != 'postgresql':
+            connection.ensure_connection()
+            return 0.0
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        # drop the broken connection so the next probe reconnects
+        connection.close()
+        raise
+
+
+class ReplicaMonitor:
+    """cached health of each replica, re-probed after CHECK_INTERVAL."""
+
+    def __init__(self, probe=replica_lag, clock=time.monotonic):
+        self.probe = probe
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.status = {}
+
+    def check(self, alias):
+        conf = replica_settings()
+        try:
+            lag = self.probe(alias)
+        except DatabaseError:
+            lag = None
+        healthy = lag is not None and lag <= conf['MAX_LAG_SECONDS']
+        self.status[alias] = (healthy, lag, self.clock() + conf['CHECK_INTERVAL'])
+        return healthy
+
+    def is_healthy(self, alias):
+        status = self.status.get(alias)
+        if status is not None and status[2] > self.clock():
+            return status[0]
+        # one thread probes, the others keep the last known state
+        if not self.lock.acquire(blocking=False):
+            return bool(status and status[0])
+        try:
+            return self.check(alias)
+        finally:
+            self.lock.release()
+
+    def healthy(self, aliases):
+        return [alias for alias in aliases if self.is_healthy(alias)]
+
+    def reset(self):
+        self.status.clear()
+
+
+monitor = ReplicaMonitor()
+
+
+class ReplicaRouter:
+    """route safe reads to healthy replicas, everything else to the primary."""
+
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        aliases = replica_settings()['ALIASES']
+        if not aliases or _primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        healthy = monitor.healthy(aliases)
+        if not healthy:
+            return DEFAULT_DB_ALIAS
+        return healthy[next(self._counter) % len(healthy)]
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
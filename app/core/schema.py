@@ -0,0 +1,168 @@
+"""
+Precomputed OpenAPI schema.
+
+Generating the schema walks every view and serializer, so it is done once
+per code version: by `manage.py generate_schema` at build time, or lazily by
+the first request. The rendered YAML and JSON, each with a gzipped copy, are
+written to OPENAPI_SCHEMA_DIR as openapi-<version>.<format>[.gz] and kept in
+memory. The code version is settings.CODE_VERSION, or a hash of the project
+sources and the installed schema libraries, so a deploy with new code gets a
+new schema and an unchanged one keeps serving the stored files.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import django
+import drf_spectacular
+import rest_framework
+from django.conf import settings
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+logger = logging.getLogger(__name__)
+
+RENDERERS = {
+    'yaml': OpenApiYamlRenderer,
+    'json': OpenApiJsonRenderer,
+}
+
+_documents = {}
+_lock = threading.Lock()
+
+
+class Document:
+    """one rendered schema format, plain and gzipped"""
+
+    def __init__(self, version, fmt, body, gzipped):
+        self.version = version
+        self.format = fmt
+        self.body = body
+        self.gzipped = gzipped
+
+    def etag(self, encoding=None):
+        suffix = f'-{encoding}' if encoding else ''
+        return f'"{self.version}-{self.format}{suffix}"'
+
+
+@lru_cache(maxsize=None)
+def _source_hash(base_dir):
+    digest = hashlib.sha256()
+    for package in (django, rest_framework, drf_spectacular):
+        digest.update(f'{package.__name__}={package.__version__};'.encode())
+    for path in sorted(Path(base_dir).rglob('*.py')):
+        digest.update(str(path.relative_to(base_dir)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def code_version():
+    """the deployed code version the schema is generated for."""
+    return settings.CODE_VERSION or _source_hash(str(settings.BASE_DIR))
+
+
+def schema_dir():
+    return Path(settings.OPENAPI_SCHEMA_DIR)
+
+
+def schema_path(version, fmt, encoding=None):
+    suffix = '.gz' if encoding == 'gzip' else ''
+    return schema_dir() / f'openapi-{version}.{fmt}{suffix}'
+
+
+def render(fmt, schema):
+    renderer = RENDERERS[fmt]()
+    return renderer.render(schema, renderer.media_type, {})
+
+
+def build_schema():
+    """generate the schema the way SpectacularAPIView does, for anonymous use."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(
+        urlconf=spectacular_settings.SERVE_URLCONF,
+    )
+    return generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+
+
+def _write(path, data):
+    """write next to the target and rename, readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.openapi-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def generate(version=None, store=True):
+    """render and store every format for the version, return them by format."""
+    version = version or code_version()
+    schema = build_schema()
+    documents = {}
+    for fmt in RENDERERS:
+        body = render(fmt, schema)
+        documents[fmt] = Document(version, fmt, body, gzip.compress(body, mtime=0))
+    if store:
+        try:
+            schema_dir().mkdir(parents=True, exist_ok=True)
+            for fmt, document in documents.items():
+                _write(schema_path(version, fmt), document.body)
+                _write(schema_path(version, fmt, 'gzip'), document.gzipped)
+        except OSError:
+            logger.warning('cannot store the OpenAPI schema in %s', schema_dir(), exc_info=True)
+    for fmt, document in documents.items():
+        _documents[version, fmt] = document
+    return documents
+
+
+def _read(version, fmt):
+    try:
+        body = schema_path(version, fmt).read_bytes()
+        gzipped = schema_path(version, fmt, 'gzip').read_bytes()
+    except OSError:
+        return None
+    return Document(version, fmt, body, gzipped)
+
+
+def get_document(fmt):
+    """the schema in the format for the current code version, generated once."""
+    version = code_version()
+    document = _documents.get((version, fmt))
+    if document is not None:
+        return document
+    with _lock:
+        document = _documents.get((version, fmt))
+        if document is None:
+            document = _read(version, fmt)
+            if document is not None:
+                _documents[version, fmt] = document
+            else:
+                document = generate(version)[fmt]
+    return document
+
+
+def clean(keep=None):
+    """delete the stored schemas of other code versions, return the count."""
+    keep = keep or code_version()
+    removed = 0
+    if not schema_dir().is_dir():
+        return removed
+    for path in schema_dir().glob('openapi-*'):
+        if not path.name.startswith(f'openapi-{keep}.'):
+            path.unlink()
+            removed += 1
+    for key in [key for key in _documents if key[0] != keep]:
+        del _documents[key]
+    return removed
+
+
+def clear():
+    """forget the schemas held in memory."""
+    _documents.clear()
@@ -0,0 +1,91 @@
+"""
+Signals for changes to recipe tag and ingredient links.
+
+Django reports m2m changes differently depending on the action and on the
+side of the relation that changed, and not at all when a recipe delete
+cascades to the through rows. The receivers below normalize all of that
+into a single recipe_links_changed signal.
+"""
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import Signal, receiver
+
+from core.models import Recipe
+
+# Sent after links are written, inside the same transaction. Arguments:
+# user_id, field ('tags' or 'ingredients'), added and removed, each a list
+# of (recipe_id, target_id) pairs.
+recipe_links_changed = Signal()
+
+# Sent after entries are appended to a user's change log, inside the same
+# transaction. Arguments: user_id, kinds (the set of Change kinds logged).
+changes_logged = Signal()
+
+LINK_FIELDS = ('tags', 'ingredients')
+
+
+def _field_for(through):
+    for field in LINK_FIELDS:
+        if getattr(Recipe, field).through is through:
+            return field
+
+
+def _pairs(instance, reverse, pk_set):
+    if reverse:
+        return [(pk, instance.pk) for pk in pk_set]
+    return [(instance.pk, pk) for pk in pk_set]
+
+
+def _existing_pairs(through, field, instance, reverse, pk_set=None):
+    """return the (recipe_id, target_id) links currently stored."""
+    target = Recipe._meta.get_field(field).m2m_reverse_name()
+    if reverse:
+        lookup = {target: instance.pk}
+        if pk_set is not None:
+            lookup['recipe_id__in'] = pk_set
+    else:
+        lookup = {'recipe_id': instance.pk}
+        if pk_set is not None:
+            lookup[f'{target}__in'] = pk_set
+    return list(through.objects.filter(**lookup).values_list('recipe_id', target))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def relay_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    field = _field_for(sender)
+    if action == 'post_add' and pk_set:
+        recipe_links_changed.send(
+            sender=Recipe, user_id=instance.user_id, field=field,
+            added=_pairs(instance, reverse, pk_set), removed=[],
+        )
+    elif action in ('pre_remove', 'pre_clear'):
+        # remove() reports the requested ids, not the ones that existed
+        instance._removed_links = _existing_pairs(
+            sender, field, instance, reverse,
+            pk_set if action == 'pre_remove' else None,
+        )
+    elif action in ('post_remove', 'post_clear'):
+        removed = instance.__dict__.pop('_removed_links', [])
+        if removed:
+            recipe_links_changed.send(
+                sender=Recipe, user_id=instance.user_id, field=field,
+                added=[], removed=removed,
+            )
+
+
+@receiver(pre_delete, sender=Recipe)
+def collect_deleted_links(sender, instance, **kwargs):
+    instance._deleted_links = {
+        field: _existing_pairs(getattr(Recipe, field).through, field, instance, False)
+        for field in LINK_FIELDS
+    }
+
+
+@receiver(post_delete, sender=Recipe)
+def relay_deleted_links(sender, instance, **kwargs):
+    for field, removed in instance.__dict__.pop('_deleted_links', {}).items():
+        if removed:
+            recipe_links_changed.send(
+                sender=Recipe, user_id=instance.user_id, field=field,
+                added=[], removed=removed,
+            )
@@ -0,0 +1,246 @@
+"""
+Single-flight: identical concurrent reads share one computation.
+
+When many clients of one user ask for the same list at once (a client
+release going out, a fleet of devices waking up), the first request runs
+the queries and serialization and the others wait for its result instead
+of repeating them. Inside a worker the waiters are the other threads;
+with SINGLE_FLIGHT['SHARED'] the workers of a host also wait for each
+other through a lock file per key under SINGLE_FLIGHT['PATH'] (tmpfs),
+the leader leaving its result next to it as JSON, encoded like the API
+renders it. The directory must belong to the worker's user and be closed
+to others, or nothing is shared. Only requests that arrive while a
+computation is running share it, nothing is served from before they were
+made, and list keys carry the position of the user's change log, read
+from the database like the list itself, so every process agrees on it and
+a client never gets a result computed before its own write. A waiter whose
+leader failed or is slower than SINGLE_FLIGHT['TIMEOUT'] computes for
+itself.
+
+`cached()` puts the same protection in front of a cache entry: a miss is
+computed once however many requests find it, and each read of a live
+entry refreshes it ahead of expiry with a probability growing as expiry
+nears and with the time it takes to compute (probabilistic early
+expiration), so a popular entry is rebuilt by one request before it
+expires instead of by all of them after.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import stat
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core import changes
+
+logger = logging.getLogger(__name__)
+
+# a cached value, the seconds it took to compute and when it expires
+Entry = namedtuple('Entry', 'value delta expires')
+
+# one in this many leaders removes the old result files
+PURGE_EVERY = 100
+
+
+class NotCached(Exception):
+    """raised by a cached() computation to return value without caching it"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+def single_flight_settings():
+    """return SINGLE_FLIGHT settings merged with the defaults"""
+    defaults = {
+        'SHARED': False,
+        'PATH': os.path.join(tempfile.gettempdir(), 'single-flight'),
+        'TIMEOUT': 10,
+        'RESULT_TTL': 60,
+        'BETA': 1.0,
+    }
+    return {**defaults, **getattr(settings, 'SINGLE_FLIGHT', {})}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.failed = False
+        self.result = None
+
+
+class Group:
+    """the computations running in this process, by key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout):
+        """fn's result, computed once for the callers arriving meanwhile."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if call.done.wait(timeout) and not call.failed:
+                return call.result
+            return fn()
+        try:
+            call.result = fn()
+        except BaseException:
+            call.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+_group = Group()
+
+
+def _lock(fd, timeout):
+    """take the exclusive lock of fd, False after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+
+
+def _purge(directory, ttl):
+    cutoff = time.time() - ttl
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def _private(directory):
+    """whether the directory is ours alone, creating it if needed."""
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    return (
+        stat.S_ISDIR(info.st_mode)
+        and info.st_uid == os.getuid()
+        and not info.st_mode & 0o077
+    )
+
+
+def _shared_do(key, fn, conf):
+    """fn's result, computed once for the workers of the host arriving meanwhile."""
+    started = time.time_ns()
+    directory = conf['PATH']
+    if not _private(directory):
+        logger.warning('not sharing through %s, other users can write to it', directory)
+        return fn()
+    path = os.path.join(directory, hashlib.sha256(key.encode()).hexdigest())
+    fd = os.open(f'{path}.lock', os.O_CREAT | os.O_RDWR | os.O_NOFOLLOW, 0o600)
+    try:
+        if not _lock(fd, conf['TIMEOUT']):
+            return fn()
+        try:
+            try:
+                # written by a leader that finished while we waited
+                if os.stat(path).st_mtime_ns >= started:
+                    with open(path, 'rb') as f:
+                        return json.load(f)
+            except (FileNotFoundError, ValueError):
+                pass
+            result = fn()
+            temp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+            with open(temp, 'w') as f:
+                json.dump(result, f, cls=JSONEncoder)
+            os.replace(temp, path)
+            if random.randrange(PURGE_EVERY) == 0:
+                _purge(directory, conf['RESULT_TTL'])
+            return result
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def do(key, fn):
+    """
+    fn's result, shared with the identical calls made while it runs. When
+    SHARED the other workers get it as rendered JSON decodes.
+    """
+    conf = single_flight_settings()
+    if conf['SHARED']:
+        return _group.do(key, lambda: _shared_do(key, fn, conf), conf['TIMEOUT'])
+    return _group.do(key, fn, conf['TIMEOUT'])
+
+
+def _expiring(entry, beta):
+    """whether to refresh the entry now, earlier the longer it takes."""
+    # 1 - random() is in (0, 1], the log is defined
+    return time.time() - entry.delta * beta * math.log(1 - random.random()) >= entry.expires
+
+
+def cached(key, timeout, compute):
+    """
+    the cached value of key, computed by compute() once for all the
+    requests missing it and refreshed ahead of its expiry. compute() raises
+    NotCached for a value not to be kept.
+    """
+    entry = cache.get(key)
+    if isinstance(entry, Entry) and not _expiring(entry, single_flight_settings()['BETA']):
+        return entry.value
+
+    def load():
+        started = time.monotonic()
+        try:
+            value = compute()
+        except NotCached as exc:
+            return exc.value
+        delta = time.monotonic() - started
+        cache.set(key, Entry(value, delta, time.time() + timeout), timeout)
+        return value
+
+    return do(f'cache:{key}', load)
+
+
+class SingleFlightListMixin:
+    """
+    Share the list responses of identical concurrent requests.
+    """
+
+    def single_flight_key(self, request):
+        """key of the request: user, their change log position, host and URL."""
+        user_id = request.user.pk
+        return (
+            f'list:{user_id}:{changes.position(user_id)}:'
+            f'{request.get_host()}:{request.get_full_path()}'
+        )
+
+    def list(self, request, *args, **kwargs):
+        parent = super().list
+        data = do(
+            self.single_flight_key(request),
+            lambda: parent(request, *args, **kwargs).data,
+        )
+        return Response(data)
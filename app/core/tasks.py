@@ -0,0 +1,68 @@
+"""
+Background tasks of the core app, run by manage.py run_worker.
+"""
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.apps import apps
+from django.db import transaction
+
+from core import changes, counters, jobs
+from core.models import AuthToken, IdempotencyKey, Recipe, ReplicaPin, Tag
+from core.signals import LINK_FIELDS
+
+
+@jobs.periodic(timedelta(hours=1))
+def purge_tokens():
+    AuthToken.objects.purge_expired()
+
+
+@jobs.periodic(timedelta(hours=1))
+def purge_idempotency_keys():
+    IdempotencyKey.objects.purge_expired()
+
+
+@jobs.periodic(timedelta(hours=1))
+def purge_replica_pins():
+    ReplicaPin.objects.purge_expired()
+
+
+@jobs.periodic(timedelta(hours=1))
+def compact_changes():
+    changes.compact()
+
+
+@jobs.periodic(timedelta(days=1))
+def reconcile_usage_counts():
+    for field in LINK_FIELDS:
+        counters.reconcile(field)
+    counters.reconcile_recipe_counts()
+
+
+@jobs.periodic(timedelta(hours=1))
+def purge_jobs():
+    jobs.purge_finished()
+
+
+@jobs.task(priority=-1)
+def delete_objects(model, ids):
+    """delete a batch of rows picked in the admin, signals included."""
+    apps.get_model(model).objects.filter(pk__in=ids).delete()
+
+
+@jobs.task(priority=-1)
+def retag_recipes(ids, name, remove=False):
+    """add or remove each recipe owner's tag called name."""
+    rows = Recipe.objects.filter(pk__in=ids).order_by('user_id').values_list('user_id', 'id')
+    for user_id, group in groupby(rows, key=itemgetter(0)):
+        recipe_ids = [recipe_id for _, recipe_id in group]
+        with transaction.atomic():
+            tag = Tag.objects.filter(user_id=user_id, name=name).first()
+            if remove:
+                if tag is not None:
+                    tag.recipe_set.remove(*recipe_ids)
+                continue
+            if tag is None:
+                tag = Tag.objects.create(user_id=user_id, name=name)
+            tag.recipe_set.add(*recipe_ids)
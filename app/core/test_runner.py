@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from rest_framework.settings import api_settings
+
+from core import invalidation, throttling
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with their own throttle buckets and no rates, so tests
+    all calling from 127.0.0.1 never throttle each other or a later run.
+    Throttling tests set the rates they check. The cache invalidation bus
+    is local: a LISTEN thread would hold a connection to the test database
+    past its teardown.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._throttle_dir = tempfile.mkdtemp(prefix='throttle-')
+        settings.THROTTLE = {
+            **getattr(settings, 'THROTTLE', {}),
+            'PATH': os.path.join(self._throttle_dir, 'buckets'),
+        }
+        settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+        api_settings.reload()
+        throttling.reset_store('THROTTLE')
+        settings.INVALIDATION = {**getattr(settings, 'INVALIDATION', {}), 'BACKEND': 'local'}
+        invalidation.reset_bus('INVALIDATION')
+
+    def teardown_test_environment(self, **kwargs):
+        invalidation.get_bus().stop()
+        shutil.rmtree(self._throttle_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,8 +1,15 @@
+from decimal import Decimal
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.test import Client
 
+from core import jobs
+from core.models import Job, Recipe, Tag
+
 class AdminSiteTests(TestCase):
     """Tests for Django admin."""
 
@@ -38,3 +45,97 @@ class AdminSiteTests(TestCase):
         url = reverse('admin:core_user_add')
         res = self.client.get(url)
         self.assertEquals(res.status_code, 200)
+
+
+class ScalableAdminTests(TestCase):
+    """Tests for the recipe, tag and ingredient admin on large tables."""
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@example.com',
+            password='mreza@0708',
+        )
+        self.client.force_login(self.admin_user)
+        self.user = get_user_model().objects.create_user(
+            email='cook@example.com', password='mreza@0708',
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                user=self.user, title=f'soup {i}', time_minutes=10, price=Decimal('5.00'),
+            )
+            for i in range(3)
+        ]
+        self.url = reverse('admin:core_recipe_changelist')
+
+    def action(self, action_name, recipes, **data):
+        return self.client.post(self.url, {
+            'action': action_name,
+            'index': 0,
+            '_selected_action': [recipe.id for recipe in recipes],
+            **data,
+        })
+
+    def test_changelists_and_forms(self):
+        """test the changelists and the autocomplete change form render"""
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        for url in [
+            self.url,
+            reverse('admin:core_tag_changelist'),
+            reverse('admin:core_ingredient_changelist'),
+            reverse('admin:core_job_changelist'),
+            reverse('admin:core_recipe_change', args=[self.recipes[0].id]),
+            reverse('admin:core_tag_change', args=[tag.id]),
+        ]:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200, url)
+        res = self.client.get(reverse('admin:core_recipe_change', args=[self.recipes[0].id]))
+        self.assertContains(res, 'admin-autocomplete')
+
+    def test_changelist_skips_full_count(self):
+        """test the changelist doesn't count the unfiltered table"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'q': 'soup'})
+        counts = [q['sql'] for q in queries if 'COUNT(' in q['sql'].upper()]
+        self.assertTrue(counts)
+        self.assertTrue(all('LIMIT' in sql.upper() for sql in counts))
+
+    def test_search(self):
+        """test searching by title prefix, id and owner email"""
+        other = get_user_model().objects.create_user('other@example.com', 'mreza@0708')
+        Recipe.objects.create(user=other, title='stew', time_minutes=5, price=Decimal('1.00'))
+        res = self.client.get(self.url, {'q': 'sou'})
+        self.assertEqual(res.context['cl'].result_count, 3)
+        res = self.client.get(self.url, {'q': str(self.recipes[1].id)})
+        self.assertEqual(list(res.context['cl'].result_list), [self.recipes[1]])
+        res = self.client.get(self.url, {'q': 'OTHER@example.com'})
+        self.assertEqual(res.context['cl'].result_count, 1)
+
+    def test_delete_action_queues_jobs(self):
+        """test bulk delete runs as a background job"""
+        res = self.action('delete_in_background', self.recipes[:2])
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(Recipe.objects.count(), 3)
+        job = Job.objects.get(name='core.tasks.delete_objects')
+        self.assertEqual(sorted(job.kwargs['ids']), sorted(r.id for r in self.recipes[:2]))
+        jobs.run(jobs.claim('test')[0])
+        self.assertEqual(list(Recipe.objects.all()), [self.recipes[2]])
+
+    def test_retag_action(self):
+        """test retagging asks for a tag then queues the change"""
+        res = self.action('retag', self.recipes)
+        self.assertContains(res, 'name="apply"')
+        self.action('retag', self.recipes, name='quick', apply='Queue')
+        jobs.run(jobs.claim('test')[0])
+        tag = Tag.objects.get(user=self.user, name='quick')
+        self.assertEqual(tag.recipe_set.count(), 3)
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 3)
+
+    def test_export_action_streams_csv(self):
+        """test exporting streams the selected rows as csv"""
+        res = self.action('export_csv', self.recipes[:2])
+        body = b''.join(res.streaming_content).decode()
+        lines = body.strip().splitlines()
+        self.assertEqual(lines[0], 'id,user__email,title,time_minutes,price,link')
+        self.assertEqual(len(lines), 3)
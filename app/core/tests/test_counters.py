@@ -0,0 +1,117 @@
+"""
+Tests for tag and ingredient usage counters.
+"""
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def create_recipe(user, **params):
+    """create and return a sample recipe"""
+    defaults = {'title': 'sample recipe', 'time_minutes': 10, 'price': Decimal('5.00')}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def count_of(obj):
+    obj.refresh_from_db()
+    return obj.recipe_count
+
+
+class UsageCounterTests(TestCase):
+    """Test recipe counts follow link changes."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_counts_on_create_and_update(self):
+        """test creating and editing recipes through the API keeps counts"""
+        payload = {
+            'title': 'curry', 'time_minutes': 30, 'price': '5.00',
+            'tags': [{'name': 'thai'}, {'name': 'dinner'}],
+            'ingredients': [{'name': 'rice'}],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.client.post(RECIPES_URL, {**payload, 'tags': [{'name': 'thai'}]}, format='json')
+        thai = Tag.objects.get(name='thai')
+        dinner = Tag.objects.get(name='dinner')
+        self.assertEqual(count_of(thai), 2)
+        self.assertEqual(count_of(dinner), 1)
+        self.assertEqual(count_of(Ingredient.objects.get(name='rice')), 2)
+
+        url = reverse('recipe:recipe-detail', args=[res.data['id']])
+        self.client.patch(url, {'tags': [{'name': 'lunch'}]}, format='json')
+        self.assertEqual(count_of(thai), 1)
+        self.assertEqual(count_of(dinner), 0)
+        self.assertEqual(count_of(Tag.objects.get(name='lunch')), 1)
+
+    def test_counts_on_direct_link_changes(self):
+        """test add, remove, clear and reverse adds are counted"""
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        r1 = create_recipe(self.user)
+        r2 = create_recipe(self.user)
+        r1.tags.add(tag)
+        r1.tags.add(tag)
+        tag.recipe_set.add(r2)
+        self.assertEqual(count_of(tag), 2)
+        r1.tags.remove(tag)
+        r1.tags.remove(tag)
+        self.assertEqual(count_of(tag), 1)
+        tag.recipe_set.clear()
+        self.assertEqual(count_of(tag), 0)
+
+    def test_counts_on_recipe_delete(self):
+        """test deleting a recipe decrements its tags and ingredients"""
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='tofu')
+        recipe = create_recipe(self.user)
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+        res = self.client.delete(reverse('recipe:recipe-detail', args=[recipe.id]))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(count_of(tag), 0)
+        self.assertEqual(count_of(ingredient), 0)
+
+    def test_count_exposed_and_used_for_assigned_only(self):
+        """test assigned_only filters on the stored count"""
+        used = Tag.objects.create(user=self.user, name='used')
+        Tag.objects.create(user=self.user, name='unused')
+        create_recipe(self.user).tags.add(used)
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+        self.assertEqual(res.data, [{'id': used.id, 'name': 'used', 'recipe_count': 1}])
+
+    def test_reconcile_repairs_drift(self):
+        """test the reconcile command fixes wrong counts"""
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='tofu')
+        create_recipe(self.user).tags.add(tag)
+        Tag.objects.filter(pk=tag.pk).update(recipe_count=7)
+        Ingredient.objects.filter(pk=ingredient.pk).update(recipe_count=3)
+        call_command('reconcile_usage_counts', batch_size=1, stdout=StringIO())
+        self.assertEqual(count_of(tag), 1)
+        self.assertEqual(count_of(ingredient), 0)
+
+    def test_user_recipe_count(self):
+        """test users count their recipes on create and delete"""
+        recipe = create_recipe(self.user)
+        create_recipe(self.user)
+        self.assertEqual(count_of(self.user), 2)
+        recipe.delete()
+        self.assertEqual(count_of(self.user), 1)
+        get_user_model().objects.filter(pk=self.user.pk).update(recipe_count=9)
+        call_command('reconcile_usage_counts', stdout=StringIO())
+        self.assertEqual(count_of(self.user), 1)
@@ -0,0 +1,39 @@
+"""
+Tests for bounded and estimated counts.
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from core.counting import EstimatedCountPaginator, count_rows
+from core.models import Recipe
+
+
+class CountRowsTests(TestCase):
+    """Test exact counts below the threshold."""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        for i in range(5):
+            Recipe.objects.create(user=user, title=f'r{i}', time_minutes=i, price=Decimal('1'))
+
+    def test_exact_below_threshold(self):
+        """test small results are counted exactly"""
+        self.assertEqual(count_rows(Recipe.objects.all(), threshold=10), (5, False))
+        self.assertEqual(
+            count_rows(Recipe.objects.filter(time_minutes__gte=3), threshold=10), (2, False))
+
+    def test_count_bounded_by_threshold(self):
+        """test counts past the threshold are exact or flagged estimates"""
+        count, estimated = count_rows(Recipe.objects.all(), threshold=3)
+        self.assertGreaterEqual(count, 4)
+        if not estimated:
+            self.assertEqual(count, 5)
+
+    def test_paginator(self):
+        """test the paginator uses the bounded count"""
+        paginator = EstimatedCountPaginator(Recipe.objects.order_by('id'), 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(paginator.count_is_estimate)
+        self.assertEqual(paginator.num_pages, 3)
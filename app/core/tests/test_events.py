@@ -0,0 +1,163 @@
+"""
+Tests for the change notification stream.
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import events
+from core.models import AuthToken, Recipe
+
+STREAM_PATH = events.events_settings()['PATH']
+
+
+def http_scope(path=STREAM_PATH, query=b'', headers=()):
+    return {
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+        'headers': list(headers),
+    }
+
+
+def keep_test_connection(test):
+    """authenticate() closes old connections, the test's is in its transaction"""
+    patcher = mock.patch('core.events.close_old_connections')
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+async def not_found(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+class SubscriptionTests(SimpleTestCase):
+    """Test notifications merge while the client is busy."""
+
+    async def test_pending_notifications_merge(self):
+        """test two notifications before a read arrive as one event"""
+        subscription = events.Subscription(1)
+        subscription.notify(['tag'])
+        subscription.notify(['recipe', 'tag'])
+        self.assertEqual(await subscription.get(), ['recipe', 'tag'])
+        subscription.ping()
+        self.assertEqual(await subscription.get(), [])
+        subscription.close()
+        self.assertIsNone(await subscription.get())
+
+
+@override_settings(EVENTS={**settings.EVENTS, 'BACKEND': 'local'})
+class EventStreamTests(TestCase):
+    """Test the stream over ASGI with the local broker."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.token = AuthToken.objects.issue(self.user)
+        self.ticket = events.issue_ticket(self.user)
+        keep_test_connection(self)
+        self.app = events.EventStream(not_found)
+        self.addCleanup(events.reset_broker, 'EVENTS')
+
+    async def open(self, scope):
+        communicator = ApplicationCommunicator(self.app, scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        return communicator, await communicator.receive_output(timeout=5)
+
+    def create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(user=self.user, title='soup', time_minutes=1, price='1')
+
+    async def test_requires_token(self):
+        """test a stream without a valid token or ticket is refused"""
+        _, start = await self.open(http_scope(query=f'token={self.token.key}'.encode()))
+        self.assertEqual(start['status'], 401)
+        _, start = await self.open(http_scope(query=b'ticket=wrong'))
+        self.assertEqual(start['status'], 401)
+
+    async def test_ticket_expires(self):
+        """test a ticket only opens streams for TICKET_TTL seconds"""
+        with self.settings(EVENTS={**settings.EVENTS, 'BACKEND': 'local', 'TICKET_TTL': -1}):
+            _, start = await self.open(http_scope(query=f'ticket={self.ticket}'.encode()))
+        self.assertEqual(start['status'], 401)
+
+    async def test_other_paths_reach_django(self):
+        """test requests outside the stream path go to the wrapped app"""
+        _, start = await self.open(http_scope(path='/api/recipe/recipes/'))
+        self.assertEqual(start['status'], 404)
+
+    async def test_change_notified(self):
+        """test a committed change sends an event to the user's stream"""
+        headers = [(b'authorization', f'Token {self.token.key}'.encode())]
+        communicator, start = await self.open(http_scope(headers=headers))
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        await communicator.receive_output(timeout=5)
+
+        await sync_to_async(self.create_recipe)()
+        message = await communicator.receive_output(timeout=5)
+        self.assertEqual(message['body'], b'event: changes\ndata: {"kinds": ["recipe"]}\n\n')
+
+        await communicator.send_input({'type': 'http.disconnect'})
+        end = await communicator.receive_output(timeout=5)
+        self.assertFalse(end.get('more_body', False))
+        self.assertEqual(events.get_broker().count, 0)
+
+    async def test_other_users_not_notified(self):
+        """test streams only hear about their own user's changes"""
+        communicator, _ = await self.open(http_scope(query=f'ticket={self.ticket}'.encode()))
+        await communicator.receive_output(timeout=5)
+        other = await sync_to_async(get_user_model().objects.create_user)(
+            'other@example.com', 'testpass123',
+        )
+        events.get_broker().deliver(other.pk, ['recipe'])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(timeout=5)
+
+    async def test_connection_limit(self):
+        """test streams beyond MAX_CONNECTIONS get 503"""
+        with self.settings(EVENTS={**settings.EVENTS, 'BACKEND': 'local', 'MAX_CONNECTIONS': 0}):
+            _, start = await self.open(http_scope(query=f'ticket={self.ticket}'.encode()))
+        self.assertEqual(start['status'], 503)
+
+
+class EventTicketApiTests(TestCase):
+    """Test signed in users get stream tickets."""
+
+    def setUp(self):
+        keep_test_connection(self)
+
+    def test_ticket_issued(self):
+        """test the ticket opens the user's stream"""
+        user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        client = APIClient()
+        res = client.post(reverse('recipe:events-ticket'))
+        self.assertEqual(res.status_code, 401)
+        client.force_authenticate(user)
+        res = client.post(reverse('recipe:events-ticket'))
+        self.assertEqual(res.status_code, 200)
+        scope = http_scope(query=f'ticket={res.data["ticket"]}'.encode())
+        self.assertEqual(events.authenticate(scope), user.pk)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY needs PostgreSQL')
+class PostgresBrokerTests(TransactionTestCase):
+    """Test notifications reach other processes through LISTEN/NOTIFY."""
+
+    async def test_notify_on_commit(self):
+        """test a committed write reaches a listening broker"""
+        broker = events.PostgresBroker(events.events_settings())
+        self.addCleanup(broker.close)
+        subscription = broker.subscribe(7)
+        # give the listener time to connect
+        await asyncio.sleep(0.5)
+        await sync_to_async(broker.publish)(7, {'tag'})
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 5), ['tag'])
@@ -0,0 +1,99 @@
+"""
+Tests for the password hashing pool.
+"""
+import asyncio
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password as django_make_password
+from django.test import TestCase, SimpleTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import hashing
+
+TOKEN_URL = reverse('user:token')
+
+
+class HashingPoolTests(SimpleTestCase):
+    """Test hashing through the pool."""
+
+    def test_make_and_verify_password(self):
+        """test a pooled hash verifies and rejects a wrong password"""
+        encoded = hashing.make_password('testpass123')
+        self.assertEqual(hashing.verify_password('testpass123', encoded), (True, False))
+        self.assertEqual(hashing.verify_password('wrong', encoded), (False, False))
+
+    def test_verify_flags_outdated_hasher(self):
+        """test hashes from a non preferred hasher must be updated"""
+        with self.settings(PASSWORD_HASHERS=[
+            'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ]):
+            encoded = django_make_password('testpass123', hasher='md5')
+            is_correct, must_update = hashing._verify('testpass123', encoded)
+        self.assertTrue(is_correct)
+        self.assertTrue(must_update)
+
+    def test_unusable_password_skips_pool(self):
+        """test unusable passwords never reach the pool"""
+        with patch.object(hashing.HashingPool, 'submit') as submit:
+            self.assertEqual(hashing.verify_password('x', '!unusable'), (False, False))
+            self.assertTrue(hashing.make_password(None).startswith('!'))
+        submit.assert_not_called()
+
+    def test_async_helpers(self):
+        """test async helpers hash without blocking the caller"""
+        encoded = asyncio.run(hashing.amake_password('testpass123'))
+        result = asyncio.run(hashing.averify_password('testpass123', encoded))
+        self.assertEqual(result, (True, False))
+
+    def test_full_queue_raises_busy(self):
+        """test new work is refused once every slot is taken"""
+        pool = hashing.HashingPool(workers=1, max_pending=0, queue_timeout=0)
+        pool._slots.acquire()
+        with self.assertRaises(hashing.PasswordHashingBusy):
+            pool.submit(hashing._hash, 'testpass123')
+
+
+class HashingLoginTests(TestCase):
+    """Test logins going through the pool."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com', password='testpass123',
+        )
+
+    @patch('core.hashing.schedule_rehash')
+    def test_outdated_hash_rehashed_off_request(self, schedule_rehash):
+        """test a login with an old hash schedules a rehash"""
+        with patch('core.hashing.verify_password', return_value=(True, True)):
+            res = self.client.post(TOKEN_URL, {
+                'email': 'test@example.com', 'password': 'testpass123',
+            })
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        schedule_rehash.assert_called_once()
+
+    def test_rehash_keeps_concurrent_password_change(self):
+        """test the background rehash does not overwrite a newer password"""
+        old = self.user.password
+        self.user.set_password('newpass123')
+        self.user.save()
+        # inline, the test's data is only visible on its connection: keep it open
+        with patch.object(hashing.connections, 'close_all') as close_all:
+            hashing._rehash(get_user_model(), self.user.pk, 'testpass123', old)
+        close_all.assert_called_once()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('newpass123'))
+
+    def test_login_when_pool_busy(self):
+        """test a full pool answers 503 with Retry-After"""
+        with patch('core.hashing.verify_password',
+                   side_effect=hashing.PasswordHashingBusy):
+            res = self.client.post(TOKEN_URL, {
+                'email': 'test@example.com', 'password': 'testpass123',
+            })
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '1')
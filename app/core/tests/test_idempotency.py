@@ -0,0 +1,152 @@
+"""
+Tests for idempotency keys on API writes.
+"""
+import io
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import APIException
+from rest_framework.test import APIClient
+
+from core.models import IdempotencyKey, Recipe
+from recipe.views import RecipeViewSet
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+CREATE_USER_URL = reverse('user:create')
+
+PAYLOAD = {
+    'title': 'soup', 'time_minutes': 10, 'price': '2.50',
+    'tags': [{'name': 'quick'}],
+}
+
+
+class IdempotencyKeyTests(TestCase):
+    """Test retried writes happen once and replay their response."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, url=RECIPES_URL, payload=PAYLOAD, key='k-1'):
+        return self.client.post(url, payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_response(self):
+        """test a repeated key creates one recipe and one tag link"""
+        first = self.post()
+        second = self.post()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Recipe.objects.count(), 1)
+        self.assertEqual(Recipe.objects.get().tags.count(), 1)
+
+    def test_without_key_not_deduplicated(self):
+        """test plain writes behave as before"""
+        self.client.post(RECIPES_URL, PAYLOAD, format='json')
+        self.client.post(RECIPES_URL, PAYLOAD, format='json')
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_key_reused_for_other_request(self):
+        """test a key sent with another payload or path is refused"""
+        self.post()
+        res = self.post(payload={**PAYLOAD, 'title': 'stew'})
+        self.assertEqual(res.status_code, 422)
+        res = self.post(TAGS_URL, {'name': 'x'})
+        self.assertEqual(res.status_code, 422)
+
+    def test_keys_scoped_to_user(self):
+        """test two users may send the same key"""
+        self.post()
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        self.client.force_authenticate(other)
+        res = self.post()
+        self.assertNotIn('Idempotent-Replayed', res)
+        self.assertEqual(Recipe.objects.filter(user=other).count(), 1)
+
+    def test_client_errors_replayed(self):
+        """test a rejected write is answered the same way again"""
+        payload = {'title': 'no price'}
+        first = self.post(payload=payload)
+        second = self.post(payload=payload)
+        self.assertEqual(first.status_code, 400)
+        self.assertEqual(second.status_code, 400)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+    def test_server_error_frees_key(self):
+        """test a failed write rolls back with its key so the retry runs"""
+        with mock.patch.object(RecipeViewSet, 'perform_create',
+                               side_effect=APIException('down')):
+            res = self.post()
+        self.assertEqual(res.status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        res = self.post()
+        self.assertEqual(res.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', res)
+
+    def test_in_progress_duplicate_conflicts(self):
+        """test a duplicate of an unfinished request is told to retry"""
+        self.post()
+        IdempotencyKey.objects.update(status_code=None)
+        res = self.post()
+        self.assertEqual(res.status_code, 409)
+
+    def test_expired_key_runs_again(self):
+        """test keys are only honoured within the TTL, then purged"""
+        self.post()
+        IdempotencyKey.objects.update(expires=timezone.now() - timedelta(seconds=1))
+        res = self.post()
+        self.assertNotIn('Idempotent-Replayed', res)
+        self.assertEqual(Recipe.objects.count(), 2)
+        IdempotencyKey.objects.create(
+            scope='user:0', key='old', fingerprint='',
+            expires=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertEqual(IdempotencyKey.objects.purge_expired(), 1)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_large_responses_replayed_without_body(self):
+        """test stored bodies are bounded"""
+        with self.settings(IDEMPOTENCY={'MAX_BODY_SIZE': 10}):
+            self.post()
+            res = self.post()
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(IdempotencyKey.objects.get().body, b'')
+
+    def test_image_upload_retry(self):
+        """test a retried multipart upload stores one image"""
+        recipe = Recipe.objects.create(user=self.user, title='t', time_minutes=1, price='1')
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+        data = io.BytesIO()
+        Image.new('RGB', (4, 4)).save(data, format='JPEG')
+        responses = []
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            for _ in range(2):
+                image = io.BytesIO(data.getvalue())
+                image.name = 'photo.jpg'
+                responses.append(self.client.post(
+                    url, {'image': image}, format='multipart', HTTP_IDEMPOTENCY_KEY='img',
+                ))
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(responses[1].content, responses[0].content)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+
+    def test_anonymous_sign_up(self):
+        """test a retried sign up replays instead of failing as a duplicate"""
+        client = APIClient()
+        payload = {'email': 'new@example.com', 'password': 'testpass123', 'name': 'New'}
+        first = client.post(CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='signup')
+        second = client.post(CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='signup')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.content, first.content)
@@ -0,0 +1,120 @@
+"""
+Tests for the cache invalidation bus.
+"""
+import threading
+import unittest
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import invalidation, versions
+from core.models import Recipe
+from recipe import coverage
+
+
+class ApplyTests(SimpleTestCase):
+    """Test received messages reach their topic's handler in batches."""
+
+    def setUp(self):
+        self.calls = []
+        invalidation.subscribe('test', self.calls.append, lambda: self.calls.append('resync'))
+        self.addCleanup(invalidation._handlers.pop, 'test')
+
+    def test_keys_grouped_by_topic(self):
+        """test one handler call per topic with the distinct keys"""
+        invalidation.apply(['test:1', 'other:1', 'test:2', 'test:1'])
+        self.assertEqual(self.calls, [{'1', '2'}])
+
+    def test_resync_calls_every_topic(self):
+        """test a resync reaches every subscribed cache"""
+        invalidation.resync()
+        self.assertIn('resync', self.calls)
+
+    def test_data_versions_bumped(self):
+        """test another process's write bumps the local version"""
+        before = versions.get_data_version(42)
+        invalidation.apply(['data-version:42'])
+        self.assertNotEqual(versions.get_data_version(42), before)
+
+    def test_coverage_index_dropped(self):
+        """test another process's ingredient change drops the local index"""
+        coverage.clear()
+        self.addCleanup(coverage.clear)
+        coverage._indexes[42] = coverage.CoverageIndex()
+        invalidation.apply(['coverage:42'])
+        self.assertNotIn(42, coverage._indexes)
+
+    def test_user_caches_dropped(self):
+        """test a user's profile change reaches every cache of the user"""
+        coverage.clear()
+        self.addCleanup(coverage.clear)
+        coverage._indexes[42] = coverage.CoverageIndex()
+        before = versions.get_data_version(42)
+        invalidation.apply(['user:42'])
+        self.assertNotIn(42, coverage._indexes)
+        self.assertNotEqual(versions.get_data_version(42), before)
+
+
+class PublishTests(TestCase):
+    """Test writes publish their invalidations after commit."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        patcher = mock.patch.object(invalidation.get_bus(), 'send')
+        self.send = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent(self):
+        return {message for call in self.send.call_args_list for message in call.args[0]}
+
+    def test_recipe_write_published_on_commit(self):
+        """test a recipe change tells the others after commit"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe = Recipe.objects.create(
+                user=self.user, title='soup', time_minutes=1, price='1',
+            )
+            recipe.ingredients.create(user=self.user, name='salt')
+        self.send.assert_not_called()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.sent(), {f'data-version:{self.user.pk}', f'coverage:{self.user.pk}'})
+
+    def test_user_update_published(self):
+        """test profile changes invalidate the user's caches everywhere"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.patch(reverse('user:me'), {'name': 'New'})
+        self.assertIn(f'user:{self.user.pk}', self.sent())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY needs PostgreSQL')
+class PostgresBusTests(TransactionTestCase):
+    """Test messages travel between two buses."""
+
+    def test_message_reaches_other_bus(self):
+        """test one bus's message is applied by the other, not by itself"""
+        received = threading.Event()
+        keys = []
+
+        def handler(topic_keys):
+            keys.extend(topic_keys)
+            received.set()
+
+        invalidation.subscribe('test', handler, lambda: None)
+        self.addCleanup(invalidation._handlers.pop, 'test')
+        conf = invalidation.invalidation_settings()
+        sender, listener = invalidation.PostgresBus(conf), invalidation.PostgresBus(conf)
+        for bus in (sender, listener):
+            bus.start()
+            self.addCleanup(bus.stop)
+        # the listener may not be listening yet, send until it hears
+        for _ in range(50):
+            sender.send(['test:7'])
+            if received.wait(0.1):
+                break
+        self.assertEqual(set(keys), {'7'})
@@ -0,0 +1,160 @@
+"""
+Tests for the database job queue.
+"""
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+calls = []
+
+
+@jobs.task(name='tests.record')
+def record(value=None):
+    calls.append(value)
+
+
+@jobs.task(name='tests.flaky', max_attempts=3)
+def flaky():
+    raise RuntimeError('boom')
+
+
+@jobs.periodic(timedelta(minutes=5), name='tests.tick')
+def tick():
+    calls.append('tick')
+
+
+class JobQueueTests(TestCase):
+    """Test claiming, retrying and scheduling jobs."""
+
+    def setUp(self):
+        calls.clear()
+        self.worker = jobs.Worker(name='test')
+
+    def test_claim_by_priority_then_age(self):
+        """test higher priority and older jobs are claimed first"""
+        low = jobs.enqueue('tests.record', {'value': 'low'})
+        high = jobs.enqueue('tests.record', {'value': 'high'}, priority=5)
+        later = jobs.enqueue('tests.record', {'value': 'later'})
+        claimed = jobs.claim('w', limit=3)
+        self.assertEqual([job.pk for job in claimed], [high.pk, low.pk, later.pk])
+        self.assertTrue(all(job.status == Job.RUNNING for job in claimed))
+        self.assertEqual(jobs.claim('w'), [])
+
+    def test_scheduled_jobs_wait(self):
+        """test jobs are not claimed before run_at"""
+        jobs.enqueue('tests.record', delay=timedelta(minutes=1))
+        self.assertFalse(self.worker.run_once('w'))
+        with mock.patch('django.utils.timezone.now',
+                        return_value=timezone.now() + timedelta(minutes=2)):
+            self.assertTrue(self.worker.run_once('w'))
+        self.assertEqual(calls, [None])
+
+    def test_run_passes_kwargs(self):
+        """test a job runs its task once and is marked done"""
+        job = jobs.enqueue('tests.record', {'value': 3})
+        self.worker.run_once('w')
+        job.refresh_from_db()
+        self.assertEqual(calls, [3])
+        self.assertEqual(job.status, Job.DONE)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_retry_with_backoff_then_fail(self):
+        """test failures retry later until max_attempts"""
+        job = jobs.enqueue('tests.flaky')
+        before = timezone.now()
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.worker.run_once('w')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('boom', job.last_error)
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=5))
+        for _ in range(2):
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            with self.assertLogs('core.jobs', 'WARNING'):
+                self.worker.run_once('w')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    def test_backoff_grows_and_is_capped(self):
+        """test retry delays double up to BACKOFF_MAX"""
+        with self.settings(JOBS={'BACKOFF_BASE': 10, 'BACKOFF_MAX': 60}):
+            self.assertLessEqual(jobs.backoff(1), 10)
+            self.assertGreaterEqual(jobs.backoff(3), 20)
+            self.assertLessEqual(jobs.backoff(10), 60)
+
+    def test_periodic_keeps_one_pending_run(self):
+        """test periodic tasks are scheduled once and reschedule themselves"""
+        jobs.schedule_periodic()
+        jobs.schedule_periodic()
+        pending = Job.objects.filter(name='tests.tick', status=Job.QUEUED)
+        self.assertEqual(pending.count(), 1)
+        Job.objects.exclude(name='tests.tick').delete()
+        self.worker.run_once('w')
+        self.assertEqual(calls, ['tick'])
+        next_run = pending.get()
+        self.assertGreater(next_run.run_at, timezone.now() + timedelta(minutes=4))
+
+    def test_recover_stale_jobs(self):
+        """test jobs of a dead worker are queued again"""
+        job = jobs.enqueue('tests.record')
+        jobs.claim('dead')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.recover_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_long_job_with_heartbeat_not_recovered(self):
+        """test a job running for long on a live worker is left alone"""
+        job = jobs.enqueue('tests.record')
+        jobs.claim('test/0')
+        self.worker.running.add(job.pk)
+        Job.objects.filter(pk=job.pk).update(
+            started_at=timezone.now() - timedelta(hours=1),
+            heartbeat_at=timezone.now() - timedelta(hours=1),
+        )
+        self.worker.beat()
+        self.assertEqual(jobs.recover_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+
+    def test_metrics(self):
+        """test queue depth and task outcomes are reported"""
+        jobs.enqueue('tests.record')
+        jobs.enqueue('tests.record')
+        self.worker.run_once('w')
+        stats = jobs.metrics()
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['done'], 1)
+        self.assertEqual(stats['tasks']['tests.record']['done'], 1)
+        self.assertIsNotNone(stats['tasks']['tests.record']['avg_seconds'])
+
+    def test_run_worker_burst(self):
+        """test the command drains the queue and exits"""
+        jobs.enqueue('tests.record', {'value': 1})
+        out = StringIO()
+        with mock.patch.object(jobs.Worker, 'maintain'), \
+                mock.patch('threading.Thread', ImmediateThread):
+            call_command('run_worker', '--burst', '--concurrency', '1', stdout=out)
+        self.assertEqual(calls, [1])
+        self.assertIn('Processed 1 jobs', out.getvalue())
+
+
+class ImmediateThread:
+    """runs the target on start, the test database lives in this thread"""
+
+    def __init__(self, target, args=(), name=None):
+        self.target, self.args = target, args
+
+    def start(self):
+        self.target(*self.args)
+
+    def join(self):
+        pass
@@ -0,0 +1,110 @@
+"""
+Tests for serving uploaded media.
+"""
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase
+from django.utils.http import http_date
+
+from core import media
+
+CONTENT = bytes(range(256)) * 4
+
+
+class MediaServingTests(TestCase):
+    """Test signed access, ranges, validators and offload headers."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        override = self.settings(MEDIA_ROOT=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.name = default_storage.save('uploads/recipe/abc.bin', ContentFile(CONTENT))
+        self.url = default_storage.url(self.name)
+
+    def get(self, url=None, **headers):
+        return self.client.get(url or self.url, **headers)
+
+    def test_signed_url_served_without_queries(self):
+        """test the storage signs URLs and the view checks them without the db"""
+        query = parse_qs(urlsplit(self.url).query)
+        self.assertEqual(set(query), {'e', 's'})
+        with self.assertNumQueries(0):
+            res = self.get()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT)
+        self.assertEqual(res['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+
+    def test_bad_or_expired_signature_forbidden(self):
+        """test tampered, foreign and expired URLs are refused"""
+        path = urlsplit(self.url).path
+        self.assertEqual(self.get(path).status_code, 403)
+        self.assertEqual(self.get(self.url.replace('abc.bin', 'abd.bin')).status_code, 403)
+        expires = int(time.time()) - 1
+        sig = media.signature(self.name, expires)
+        self.assertEqual(self.get(f'{path}?e={expires}&s={sig}').status_code, 403)
+
+    def test_missing_and_traversal_not_found(self):
+        """test unknown files and paths outside MEDIA_ROOT are 404"""
+        for name in ['uploads/recipe/nope.bin', '../etc/passwd']:
+            url = f'/static/media/{name}?{media.signed_query(name)}'
+            self.assertEqual(self.get(url).status_code, 404, name)
+
+    def test_immutable_cache_headers(self):
+        """test uploads are cacheable until the grant expires"""
+        res = self.get()
+        cache_control = res['Cache-Control']
+        self.assertIn('immutable', cache_control)
+        max_age = int(cache_control.split('max-age=')[1].split(',')[0])
+        self.assertLessEqual(max_age, 2 * media.media_settings()['SIGNED_URL_TTL'])
+        other = default_storage.save('avatar.bin', ContentFile(b'x'))
+        res = self.get(default_storage.url(other))
+        self.assertEqual(res['Cache-Control'], 'no-cache')
+
+    def test_conditional_requests(self):
+        """test etag and date validators give 304"""
+        res = self.get()
+        res = self.get(HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+        mtime = (self.root / self.name).stat().st_mtime
+        res = self.get(HTTP_IF_MODIFIED_SINCE=http_date(mtime + 1))
+        self.assertEqual(res.status_code, 304)
+
+    def test_range_requests(self):
+        """test single ranges, suffixes and unsatisfiable ranges"""
+        res = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res['Content-Range'], f'bytes 10-19/{len(CONTENT)}')
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[10:20])
+        res = self.get(HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[-4:])
+        res = self.get(HTTP_RANGE=f'bytes={len(CONTENT)}-')
+        self.assertEqual(res.status_code, 416)
+        res = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(res.status_code, 200)
+
+    def test_stale_if_range_sends_whole_file(self):
+        """test a range for an older version gets the full new file"""
+        res = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(res.status_code, 200)
+        etag = self.get()['ETag']
+        res = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(res.status_code, 206)
+
+    def test_proxy_offload(self):
+        """test x-accel and x-sendfile hand the file to the proxy"""
+        with self.settings(MEDIA_SERVING={'BACKEND': 'x-accel'}):
+            res = self.get()
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(res.content, b'')
+        with self.settings(MEDIA_SERVING={'BACKEND': 'x-sendfile'}):
+            res = self.get()
+        self.assertEqual(res['X-Sendfile'], str(self.root / self.name))
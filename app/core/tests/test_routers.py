@@ -0,0 +1,144 @@
+"""
+Tests for read replica routing.
+"""
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, TransactionTestCase, override_settings
+
+from core import routers
+from core.middleware import ReadYourWritesMiddleware
+from core.models import Recipe, ReplicaPin
+
+REPLICAS = {
+    'ALIASES': ['replica_0', 'replica_1'],
+    'PIN_SECONDS': 5,
+    'MAX_LAG_SECONDS': 5,
+    'CHECK_INTERVAL': 5,
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS)
+class ReplicaRouterTests(SimpleTestCase):
+    """Test reads are spread over healthy replicas."""
+
+    def setUp(self):
+        self.lags = {'replica_0': 0.0, 'replica_1': 0.0}
+        self.clock = FakeClock()
+        self.monitor = routers.ReplicaMonitor(probe=self.probe, clock=self.clock)
+        patcher = mock.patch.object(routers, 'monitor', self.monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = routers.ReplicaRouter()
+
+    def probe(self, alias):
+        lag = self.lags[alias]
+        if lag is None:
+            raise DatabaseError('connection refused')
+        return lag
+
+    def reads(self, count=4):
+        return [self.router.db_for_read(Recipe) for _ in range(count)]
+
+    def test_reads_round_robin_writes_primary(self):
+        """test reads alternate between replicas and writes stay on default"""
+        self.assertEqual(sorted(set(self.reads())), ['replica_0', 'replica_1'])
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+        self.assertFalse(self.router.allow_migrate('replica_0', 'core'))
+
+    def test_use_primary(self):
+        """test reads inside use_primary go to the primary"""
+        with routers.use_primary():
+            self.assertEqual(set(self.reads()), {'default'})
+        self.assertNotIn('default', self.reads())
+
+    def test_lagging_and_failed_replicas_leave_rotation(self):
+        """test unhealthy replicas are skipped until a later probe"""
+        self.lags['replica_0'] = 30.0
+        self.assertEqual(set(self.reads()), {'replica_1'})
+        self.lags['replica_1'] = None
+        self.clock.now += 10
+        self.assertEqual(set(self.reads()), {'default'})
+        self.lags['replica_0'] = 1.0
+        self.assertEqual(set(self.reads()), {'default'})
+        self.clock.now += 10
+        self.assertEqual(set(self.reads()), {'replica_0'})
+
+    @override_settings(DATABASE_REPLICAS={**REPLICAS, 'ALIASES': []})
+    def test_no_replicas(self):
+        """test everything goes to default without replicas"""
+        self.assertEqual(set(self.reads()), {'default'})
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS)
+class ReadYourWritesTests(TransactionTestCase):
+    """Test clients are pinned to the primary after they write."""
+
+    def setUp(self):
+        monitor = routers.ReplicaMonitor(probe=lambda alias: 0.0)
+        patcher = mock.patch.object(routers, 'monitor', monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = routers.ReplicaRouter()
+        self.middleware = ReadYourWritesMiddleware(self.view)
+        self.factory = RequestFactory()
+
+    def view(self, request):
+        request.read_from = self.router.db_for_read(Recipe)
+        return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+    def send(self, method, token='abc', cookies=None):
+        request = getattr(self.factory, method)('/api/recipe/recipes/',
+                                                HTTP_AUTHORIZATION=f'Token {token}')
+        request.COOKIES.update(cookies or {})
+        self.response = self.middleware(request)
+        return request.read_from
+
+    def test_pinned_after_write(self):
+        """test reads after a write come from the primary"""
+        self.assertNotEqual(self.send('get'), 'default')
+        self.assertEqual(self.send('post'), 'default')
+        self.assertEqual(self.send('get'), 'default')
+        self.assertNotEqual(self.send('get', token='other'), 'default')
+
+    def test_pin_expires(self):
+        """test the pin lapses after PIN_SECONDS"""
+        with mock.patch('core.middleware.time.time', return_value=1000.0):
+            self.send('patch')
+        with mock.patch('core.middleware.time.time', return_value=1006.0):
+            self.assertNotEqual(self.send('get'), 'default')
+
+    def test_pinned_by_cookie(self):
+        """test the pin cookie holds without a lookup on the primary"""
+        self.send('post')
+        cookies = {name: morsel.value for name, morsel in self.response.cookies.items()}
+        ReplicaPin.objects.all().delete()
+        self.assertNotEqual(self.send('get'), 'default')
+        self.assertEqual(self.send('get', cookies=cookies), 'default')
+        self.assertNotEqual(self.send('get', token='other', cookies=cookies), 'default')
+
+    def test_pinned_without_cookie(self):
+        """test a client dropping cookies is pinned by the row on the primary"""
+        self.send('post')
+        self.assertTrue(ReplicaPin.objects.using('default').exists())
+        # another worker, with nothing of the write in its process
+        cache.clear()
+        self.assertEqual(self.send('get'), 'default')
+
+    def test_expired_pins_purged(self):
+        """test the pins past their deadline are deleted"""
+        ReplicaPin.objects.pin('old', time.time() - 1)
+        ReplicaPin.objects.pin('new', time.time() + 60)
+        ReplicaPin.objects.purge_expired()
+        self.assertEqual(list(ReplicaPin.objects.using('default').values_list('key', flat=True)), ['new'])
@@ -0,0 +1,94 @@
+"""
+Tests for the precomputed OpenAPI schema.
+"""
+import gzip
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import schema
+
+SCHEMA_URL = reverse('api-schema')
+
+
+class SchemaServingTests(TestCase):
+    """Test the schema is generated once and served with validators."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        override = self.settings(OPENAPI_SCHEMA_DIR=tmp.name, CODE_VERSION='v1')
+        override.enable()
+        self.addCleanup(override.disable)
+        schema.clear()
+        self.addCleanup(schema.clear)
+        self.client = APIClient()
+
+    def test_generated_once_and_stored(self):
+        """test repeated requests reuse the stored schema"""
+        with mock.patch.object(schema, 'build_schema', wraps=schema.build_schema) as build:
+            first = self.client.get(SCHEMA_URL)
+            second = self.client.get(SCHEMA_URL)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertIn(b'openapi:', first.content)
+        self.assertTrue((self.dir / 'openapi-v1.yaml').exists())
+        self.assertTrue((self.dir / 'openapi-v1.json.gz').exists())
+
+    def test_read_from_disk_after_restart(self):
+        """test a new process serves the stored files without generating"""
+        call_command('generate_schema', stdout=StringIO())
+        schema.clear()
+        with mock.patch.object(schema, 'build_schema') as build:
+            res = self.client.get(SCHEMA_URL, {'format': 'json'})
+        build.assert_not_called()
+        self.assertIn('paths', json.loads(res.content))
+
+    def test_etag_not_modified(self):
+        """test a matching If-None-Match gets an empty 304"""
+        res = self.client.get(SCHEMA_URL)
+        self.assertEqual(res['ETag'], '"v1-yaml"')
+        self.assertEqual(res['Cache-Control'], 'no-cache')
+        res = self.client.get(SCHEMA_URL, HTTP_IF_NONE_MATCH='"v1-yaml"')
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b'')
+        res = self.client.get(SCHEMA_URL, HTTP_IF_NONE_MATCH='"v0-yaml"')
+        self.assertEqual(res.status_code, 200)
+
+    def test_gzip_when_accepted(self):
+        """test gzip clients get the compressed copy under its own etag"""
+        plain = self.client.get(SCHEMA_URL, HTTP_ACCEPT='application/json')
+        res = self.client.get(SCHEMA_URL, HTTP_ACCEPT='application/json',
+                              HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(res['ETag'], '"v1-json-gzip"')
+        self.assertIn('Accept-Encoding', res['Vary'])
+        self.assertEqual(gzip.decompress(res.content), plain.content)
+        self.assertLess(len(res.content), len(plain.content))
+
+    def test_new_code_version_regenerates(self):
+        """test a deploy with new code gets a new schema and cleans the old"""
+        call_command('generate_schema', stdout=StringIO())
+        with self.settings(CODE_VERSION='v2'):
+            res = self.client.get(SCHEMA_URL)
+            self.assertEqual(res['ETag'], '"v2-yaml"')
+            call_command('generate_schema', stdout=StringIO())
+        self.assertEqual(
+            sorted(path.name for path in self.dir.iterdir()),
+            ['openapi-v2.json', 'openapi-v2.json.gz', 'openapi-v2.yaml', 'openapi-v2.yaml.gz'],
+        )
+
+    def test_source_hash_version(self):
+        """test without CODE_VERSION the version follows the sources"""
+        with self.settings(CODE_VERSION=''):
+            version = schema.code_version()
+            self.assertEqual(schema.code_version(), version)
+        self.assertEqual(len(version), 16)
@@ -0,0 +1,221 @@
+"""
+Tests for single-flight request coalescing.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import singleflight
+from core.models import Tag
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+
+class GroupTests(SimpleTestCase):
+    """Test concurrent calls in a process share one computation."""
+
+    def test_concurrent_calls_share_result(self):
+        """test callers arriving while it runs get the leader's result"""
+        group = singleflight.Group()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return object()
+
+        leader = threading.Thread(target=lambda: results.append(group.do('k', compute, 5)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(group.do('k', compute, 5)))
+            for _ in range(4)
+        ]
+        for thread in followers:
+            thread.start()
+        # let the followers reach the wait
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len({id(result) for result in results}), 1)
+
+    def test_later_calls_compute_again(self):
+        """test nothing is kept once the computation finished"""
+        group = singleflight.Group()
+        self.assertEqual(group.do('k', lambda: 1, 5), 1)
+        self.assertEqual(group.do('k', lambda: 2, 5), 2)
+
+    def test_follower_computes_after_leader_failure(self):
+        """test a failed leader doesn't fail its waiters"""
+        group = singleflight.Group()
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError()
+
+        def lead():
+            with self.assertRaises(ValueError):
+                group.do('k', fail, 5)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(group.do('k', lambda: 2, 5)))
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(results, [2])
+
+
+class SharedTests(SimpleTestCase):
+    """Test workers of a host share through the lock files."""
+
+    def setUp(self):
+        self.conf = {
+            **singleflight.single_flight_settings(),
+            'PATH': tempfile.mkdtemp(), 'TIMEOUT': 5,
+        }
+        self.addCleanup(shutil.rmtree, self.conf['PATH'])
+
+    def test_waiter_reads_leader_result(self):
+        """test a worker waiting on the lock gets the result written meanwhile"""
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def compute():
+            started.set()
+            release.wait(5)
+            return {'tags': [1, 2]}
+
+        leader = threading.Thread(
+            target=lambda: results.append(singleflight._shared_do('k', compute, self.conf)),
+        )
+        leader.start()
+        started.wait(5)
+        waiter = threading.Thread(
+            target=lambda: results.append(singleflight._shared_do('k', self.fail, self.conf)),
+        )
+        waiter.start()
+        time.sleep(0.05)
+        release.set()
+        leader.join(5)
+        waiter.join(5)
+        self.assertEqual(results, [{'tags': [1, 2]}] * 2)
+
+    def test_earlier_result_not_reused(self):
+        """test a result from before the call is computed again"""
+        singleflight._shared_do('k', lambda: 1, self.conf)
+        self.assertEqual(singleflight._shared_do('k', lambda: 2, self.conf), 2)
+
+    def test_directory_open_to_others_not_used(self):
+        """test results planted by other users are never read"""
+        os.chmod(self.conf['PATH'], 0o777)
+        singleflight._shared_do('k', lambda: 1, self.conf)
+        self.assertEqual(os.listdir(self.conf['PATH']), [])
+
+    def fail(self):
+        raise AssertionError('computed twice')
+
+
+class CachedTests(SimpleTestCase):
+    """Test cache misses and expiries are computed once."""
+
+    def setUp(self):
+        cache.delete('test-key')
+        self.addCleanup(cache.delete, 'test-key')
+
+    def test_miss_computed_and_cached(self):
+        """test a miss computes and stores the value"""
+        compute = mock.Mock(return_value=[1])
+        self.assertEqual(singleflight.cached('test-key', 60, compute), [1])
+        self.assertEqual(singleflight.cached('test-key', 60, compute), [1])
+        compute.assert_called_once()
+
+    def test_concurrent_misses_computed_once(self):
+        """test requests missing the same key together share its computation"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return [1]
+
+        run_threads(5, lambda: singleflight.cached('test-key', 60, compute))
+        self.assertEqual(len(calls), 1)
+
+    def test_refreshed_ahead_of_expiry(self):
+        """test an entry about to expire that is slow to compute is refreshed"""
+        cache.set('test-key', singleflight.Entry([1], 60, time.time() + 1), 60)
+        self.assertEqual(singleflight.cached('test-key', 60, lambda: [2]), [2])
+
+    def test_fresh_entry_served(self):
+        """test an entry far from expiry is served as is"""
+        cache.set('test-key', singleflight.Entry([1], 0.01, time.time() + 60), 60)
+        self.assertEqual(singleflight.cached('test-key', 60, lambda: [2]), [1])
+
+
+class ListTests(TestCase):
+    """Test list requests are coalesced per user and change log position."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(singleflight, 'do', wraps=singleflight.do)
+        self.do = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def keys(self):
+        return [call.args[0] for call in self.do.call_args_list]
+
+    def test_list_goes_through_single_flight(self):
+        """test the list response is the shared computation's"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        res = self.client.get(reverse('recipe:tag-list'))
+        self.assertEqual([tag['name'] for tag in res.data], ['Vegan'])
+        self.assertIn(str(self.user.pk), self.keys()[0])
+
+    def test_write_changes_key(self):
+        """test a request after a write never joins one from before it"""
+        url = reverse('recipe:ingredient-list')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(user=self.user, name='Vegan')
+        self.client.get(url)
+        first, second = self.keys()
+        self.assertNotEqual(first, second)
+
+    def test_key_shared_between_processes(self):
+        """test the key doesn't depend on the process's own cache"""
+        url = reverse('recipe:tag-list')
+        self.client.get(url)
+        # what another worker starts from
+        cache.clear()
+        self.client.get(url)
+        first, second = self.keys()
+        self.assertEqual(first, second)
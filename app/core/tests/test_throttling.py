@@ -0,0 +1,134 @@
+"""
+Tests for the shared-memory token bucket throttle.
+"""
+import multiprocessing
+import os
+import tempfile
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import throttling
+from core.models import Recipe
+
+TOKEN_URL = reverse('user:token')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def with_rates(**rates):
+    """REST_FRAMEWORK settings with the given throttle rates."""
+    rates = {scope.replace('_', '-'): rate for scope, rate in rates.items()}
+    return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+
+
+def take_in_child(path, slots, count):
+    store = throttling.BucketStore(path, slots)
+    for _ in range(count):
+        store.take('shared', 5, 0.001)
+
+
+class BucketStoreTests(SimpleTestCase):
+    """Test the buckets refill, evict and are shared between processes."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'buckets')
+        self.store = throttling.BucketStore(self.path, 1024)
+
+    def test_parse_rate(self):
+        """test DRF rates become a capacity and a refill per second"""
+        self.assertEqual(throttling.parse_rate('120/min'), (120, 2.0))
+        self.assertEqual(throttling.parse_rate('10/s'), (10, 10.0))
+
+    def test_burst_then_refill(self):
+        """test a full bucket allows a burst then refills at the rate"""
+        now = 1000.0
+        waits = [self.store.take('k', 3, 1.0, now=now) for _ in range(4)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 1.0)
+        self.assertEqual(self.store.take('k', 3, 1.0, now=now + 1.0), 0)
+
+    def test_keys_are_separate(self):
+        """test one key running dry leaves the others alone"""
+        for _ in range(2):
+            self.store.take('a', 2, 0.001, now=0)
+        self.assertGreater(self.store.take('a', 2, 0.001, now=0), 0)
+        self.assertEqual(self.store.take('b', 2, 0.001, now=0), 0)
+
+    def test_full_stripe_reuses_idlest_slot(self):
+        """test more keys than slots evict the longest idle bucket"""
+        store = throttling.BucketStore(self.path + '-small', 1)
+        for number in range(store.slots * 3):
+            store.take(f'key-{number}', 1, 0.001, now=number)
+        # a key whose slot was taken starts again from a full bucket
+        self.assertEqual(store.take('key-0', 1, 0.001, now=10 ** 6), 0)
+
+    def test_shared_between_processes(self):
+        """test tokens taken in another process are gone here"""
+        context = multiprocessing.get_context('fork')
+        child = context.Process(target=take_in_child, args=(self.path, 1024, 5))
+        child.start()
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        self.assertGreater(self.store.take('shared', 5, 0.001), 0)
+
+
+class ThrottleApiTests(TestCase):
+    """Test the API throttles by user, by IP and per action."""
+
+    def setUp(self):
+        throttling.get_store().clear()
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+
+    def test_token_guesses_limited_per_ip(self):
+        """test password guessing gets 429 with Retry-After"""
+        payload = {'email': 'user@example.com', 'password': 'wrong'}
+        with self.settings(REST_FRAMEWORK=with_rates(token='3/min')):
+            codes = [self.client.post(TOKEN_URL, payload).status_code for _ in range(3)]
+            res = self.client.post(TOKEN_URL, payload)
+            other_ip = self.client.post(TOKEN_URL, payload, REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(codes, [400] * 3)
+        self.assertEqual(res.status_code, 429)
+        self.assertGreaterEqual(int(res['Retry-After']), 1)
+        self.assertEqual(other_ip.status_code, 400)
+
+    def test_users_have_own_buckets(self):
+        """test one user exhausting their rate doesn't limit another"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        with self.settings(REST_FRAMEWORK=with_rates(user='2/min')):
+            self.client.force_authenticate(self.user)
+            codes = [self.client.get(RECIPES_URL).status_code for _ in range(3)]
+            self.client.force_authenticate(other)
+            res = self.client.get(RECIPES_URL)
+        self.assertEqual(codes, [200, 200, 429])
+        self.assertEqual(res.status_code, 200)
+
+    def test_write_actions_use_their_scope(self):
+        """test recipe writes are limited apart from reads"""
+        self.client.force_authenticate(self.user)
+        payload = {'title': 'soup', 'time_minutes': 5, 'price': Decimal('1.00')}
+        with self.settings(REST_FRAMEWORK=with_rates(user='100/min', recipe_write='1/min')):
+            created = self.client.post(RECIPES_URL, payload)
+            limited = self.client.post(RECIPES_URL, payload)
+            read = self.client.get(RECIPES_URL)
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(read.status_code, 200)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_ip_cap_across_accounts(self):
+        """test many accounts from one address share its cap"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        with self.settings(REST_FRAMEWORK=with_rates(ip='2/min', user='100/min')):
+            self.client.force_authenticate(self.user)
+            self.client.get(RECIPES_URL)
+            self.client.get(RECIPES_URL)
+            self.client.force_authenticate(other)
+            res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, 429)
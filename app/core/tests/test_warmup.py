@@ -0,0 +1,47 @@
+"""
+Tests for the pre-fork warm-up.
+"""
+import tempfile
+from unittest import mock
+
+from django.test import TransactionTestCase
+
+from core import schema, warmup
+from recipe.serializers import RecipeDetailSerializer, RecipeSerializer
+from user.serializers import AuthTokenSerializer
+
+
+class WarmUpTests(TransactionTestCase):
+    """Test the state built before fork and the startup report."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = self.settings(OPENAPI_SCHEMA_DIR=tmp.name, CODE_VERSION='warm')
+        override.enable()
+        self.addCleanup(override.disable)
+        schema.clear()
+        self.addCleanup(schema.clear)
+
+    def test_serializers_of_every_action(self):
+        """test viewset actions and plain views are all found"""
+        found = set(warmup._serializer_classes(warmup.warm_urls()))
+        self.assertTrue({RecipeSerializer, RecipeDetailSerializer, AuthTokenSerializer} <= found)
+
+    def test_warm_up_reports_steps_and_closes_connections(self):
+        """test every step is timed and nothing stays open for the workers"""
+        with mock.patch.object(warmup.connections, 'close_all') as close_all:
+            timings = warmup.warm_up()
+        self.assertEqual(
+            [name for name, _ in timings.steps],
+            ['models', 'urls', 'serializers', 'translations', 'schema'],
+        )
+        self.assertIn('total', str(timings))
+        self.assertIn(('warm', 'json'), schema._documents)
+        close_all.assert_called_once_with()
+
+    def test_connect_databases(self):
+        """test the worker opens its connections up front"""
+        timings = warmup.connect_databases()
+        self.assertEqual(timings.steps[0][0], 'db:default')
+        self.assertIsNotNone(warmup.connections['default'].connection)
@@ -0,0 +1,219 @@
+"""
+Token bucket rate limiting shared by every worker process on a host.
+
+Buckets live in a fixed size hash table in a memory mapped file
+(THROTTLE['PATH'], on tmpfs by default), so a check is a hash, a lock and a
+few bytes read and written: no database or cache round trip. Each slot
+holds the key's hash, its tokens and when they were last refilled. The
+table is split into stripes, each guarded by a thread lock and an fcntl
+record lock on its byte range, so workers only contend on the same stripe.
+A key probes a few slots of its stripe; when they are all taken the one
+idle the longest is reused, which at worst hands a full bucket to a client
+that would have had one by now anyway.
+
+Rates use the DRF format ('100/min') from DEFAULT_THROTTLE_RATES: the
+bucket holds that many requests and refills at that rate. Views pick a
+scope with `throttle_scope`, or per action with `throttle_scopes`.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# key hash, tokens, last refill
+SLOT = struct.Struct('=Qdd')
+PROBES = 8
+STRIPES = 64
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def throttle_settings():
+    shm = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    conf = {
+        'PATH': os.path.join(shm, 'recipe-api-throttle'),
+        'SLOTS': 65536,
+    }
+    conf.update(getattr(settings, 'THROTTLE', {}))
+    return conf
+
+
+def parse_rate(rate):
+    """(capacity, tokens per second) for a rate like '100/min'."""
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def key_hash(key):
+    value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+    # zero marks an empty slot
+    return value or 1
+
+
+class BucketStore:
+    """token buckets in a memory mapped file shared between processes."""
+
+    def __init__(self, path, slots):
+        self.stripe_slots = max(PROBES, slots // STRIPES)
+        self.slots = self.stripe_slots * STRIPES
+        # a resized table is a new file, running workers keep their mapping
+        self.path = f'{path}-{self.slots}'
+        self._pid = None
+        self._open_lock = threading.Lock()
+
+    def _open(self):
+        # locks and the file position don't survive fork(), reopen per process
+        with self._open_lock:
+            if self._pid != os.getpid():
+                size = self.slots * SLOT.size
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)
+                    self._map = mmap.mmap(fd, size)
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+                self._fd = fd
+                self._locks = [threading.Lock() for _ in range(STRIPES)]
+                self._pid = os.getpid()
+
+    def take(self, key, capacity, rate, now=None):
+        """
+        take a token from the key's bucket, return 0 when one was taken or
+        the seconds until one is available.
+        """
+        if self._pid != os.getpid():
+            self._open()
+        now = time.time() if now is None else now
+        value = key_hash(key)
+        stripe = value % STRIPES
+        start = stripe * self.stripe_slots * SLOT.size
+        length = self.stripe_slots * SLOT.size
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                offset, tokens, updated = self._find(value, stripe, start)
+                if updated is None:
+                    tokens = capacity
+                else:
+                    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / rate
+                SLOT.pack_into(self._map, offset, value, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+        return wait
+
+    def _find(self, value, stripe, start):
+        """(offset, tokens, updated) of the key's slot, updated None when new."""
+        first = value // STRIPES
+        oldest = None
+        for probe in range(PROBES):
+            offset = start + (first + probe) % self.stripe_slots * SLOT.size
+            slot_value, tokens, updated = SLOT.unpack_from(self._map, offset)
+            if slot_value == value:
+                return offset, tokens, updated
+            if slot_value == 0:
+                return offset, 0.0, None
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        return oldest[0], 0.0, None
+
+    def clear(self):
+        """empty every bucket."""
+        if self._pid != os.getpid():
+            self._open()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            self._map[:] = bytes(len(self._map))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """return the host-wide bucket store, opening it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                conf = throttle_settings()
+                _store = BucketStore(conf['PATH'], conf['SLOTS'])
+    return _store
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    global _store
+    if setting == 'THROTTLE':
+        _store = None
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle keyed by user, or by client IP when anonymous.
+    The scope comes from the view's `throttle_scopes[action]`, then its
+    `throttle_scope`, then `default_scope`; a scope without a rate isn't
+    throttled.
+    """
+    default_scope = 'user'
+    anon_scope = 'anon'
+
+    def get_scope(self, request, view):
+        scopes = getattr(view, 'throttle_scopes', {})
+        scope = scopes.get(getattr(view, 'action', None))
+        scope = scope or getattr(view, 'throttle_scope', None)
+        if scope:
+            return scope
+        if request.user and request.user.is_authenticated:
+            return self.default_scope
+        return self.anon_scope
+
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if not rate:
+            return True
+        capacity, per_second = parse_rate(rate)
+        key = f'{scope}:{self.get_ident_key(request)}'
+        self._wait = get_store().take(key, capacity, per_second)
+        return self._wait == 0
+
+    def wait(self):
+        return self._wait
+
+
+class IPBucketThrottle(BucketThrottle):
+    """
+    Token bucket per client IP whoever is signed in, capping what one host
+    gets across accounts. Views may set `throttle_ip_scope`.
+    """
+
+    def get_scope(self, request, view):
+        return getattr(view, 'throttle_ip_scope', 'ip')
+
+    def get_ident_key(self, request):
+        return f'ip:{self.get_ident(request)}'
@@ -0,0 +1,81 @@
+"""
+Per-user data versions for cache keys.
+
+Every write to a user's recipes, tags, ingredients or their links bumps the
+user's version once the transaction commits, so anything cached under the
+old version is simply never read again. With a cache local to the process
+the other processes bump theirs through the invalidation bus.
+"""
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import invalidation
+from core.models import Recipe, Tag, Ingredient
+from core.signals import recipe_links_changed
+
+
+def _key(user_id):
+    return f'data-version:{user_id}'
+
+
+def get_data_version(user_id):
+    """return the current data version for the user."""
+    version = cache.get(_key(user_id))
+    if version is None:
+        # start from the clock so an evicted version never repeats
+        cache.add(_key(user_id), time.time_ns(), timeout=None)
+        version = cache.get(_key(user_id))
+    return version
+
+
+def _bump(user_id):
+    try:
+        cache.incr(_key(user_id))
+    except ValueError:
+        cache.set(_key(user_id), time.time_ns(), timeout=None)
+
+
+def bump_data_version(user_id):
+    """bump the user's version after the current transaction commits."""
+    transaction.on_commit(lambda: _bump(user_id))
+    invalidation.publish('data-version', user_id)
+
+
+def _is_local():
+    return isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def _invalidated(user_ids):
+    if _is_local():
+        for user_id in user_ids:
+            _bump(user_id)
+
+
+def _resync():
+    if _is_local():
+        # versions restart from the clock, every cached entry is orphaned
+        cache.clear()
+
+
+invalidation.subscribe('data-version', _invalidated, _resync)
+invalidation.subscribe('user', _invalidated, _resync)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def bump_on_write(sender, instance, **kwargs):
+    bump_data_version(instance.user_id)
+
+
+@receiver(recipe_links_changed)
+def bump_on_links_changed(sender, user_id, **kwargs):
+    bump_data_version(user_id)
@@ -1,3 +1,131 @@
-from django.shortcuts import render
+import mimetypes
+import os
+import re
+import stat
 
-# Create your views here.
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from drf_spectacular.views import SpectacularAPIView
+
+from core import media, schema
+
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+class CachedSchemaView(SpectacularAPIView):
+    """
+    The OpenAPI schema rendered once per code version, see core/schema.py.
+    Served with an ETag and gzipped when the client accepts it.
+    """
+
+    def _get_schema_response(self, request):
+        lang = request.GET.get('lang')
+        if lang and lang != settings.LANGUAGE_CODE:
+            # translated schemas are rare, render them live
+            return super()._get_schema_response(request)
+
+        document = schema.get_document(request.accepted_renderer.format)
+        encoding = None
+        if accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            encoding = 'gzip'
+        etag = document.etag(encoding)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                document.gzipped if encoding else document.body,
+                content_type=request.accepted_media_type,
+            )
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        # cheap to revalidate, and the schema changes with every deploy
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        return response
+
+
+# a year, the longest max-age caches are asked to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    A file under MEDIA_ROOT for a holder of its signed URL, sent by the
+    configured backend, see core/media.py. No database query is made.
+    """
+    conf = media.media_settings()
+    max_age = IMMUTABLE_MAX_AGE
+    if conf['SIGNED']:
+        remaining = media.check_signature(path, request.GET.get('e'), request.GET.get('s'))
+        if remaining is None:
+            return HttpResponseForbidden()
+        # cached copies must not outlive the grant
+        max_age = min(max_age, remaining)
+
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat_result = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    if conf['BACKEND'] == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = conf['INTERNAL_PREFIX'] + path
+    elif conf['BACKEND'] == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+    else:
+        response = _file_response(request, fullpath, stat_result, content_type)
+
+    if media.is_immutable(path):
+        response['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _file_response(request, fullpath, stat_result, content_type):
+    """the file, or the requested range of it, honouring the validators."""
+    etag = media.file_etag(stat_result)
+    last_modified = stat_result.st_mtime
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is not None:
+        response['ETag'] = etag
+        return response
+
+    size = stat_result.st_size
+    byte_range = None
+    header = request.META.get('HTTP_RANGE')
+    if header and media.if_range_matches(
+            request.META.get('HTTP_IF_RANGE'), etag, last_modified):
+        byte_range = media.parse_range(header, size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = FileResponse(media.FileRange(file, start, end - start + 1),
+                                content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,147 @@
+"""
+Warm-up before serving traffic.
+
+The prefork server (gunicorn.conf.py) loads the app once in the master and
+runs `warm_up` there, so the lazily built state below is created before
+fork() and shared copy-on-write by every worker instead of being rebuilt by
+each worker on its first requests. Database connections can't be shared
+across fork(), so the master closes them and each worker opens its own with
+`connect_databases` before accepting requests.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.urls import URLResolver, get_resolver
+from django.utils import translation
+
+from core import schema
+
+logger = logging.getLogger(__name__)
+
+
+class Timings:
+    """named durations of startup steps, in order"""
+
+    def __init__(self):
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def add(self, name, seconds):
+        self.steps.append((name, seconds))
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.steps)
+
+    def __str__(self):
+        parts = [f'{name} {seconds:.3f}s' for name, seconds in self.steps]
+        return ', '.join(parts + [f'total {self.total:.3f}s'])
+
+
+def warm_models():
+    """build every model's field and relation caches."""
+    for model in apps.get_models():
+        model._meta.get_fields()
+        model._meta.related_objects
+
+
+def _walk(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _walk(pattern.url_patterns)
+        else:
+            yield pattern
+
+
+def warm_urls():
+    """import the URLconf and build the resolve and reverse tables."""
+    resolver = get_resolver()
+    resolver.reverse_dict
+    pending = [resolver]
+    while pending:
+        current = pending.pop()
+        for _, namespaced in current.namespace_dict.values():
+            namespaced.reverse_dict
+            pending.append(namespaced)
+    return list(_walk(resolver.url_patterns))
+
+
+def _serializer_classes(patterns):
+    seen = set()
+    for pattern in patterns:
+        view_class = getattr(pattern.callback, 'cls', None)
+        if view_class is None or view_class in seen:
+            continue
+        seen.add(view_class)
+        actions = getattr(pattern.callback, 'actions', None) or {}
+        for action in set(actions.values()) or [None]:
+            view = view_class(action=action, request=None, format_kwarg=None, kwargs={})
+            if hasattr(view, 'get_serializer_class'):
+                yield view.get_serializer_class()
+            elif getattr(view, 'serializer_class', None):
+                yield view.serializer_class
+
+
+def warm_serializers(patterns):
+    """build the field maps of every serializer the routed views use."""
+    built = set()
+    for serializer_class in _serializer_classes(patterns):
+        if serializer_class in built:
+            continue
+        built.add(serializer_class)
+        serializer_class().fields
+    return len(built)
+
+
+def warm_translations():
+    """load the default language's catalogs."""
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.gettext('Not found.')
+
+
+def warm_schema():
+    """load or render the OpenAPI schema, see core/schema.py."""
+    for fmt in schema.RENDERERS:
+        schema.get_document(fmt)
+
+
+def warm_up(timings=None):
+    """build the shared state before fork, return the Timings."""
+    timings = timings or Timings()
+    with timings.step('models'):
+        warm_models()
+    with timings.step('urls'):
+        patterns = warm_urls()
+    with timings.step('serializers'):
+        warm_serializers(patterns)
+    with timings.step('translations'):
+        warm_translations()
+    with timings.step('schema'):
+        warm_schema()
+    # nothing opened before fork may be shared by the workers
+    connections.close_all()
+    return timings
+
+
+def connect_databases(timings=None):
+    """open a connection to every database, so the first request doesn't."""
+    timings = timings or Timings()
+    for alias in connections:
+        with timings.step(f'db:{alias}'):
+            try:
+                connections[alias].ensure_connection()
+            except DatabaseError:
+                # requests retry it, a down replica is routed around
+                logger.warning('cannot connect to database %s', alias, exc_info=True)
+    return timings
@@ -0,0 +1,86 @@
+"""
+Gunicorn settings for production, read by `gunicorn app.wsgi` run from this
+directory (the Dockerfile's default command, scripts/run.sh). With
+SERVER=asgi that script serves app.asgi, the API and the change
+notification stream, on uvicorn workers instead.
+
+The app is imported and warmed up once in the master (preload_app, see
+core/warmup.py), then forked, so workers share that memory copy-on-write and
+serve their first request warm. Each worker opens its own database
+connections before it accepts traffic. The master logs the startup
+breakdown; run with PYTHONPROFILEIMPORTTIME=1 for a per-module import one.
+
+Sizing, overridable from the environment:
+  WEB_CONCURRENCY   workers, default 2 x available CPUs + 1
+  GUNICORN_THREADS  threads per worker, default 1 (sync workers). Above 1
+                    workers are gthread, and every thread holds its own
+                    database connection: keep workers x threads under the
+                    server's max_connections.
+  GUNICORN_WORKER_CLASS  overrides the worker class, set by scripts/run.sh
+                    for app.asgi.
+
+Signals to the master:
+  HUP   graceful worker restart: new workers are forked from the preloaded
+        master while the old ones finish their requests. Code is not
+        reloaded, since it lives in the master.
+  USR2  start a new master with new code next to the old one; then WINCH
+        and TERM the old master once the new one is ready.
+  TERM  graceful shutdown within graceful_timeout.
+"""
+import multiprocessing
+import os
+import time
+
+_config_loaded = time.perf_counter()
+
+# reuse connections across requests, the workers open them at boot
+os.environ.setdefault('DB_CONN_MAX_AGE', '60')
+
+
+def _cpus():
+    try:
+        # honours container CPU sets
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * _cpus() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or ('gthread' if threads > 1 else 'sync')
+
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# recycle workers to bound memory growth, cheap since they fork warm
+max_requests = 2000
+max_requests_jitter = 200
+# heartbeat files on tmpfs, an overlay filesystem can stall workers
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+pidfile = os.environ.get('GUNICORN_PIDFILE')
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    """warm the preloaded app in the master, before the first fork."""
+    from core import warmup
+
+    timings = warmup.Timings()
+    timings.add('preload', time.perf_counter() - _config_loaded)
+    warmup.warm_up(timings)
+    server.log.info('startup: %s', timings)
+    server.log.info('serving with %s %s workers x %s threads', workers, worker_class, threads)
+
+
+def post_worker_init(worker):
+    """connect the worker's databases and cache invalidation before it accepts requests."""
+    from core import invalidation, warmup
+
+    timings = warmup.connect_databases()
+    invalidation.get_bus().start()
+    worker.log.info('worker %s ready: %s', worker.pid, timings)
@@ -0,0 +1,58 @@
+"""
+Prefix and fuzzy name matching for tag and ingredient autocomplete.
+
+Prefix matches use a (user_id, lower(name) text_pattern_ops) index and fuzzy
+matches a pg_trgm GIN index, both created in core migration 0010. Every
+lookup runs under a short statement timeout: at keystroke rate a late answer
+is worth less than a partial one, which callers must not cache.
+"""
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+from django.db.models.functions import Lower
+
+ORDERING = ('-recipe_count', 'name', 'id')
+
+
+def _set_timeout(connection, timeout_ms):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL statement_timeout = %s', [int(timeout_ms)])
+
+
+def _fuzzy(queryset, term, vendor):
+    if vendor == 'postgresql':
+        # uses the trigram index through the % operator
+        return queryset.filter(lname__trigram_similar=term)
+    return queryset.filter(lname__contains=term)
+
+
+def autocomplete(queryset, term, limit):
+    """
+    Return up to limit objects from queryset whose name starts with term,
+    topped up with fuzzy matches, most used first, and whether the lookup
+    finished within the statement timeout.
+    """
+    conf = settings.AUTOCOMPLETE
+    term = term.strip().lower()
+    if not term:
+        return [], True
+    queryset = queryset.annotate(lname=Lower('name'))
+    connection = connections[queryset.db]
+    results = []
+    try:
+        with transaction.atomic(using=queryset.db):
+            _set_timeout(connection, conf['TIMEOUT_MS'])
+            results = list(
+                queryset.filter(lname__startswith=term).order_by(*ORDERING)[:limit]
+            )
+            if len(results) < limit and len(term) >= conf['FUZZY_MIN_LENGTH']:
+                fuzzy = _fuzzy(
+                    queryset.exclude(id__in=[obj.id for obj in results]),
+                    term, connection.vendor,
+                )
+                with transaction.atomic(using=queryset.db):
+                    results += list(fuzzy.order_by(*ORDERING)[:limit - len(results)])
+    except OperationalError:
+        # statement timeout, serve whatever finished in time
+        return results, False
+    return results, True
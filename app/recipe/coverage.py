@@ -0,0 +1,212 @@
+"""
+In-memory ingredient coverage index for "what can I cook".
+
+Each user's recipes are kept as columns of a packed bit matrix, one bit per
+ingredient the user has, stored word-major so the words touched by a pantry
+are contiguous. Ranking a pantry is then an AND plus popcount in numpy, so
+no SQL runs on the hot path. Indexes are built
+lazily from the recipe/ingredient through table and kept in step with
+recipe_links_changed after each commit. Other processes drop the user's
+index through the invalidation bus and rebuild it on next use.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+
+from core import invalidation
+from core.models import Recipe
+from core.routers import use_primary
+from core.signals import recipe_links_changed
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+ONE = np.uint64(1)
+
+
+def _popcount(bits):
+    """number of set bits in each column of a uint64 matrix."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=0, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(bits.T).view(np.uint8)
+    return POPCOUNT[as_bytes].sum(axis=1, dtype=np.int64)
+
+
+class CoverageIndex:
+    """ingredient word x recipe bit matrix for one user."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.columns = {}
+        self.ingredient_ids = []
+        self.rows = {}
+        self.count = 0
+        self.recipe_ids = np.zeros(16, dtype=np.int64)
+        self.bits = np.zeros((1, 16), dtype='<u8')
+        self.sizes = np.zeros(16, dtype=np.int64)
+
+    @classmethod
+    def build(cls, user_id):
+        index = cls()
+        through = Recipe.ingredients.through
+        pairs = through.objects.filter(recipe__user_id=user_id).values_list(
+            'recipe_id', 'ingredient_id',
+        )
+        # changes after the build arrive from commits on the primary
+        with use_primary():
+            index.add_links(list(pairs.iterator()))
+        return index
+
+    def _row(self, recipe_id):
+        row = self.rows.get(recipe_id)
+        if row is None:
+            if self.count == len(self.recipe_ids):
+                grow = len(self.recipe_ids)
+                self.recipe_ids = np.concatenate([self.recipe_ids, np.zeros(grow, np.int64)])
+                self.sizes = np.concatenate([self.sizes, np.zeros(grow, np.int64)])
+                self.bits = np.hstack([self.bits, np.zeros_like(self.bits)])
+            row = self.rows[recipe_id] = self.count
+            self.recipe_ids[row] = recipe_id
+            self.count += 1
+        return row
+
+    def _column(self, ingredient_id):
+        column = self.columns.get(ingredient_id)
+        if column is None:
+            column = self.columns[ingredient_id] = len(self.ingredient_ids)
+            self.ingredient_ids.append(ingredient_id)
+            if column // 64 >= self.bits.shape[0]:
+                self.bits = np.vstack([self.bits, np.zeros_like(self.bits)])
+        return column
+
+    def _apply(self, pairs, set_bits):
+        if not pairs:
+            return
+        rows = np.fromiter((self._row(r) for r, _ in pairs), np.int64, len(pairs))
+        columns = np.fromiter((self._column(i) for _, i in pairs), np.int64, len(pairs))
+        words = columns // 64
+        masks = np.left_shift(ONE, (columns % 64).astype(np.uint64))
+        if set_bits:
+            np.bitwise_or.at(self.bits, (words, rows), masks)
+        else:
+            np.bitwise_and.at(self.bits, (words, rows), ~masks)
+        touched = np.unique(rows)
+        self.sizes[touched] = _popcount(self.bits[:, touched])
+
+    def add_links(self, pairs):
+        with self.lock:
+            self._apply(pairs, True)
+
+    def remove_links(self, pairs):
+        with self.lock:
+            self._apply([(r, i) for r, i in pairs if r in self.rows], False)
+
+    def _mask(self, ingredient_ids):
+        mask = np.zeros(self.bits.shape[0], dtype='<u8')
+        for ingredient_id in ingredient_ids:
+            column = self.columns.get(ingredient_id)
+            if column is not None:
+                mask[column // 64] |= ONE << np.uint64(column % 64)
+        return mask
+
+    def _decode(self, recipe_bits):
+        positions = np.flatnonzero(np.unpackbits(recipe_bits.view(np.uint8), bitorder='little'))
+        return [self.ingredient_ids[p] for p in positions]
+
+    def rank(self, ingredient_ids, limit):
+        """
+        Return the top recipes by share of their ingredients in
+        ingredient_ids, with the ingredients still missing.
+        """
+        with self.lock:
+            have = self._mask(ingredient_ids)
+            bits = self.bits[:, :self.count]
+            # only words with an owned ingredient can contribute
+            words = np.flatnonzero(have)
+            shared = bits[words] & have[words, None]
+            candidates = np.flatnonzero(shared.any(axis=0))
+            if not len(candidates):
+                return []
+            owned = _popcount(shared[:, candidates])
+            sizes = self.sizes[candidates]
+            coverage = owned / sizes
+            missing = sizes - owned
+            if limit < len(candidates):
+                # keep everything tied with the kth best, then order exactly
+                cut = np.partition(-coverage, limit - 1)[limit - 1]
+                keep = -coverage <= cut
+                candidates, owned, sizes = candidates[keep], owned[keep], sizes[keep]
+                coverage, missing = coverage[keep], missing[keep]
+            order = np.lexsort((-self.recipe_ids[candidates], missing, -coverage))[:limit]
+            return [
+                {
+                    'id': int(self.recipe_ids[candidates[i]]),
+                    'coverage': round(float(coverage[i]), 4),
+                    'owned': int(owned[i]),
+                    'total': int(sizes[i]),
+                    'missing': self._decode(bits[:, candidates[i]] & ~have),
+                }
+                for i in order
+            ]
+
+
+_indexes = OrderedDict()
+_building = {}
+_lock = threading.Lock()
+
+
+def get_index(user_id):
+    """return the user's index, building it on first use."""
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+            return index
+        _building[user_id] = False
+
+    index = CoverageIndex.build(user_id)
+
+    with _lock:
+        # a commit that landed mid-build may be missing, serve but don't keep it
+        if not _building.pop(user_id, True):
+            _indexes[user_id] = index
+            while len(_indexes) > settings.RECIPE_COVERAGE_MAX_USERS:
+                _indexes.popitem(last=False)
+    return index
+
+
+def clear():
+    with _lock:
+        _indexes.clear()
+        _building.clear()
+
+
+def _apply_changes(user_id, added, removed):
+    with _lock:
+        if user_id in _building:
+            _building[user_id] = True
+        index = _indexes.get(user_id)
+    if index is not None:
+        index.remove_links(removed)
+        index.add_links(added)
+
+
+def _invalidated(user_ids):
+    with _lock:
+        for user_id in map(int, user_ids):
+            _indexes.pop(user_id, None)
+            if user_id in _building:
+                _building[user_id] = True
+
+
+@receiver(recipe_links_changed)
+def update_coverage_index(sender, user_id, field, added=(), removed=(), **kwargs):
+    if field == 'ingredients':
+        transaction.on_commit(lambda: _apply_changes(user_id, added, removed))
+        invalidation.publish('coverage', user_id)
+
+
+invalidation.subscribe('coverage', _invalidated, clear)
+invalidation.subscribe('user', _invalidated, clear)
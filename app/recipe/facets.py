@@ -0,0 +1,93 @@
+"""
+Facet counts and value statistics for a filtered set of recipes.
+"""
+from decimal import Decimal
+
+from django.db import connections
+
+from core.models import Recipe
+
+PERCENTILES = (25, 50, 75, 90)
+CENT = Decimal('0.01')
+
+
+def _percentile(histogram, total, fraction):
+    """linear interpolation like percentile_cont over a sorted histogram."""
+    position = fraction * (total - 1)
+    lower_rank = int(position)
+    upper_rank = min(lower_rank + 1, total - 1)
+    lower = upper = None
+    seen = 0
+    for value, count in histogram:
+        seen += count
+        if lower is None and seen > lower_rank:
+            lower = value
+        if seen > upper_rank:
+            upper = value
+            break
+    weight = Decimal(str(position - lower_rank))
+    return Decimal(lower) + (Decimal(upper) - Decimal(lower)) * weight
+
+
+def _stats(histogram, to_value, to_percentile):
+    histogram = sorted((to_value(value), count) for value, count in histogram)
+    if not histogram:
+        return None
+    total = sum(count for _, count in histogram)
+    stats = {'min': histogram[0][0], 'max': histogram[-1][0]}
+    for p in PERCENTILES:
+        stats[f'p{p}'] = to_percentile(_percentile(histogram, total, p / 100))
+    return stats
+
+
+def _to_price(value):
+    return Decimal(str(value)).quantize(CENT)
+
+
+def _to_minutes(value):
+    return int(Decimal(str(value)))
+
+
+def _minutes_percentile(value):
+    return float(value.quantize(CENT))
+
+
+def compute_facets(queryset):
+    """
+    Return tag and ingredient counts plus price and time_minutes stats for
+    the recipes in queryset, using a single UNION ALL query over a CTE.
+    """
+    filtered = queryset.order_by().values('id', 'price', 'time_minutes')
+    sql, params = filtered.query.get_compiler(using=filtered.db).as_sql()
+    tags = Recipe.tags.through._meta.db_table
+    ingredients = Recipe.ingredients.through._meta.db_table
+    query = f"""
+        WITH filtered AS ({sql})
+        SELECT 'tag', l.tag_id, COUNT(*) FROM filtered f
+            JOIN {tags} l ON l.recipe_id = f.id GROUP BY l.tag_id
+        UNION ALL
+        SELECT 'ingredient', l.ingredient_id, COUNT(*) FROM filtered f
+            JOIN {ingredients} l ON l.recipe_id = f.id GROUP BY l.ingredient_id
+        UNION ALL
+        SELECT 'price', f.price, COUNT(*) FROM filtered f GROUP BY f.price
+        UNION ALL
+        SELECT 'time_minutes', f.time_minutes, COUNT(*) FROM filtered f
+            GROUP BY f.time_minutes
+    """
+    rows = {'tag': [], 'ingredient': [], 'price': [], 'time_minutes': []}
+    with connections[filtered.db].cursor() as cursor:
+        cursor.execute(query, params)
+        for kind, key, count in cursor.fetchall():
+            rows[kind].append((key, count))
+
+    def ranked(pairs):
+        pairs = sorted(pairs, key=lambda pair: (-pair[1], int(pair[0])))
+        return [{'id': int(pk), 'count': count} for pk, count in pairs]
+
+    return {
+        'count': sum(count for _, count in rows['price']),
+        'tags': ranked(rows['tag']),
+        'ingredients': ranked(rows['ingredient']),
+        'price': _stats(rows['price'], _to_price, _to_price),
+        'time_minutes': _stats(rows['time_minutes'], _to_minutes, _minutes_percentile),
+    }
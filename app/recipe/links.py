@@ -0,0 +1,88 @@
+"""
+Set-based tag and ingredient link changes.
+
+Adding or removing links on any number of recipes is one INSERT ... SELECT
+or one DELETE per relation, scoped to the user's own recipes and targets,
+that returns the (recipe_id, target_id) pairs it actually wrote. Those are
+sent as recipe_links_changed so counts, versions and the recipe indexes
+follow as they do for the m2m managers.
+"""
+from django.db import connection, transaction
+
+from core.counters import get_relation
+from core.models import Recipe
+from core.signals import recipe_links_changed
+
+
+def resolve(model, user, names, create=False):
+    """
+    ids of the user's objects with these names, one query, plus one insert
+    per missing name when create is set.
+    """
+    names = list(dict.fromkeys(names))
+    existing = {}
+    for pk, name in model.objects.filter(
+            user=user, name__in=names).order_by('-id').values_list('id', 'name'):
+        existing[name] = pk
+    if create:
+        for name in names:
+            if name not in existing:
+                existing[name] = model.objects.create(user=user, name=name).pk
+    return [existing[name] for name in names if name in existing]
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def add_links(user_id, field, recipe_ids, target_ids):
+    """link every target to every recipe of the user, return the new pairs."""
+    if not recipe_ids or not target_ids:
+        return []
+    through, model, column = get_relation(field)
+    quote = connection.ops.quote_name
+    sql = (
+        f'INSERT INTO {quote(through._meta.db_table)} (recipe_id, {quote(column)}) '
+        f'SELECT r.id, t.id FROM {quote(Recipe._meta.db_table)} r '
+        f'CROSS JOIN {quote(model._meta.db_table)} t '
+        f'WHERE r.user_id = %s AND r.id IN ({_placeholders(recipe_ids)}) '
+        f'AND t.user_id = %s AND t.id IN ({_placeholders(target_ids)}) '
+        # existing links are skipped, including ones a concurrent add just wrote
+        f'ON CONFLICT DO NOTHING '
+        f'RETURNING recipe_id, {quote(column)}'
+    )
+    with transaction.atomic():
+        added = _execute(sql, [user_id, *recipe_ids, user_id, *target_ids])
+        if added:
+            recipe_links_changed.send(
+                sender=Recipe, user_id=user_id, field=field, added=added, removed=[],
+            )
+    return added
+
+
+def remove_links(user_id, field, recipe_ids, target_ids):
+    """unlink the targets from the user's recipes, return the removed pairs."""
+    if not recipe_ids or not target_ids:
+        return []
+    through, model, column = get_relation(field)
+    quote = connection.ops.quote_name
+    sql = (
+        f'DELETE FROM {quote(through._meta.db_table)} '
+        f'WHERE {quote(column)} IN ({_placeholders(target_ids)}) '
+        f'AND recipe_id IN (SELECT id FROM {quote(Recipe._meta.db_table)} '
+        f'WHERE user_id = %s AND id IN ({_placeholders(recipe_ids)})) '
+        f'RETURNING recipe_id, {quote(column)}'
+    )
+    with transaction.atomic():
+        removed = _execute(sql, [*target_ids, user_id, *recipe_ids])
+        if removed:
+            recipe_links_changed.send(
+                sender=Recipe, user_id=user_id, field=field, added=[], removed=removed,
+            )
+    return removed
@@ -0,0 +1,114 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import Recipe, Tag, Ingredient
+from recipe import similarity
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare LSH similar-recipe lookups with brute force for recall and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email of the user whose library to use')
+        parser.add_argument(
+            '--synthetic', type=int, default=0,
+            help='generate this many recipes for a throwaway user instead',
+        )
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if not options['user'] and not options['synthetic']:
+            raise CommandError('Pass --user or --synthetic.')
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                if options['synthetic']:
+                    user = self._synthetic_library(options['synthetic'])
+                else:
+                    user = get_user_model().objects.get(email=options['user'])
+                self._benchmark(user, options['queries'], options['limit'])
+                # never keep synthetic data around
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def _synthetic_library(self, size):
+        user = get_user_model().objects.create_user(
+            f'benchmark-{time.time_ns()}@example.com', None,
+        )
+        Tag.objects.bulk_create([Tag(user=user, name=f'tag {i}') for i in range(50)])
+        Ingredient.objects.bulk_create(
+            [Ingredient(user=user, name=f'ingredient {i}') for i in range(500)])
+        Recipe.objects.bulk_create([
+            Recipe(user=user, title=f'recipe {i}', time_minutes=10, price=Decimal('1.00'))
+            for i in range(size)
+        ])
+        tags = list(Tag.objects.filter(user=user).values_list('id', flat=True))
+        ingredients = list(Ingredient.objects.filter(user=user).values_list('id', flat=True))
+        ids = list(Recipe.objects.filter(user=user).values_list('id', flat=True))
+        # recipes come in families sharing most ingredients, so there is
+        # something to find
+        families = [random.sample(ingredients, 12) for _ in range(max(1, size // 20))]
+        tag_links, ingredient_links = [], []
+        for recipe_id in ids:
+            base = random.choice(families)
+            chosen = set(random.sample(base, 9)) | set(random.sample(ingredients, 2))
+            ingredient_links += [
+                Recipe.ingredients.through(recipe_id=recipe_id, ingredient_id=pk)
+                for pk in chosen
+            ]
+            tag_links += [
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=pk)
+                for pk in random.sample(tags, 3)
+            ]
+        Recipe.ingredients.through.objects.bulk_create(ingredient_links)
+        Recipe.tags.through.objects.bulk_create(tag_links)
+        start = time.perf_counter()
+        for i in range(0, len(ids), 500):
+            similarity.refresh_signatures(ids[i:i + 500])
+        self.stdout.write(
+            f'Indexed {size} synthetic recipes in {time.perf_counter() - start:.2f}s'
+        )
+        return user
+
+    def _benchmark(self, user, queries, limit):
+        recipes = list(Recipe.objects.filter(user=user))
+        sample = random.sample(recipes, min(queries, len(recipes)))
+        lsh_times, brute_times, recalls = [], [], []
+        for recipe in sample:
+            start = time.perf_counter()
+            approx = similarity.similar_recipes(recipe, limit)
+            lsh_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            exact = similarity.brute_force_similar(recipe, limit)
+            brute_times.append(time.perf_counter() - start)
+
+            if exact:
+                # ties at the cut make ids ambiguous, compare scores instead
+                found = sorted((score for score, _ in approx), reverse=True)
+                wanted = [score for score, _ in exact]
+                hits = sum(1 for a, b in zip(found, wanted) if a >= b)
+                recalls.append(hits / len(wanted))
+
+        def ms(values):
+            return f'p50 {statistics.median(values) * 1000:.1f}ms max {max(values) * 1000:.1f}ms'
+
+        self.stdout.write(f'Library: {len(recipes)} recipes, {len(sample)} queries, top {limit}')
+        self.stdout.write(f'LSH:         {ms(lsh_times)}')
+        self.stdout.write(f'Brute force: {ms(brute_times)}')
+        if recalls:
+            self.stdout.write(self.style.SUCCESS(
+                f'Recall@{limit}: {statistics.mean(recalls):.3f}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+from recipe import similarity
+
+
+class Command(BaseCommand):
+    help = 'Recompute MinHash signatures and LSH buckets for all recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                Recipe.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            similarity.refresh_signatures(ids)
+            last_id = ids[-1]
+            total += len(ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt signatures for {total} recipes.'))
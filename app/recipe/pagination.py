@@ -0,0 +1,131 @@
+"""
+Keyset (cursor) pagination for the recipe list.
+
+The cursor holds the ordering columns of the last row served, and the next
+page starts with a row value comparison against it. With the list ordered
+by the same columns as one of the recipe indexes, that's an index range
+scan however deep the client pages. Pagination is opt in: without cursor
+or page_size the list is returned as a plain array as before.
+
+Pages carry a total count. It comes from the view's maintained counter when
+it has one for the request (get_unfiltered_count), otherwise from
+core.counting.count_rows, exact up to COUNT_ESTIMATE_THRESHOLD and the
+planner's estimate above it, flagged by count_is_estimate.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from core.counting import count_rows
+
+
+class RecipeCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = list(queryset.query.order_by)
+        model = queryset.model
+        self.fields = [model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+        self.count, self.count_is_estimate = self.get_count(queryset, view)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = self.after(queryset, position)
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_count(self, queryset, view):
+        """(total, is_estimate) of the rows across all pages."""
+        counter = getattr(view, 'get_unfiltered_count', None)
+        count = counter() if counter is not None else None
+        if count is not None:
+            return count, False
+        return count_rows(queryset)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, queryset, position):
+        """rows strictly after position in the queryset ordering."""
+        quote = connections[queryset.db].ops.quote_name
+        table = quote(queryset.model._meta.db_table)
+        columns = ', '.join(f'{table}.{quote(field.column)}' for field in self.fields)
+        placeholders = ', '.join(['%s'] * len(self.fields))
+        # the orderings allowed by the view run all keys in one direction
+        op = '<' if self.ordering[0].startswith('-') else '>'
+        return queryset.extra(where=[f'({columns}) {op} ({placeholders})'], params=position)
+
+    def encode_cursor(self, obj):
+        values = [self._dump(field.value_from_object(obj)) for field in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _dump(value):
+        return value if isinstance(value, (int, str)) or value is None else str(value)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'count_is_estimate': self.count_is_estimate,
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'cursor from the next link of the previous page',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'page size (max {self.max_page_size}), paginates the list',
+                'schema': {'type': 'integer'},
+            },
+        ]
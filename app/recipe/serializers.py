@@ -1,5 +1,14 @@
-from rest_framework import serializers
-from core.models import Recipe, Tag, Ingredient
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions, serializers, status
+from core.models import Recipe, StaleVersion, Tag, Ingredient
+from recipe import links
+
+
+class PreconditionFailed(exceptions.APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = _('The recipe changed since this version was read.')
+    default_code = 'stale_version'
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -7,68 +16,118 @@ class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
 
 
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
+
+
+class VersionedSerializer(serializers.Serializer):
+    """
+    Updates applied only while the recipe is at the version the client
+    read, sent as If-Match (context['if_match']) or in the version field.
+    """
+    version = serializers.IntegerField(min_value=1, required=False)
 
+    def _expected_version(self, instance, validated_data):
+        sent = validated_data.pop('version', None)
+        expected = self.context.get('if_match', sent)
+        if expected is not None and expected != instance.version:
+            # stale when read, refuse without writing
+            raise PreconditionFailed()
+        return expected
 
-class RecipeSerializer(serializers.ModelSerializer):
+    def _save_versioned(self, instance, update_fields, expected):
+        try:
+            instance.save_versioned(update_fields, expected)
+        except StaleVersion:
+            raise PreconditionFailed()
+
+
+class RecipeSerializer(VersionedSerializer, serializers.ModelSerializer):
     """Serializer for Recipes."""
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
 
     class Meta:
         model = Recipe
-        fields = ['id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients']
+        fields = ['id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients', 'version']
         read_only_fields = ['id']
 
-    def _get_or_create_tags(self, tags, recipe):
-        """Handle getting or creating tags as needed."""
-        auth_user = self.context['request'].user
-
-        for tag in tags:
-            tag_object, created = Tag.objects.get_or_create(user=auth_user, name=tag['name'])
-            recipe.tags.add(tag_object)
-
-    def _get_or_create_ingredients(self, ingredients, recipe):
-        """Handle getting or creating ingredients as needed."""
+    def _get_or_create(self, model, items):
+        """Return the ids of the user's objects named in items, creating missing ones."""
         auth_user = self.context['request'].user
-        for ingredient in ingredients:
-            ingredient_object, created = Ingredient.objects.get_or_create(user=auth_user, **ingredient)
-            recipe.ingredients.add(ingredient_object)
-
+        return links.resolve(model, auth_user, [item['name'] for item in items], create=True)
+
+    def _link_changes(self, recipe, field, model, items):
+        """Return the ids to unlink and to link for exactly the named objects."""
+        wanted = set(self._get_or_create(model, items))
+        through = getattr(Recipe, field).through
+        target = Recipe._meta.get_field(field).m2m_reverse_name()
+        current = set(
+            through.objects.filter(recipe_id=recipe.pk).values_list(target, flat=True)
+        )
+        return current - wanted, wanted - current
+
+    @transaction.atomic
     def create(self, validated_data):
         """Create a recipe."""
         tags = validated_data.pop('tags', [])
         ingredients = validated_data.pop('ingredients', [])
+        validated_data.pop('version', None)
         recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(tags, recipe)
-        self._get_or_create_ingredients(ingredients, recipe)
+        if tags:
+            recipe.tags.add(*self._get_or_create(Tag, tags))
+        if ingredients:
+            recipe.ingredients.add(*self._get_or_create(Ingredient, ingredients))
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        """Update a recipe."""
-        tags = validated_data.pop('tags', None)
-        ingredients = validated_data.pop('ingredients', None)
-        if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
-
-        if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+        """Update a recipe, writing only what changed."""
+        expected = self._expected_version(instance, validated_data)
+        link_changes = {}
+        for field, model in (('tags', Tag), ('ingredients', Ingredient)):
+            items = validated_data.pop(field, None)
+            if items is not None:
+                link_changes[field] = self._link_changes(instance, field, model, items)
+
+        changed = []
         for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
+            if getattr(instance, attr) != value:
+                setattr(instance, attr, value)
+                changed.append(attr)
+        if changed or any(any(ids) for ids in link_changes.values()):
+            # the version check and bump come first, a conflict writes nothing
+            self._save_versioned(instance, changed, expected)
+        for field, (removed, added) in link_changes.items():
+            manager = getattr(instance, field)
+            if removed:
+                manager.remove(*removed)
+            if added:
+                manager.add(*added)
         return instance
 
 
+class RecipeLinksSerializer(serializers.Serializer):
+    """Serializer for adding or removing tags or ingredients by name."""
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False, max_length=100,
+    )
+
+
+class BulkRecipeLinksSerializer(RecipeLinksSerializer):
+    """Serializer for adding or removing tags or ingredients on many recipes."""
+    recipe_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000,
+    )
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for Recipe details view."""
 
@@ -76,11 +135,28 @@ class RecipeDetailSerializer(RecipeSerializer):
         fields = RecipeSerializer.Meta.fields + ['description', 'image']
 
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class RecipeChangeSerializer(RecipeDetailSerializer):
+    """Serializer for recipes in the change feed, links are separate entries."""
+
+    class Meta(RecipeDetailSerializer.Meta):
+        fields = [
+            field for field in RecipeDetailSerializer.Meta.fields
+            if field not in ('tags', 'ingredients')
+        ]
+
+
+class RecipeImageSerializer(VersionedSerializer, serializers.ModelSerializer):
     """serializer for uploading images to recipes."""
 
     class Meta:
         model = Recipe
-        fields = ('id', 'image')
+        fields = ('id', 'image', 'version')
         read_only_fields = ('id',)
         extra_kwargs = {'image': {'required': True}}
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        expected = self._expected_version(instance, validated_data)
+        instance.image = validated_data['image']
+        self._save_versioned(instance, ['image'], expected)
+        return instance
@@ -0,0 +1,149 @@
+"""
+Similar recipes by Jaccard similarity of their tag and ingredient sets.
+
+Comparing a recipe with every other one is quadratic over a library, so each
+recipe keeps a MinHash signature (NUM_PERM 32-bit minima, 256 bytes) and the
+signature is cut into BANDS bands whose hashes are stored as LSH buckets.
+Recipes sharing at least one bucket are candidates. Similar recipes tend to
+share only a third of their tags and ingredients, so the bands are narrow:
+32 bands of 2 rows put the collision threshold near 0.18. Candidates are
+then re-ranked by their exact Jaccard similarity
+(see `manage.py benchmark_similar` for recall and latency).
+"""
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.dispatch import receiver
+
+from core.models import Recipe, RecipeSignature, RecipeBucket
+from core.routers import use_primary
+from core.signals import recipe_links_changed
+
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+PRIME = (1 << 31) - 1
+MAX_CANDIDATES = 200
+
+# fixed seed: signatures must stay comparable across processes and releases
+_rng = np.random.default_rng(20241028)
+_A = _rng.integers(1, PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def load_features(recipe_ids=None, user_id=None):
+    """return {recipe_id: set of features}, tags even and ingredients odd."""
+    lookup = {'recipe_id__in': recipe_ids} if user_id is None else {'recipe__user_id': user_id}
+    features = defaultdict(set)
+    for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+            **lookup).values_list('recipe_id', 'tag_id'):
+        features[recipe_id].add(2 * tag_id)
+    for recipe_id, ingredient_id in Recipe.ingredients.through.objects.filter(
+            **lookup).values_list('recipe_id', 'ingredient_id'):
+        features[recipe_id].add(2 * ingredient_id + 1)
+    return features
+
+
+def minhash(features):
+    """MinHash signature of a non-empty feature set as uint32 values."""
+    x = np.fromiter(features, dtype=np.uint64, count=len(features)) % np.uint64(PRIME)
+    hashes = (_A[:, None] * x[None, :] + _B[:, None]) % np.uint64(PRIME)
+    return hashes.min(axis=1).astype('<u4')
+
+
+def band_buckets(signature):
+    """one 64-bit bucket per band, the band number is part of the hash."""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(bytes([band]) + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'little', signed=True))
+    return buckets
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def refresh_signatures(recipe_ids):
+    """recompute signatures and buckets for the given recipes."""
+    recipe_ids = set(recipe_ids)
+    with use_primary():
+        users = dict(Recipe.objects.filter(id__in=recipe_ids).values_list('id', 'user_id'))
+        features = load_features(list(users))
+    signatures = {
+        recipe_id: minhash(features[recipe_id])
+        for recipe_id in users if features.get(recipe_id)
+    }
+    with transaction.atomic():
+        RecipeBucket.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeSignature.objects.bulk_create([
+            RecipeSignature(recipe_id=recipe_id, minhash=signature.tobytes())
+            for recipe_id, signature in signatures.items()
+        ])
+        RecipeBucket.objects.bulk_create([
+            RecipeBucket(recipe_id=recipe_id, user_id=users[recipe_id], bucket=bucket)
+            for recipe_id, signature in signatures.items()
+            for bucket in band_buckets(signature)
+        ])
+    return signatures
+
+
+def get_signature(recipe):
+    try:
+        return np.frombuffer(recipe.signature.minhash, dtype='<u4')
+    except RecipeSignature.DoesNotExist:
+        return refresh_signatures([recipe.id]).get(recipe.id)
+
+
+def candidate_ids(recipe, signature, limit=MAX_CANDIDATES):
+    """recipes sharing at least one LSH bucket, most shared buckets first."""
+    buckets = (
+        RecipeBucket.objects
+        .filter(user_id=recipe.user_id, bucket__in=band_buckets(signature))
+        .exclude(recipe_id=recipe.id)
+        .values_list('recipe_id', flat=True)
+    )
+    shared = defaultdict(int)
+    for recipe_id in buckets:
+        shared[recipe_id] += 1
+    return sorted(shared, key=lambda pk: (-shared[pk], -pk))[:limit]
+
+
+def rank_exact(recipe_id, candidates, features, limit):
+    """re-rank candidates by exact Jaccard similarity."""
+    target = features.get(recipe_id, set())
+    scored = [(jaccard(target, features.get(pk, set())), pk) for pk in candidates]
+    scored = [pair for pair in scored if pair[0] > 0]
+    scored.sort(key=lambda pair: (-pair[0], -pair[1]))
+    return scored[:limit]
+
+
+def similar_recipes(recipe, limit=10):
+    """return [(similarity, recipe_id)] for the recipes most like recipe."""
+    signature = get_signature(recipe)
+    if signature is None:
+        return []
+    candidates = candidate_ids(recipe, signature)
+    features = load_features([recipe.id, *candidates])
+    return rank_exact(recipe.id, candidates, features, limit)
+
+
+def brute_force_similar(recipe, limit=10, features=None):
+    """exact answer over every recipe of the user, for benchmarks."""
+    if features is None:
+        features = load_features(user_id=recipe.user_id)
+    others = [pk for pk in features if pk != recipe.id]
+    return rank_exact(recipe.id, others, features, limit)
+
+
+@receiver(recipe_links_changed)
+def update_signatures(sender, added=(), removed=(), **kwargs):
+    recipe_ids = {recipe_id for recipe_id, _ in added} | {recipe_id for recipe_id, _ in removed}
+    if recipe_ids:
+        transaction.on_commit(lambda: refresh_signatures(recipe_ids))
@@ -0,0 +1,90 @@
+"""
+Tests for tag and ingredient autocomplete.
+"""
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient
+
+TAG_AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
+INGREDIENT_AUTOCOMPLETE_URL = reverse('recipe:ingredient-autocomplete')
+
+
+class AutocompleteApiTests(TestCase):
+    """Test name suggestions."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def names(self, res):
+        return [item['name'] for item in res.data]
+
+    def test_prefix_ranked_by_usage(self):
+        """test prefix matches come back most used first"""
+        Tag.objects.create(user=self.user, name='Chinese', recipe_count=2)
+        Tag.objects.create(user=self.user, name='chili', recipe_count=9)
+        Tag.objects.create(user=self.user, name='Cheap', recipe_count=50)
+        Tag.objects.create(user=self.user, name='dinner')
+        res = self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 'Chi'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.names(res), ['chili', 'Chinese'])
+
+    def test_fuzzy_matches_after_prefix(self):
+        """test fuzzy matches top up the prefix matches"""
+        Ingredient.objects.create(user=self.user, name='tomato', recipe_count=1)
+        Ingredient.objects.create(user=self.user, name='cherry tomato', recipe_count=5)
+        res = self.client.get(INGREDIENT_AUTOCOMPLETE_URL, {'q': 'tomato'})
+        self.assertEqual(self.names(res), ['tomato', 'cherry tomato'])
+
+    def test_limit_and_user_scope(self):
+        """test only the user's names and at most limit results"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        Tag.objects.create(user=other, name='salad')
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'salt {i}')
+        res = self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 'sal', 'limit': 3})
+        self.assertEqual(len(res.data), 3)
+        self.assertNotIn('salad', self.names(res))
+
+    def test_empty_query(self):
+        """test a blank query returns nothing"""
+        Tag.objects.create(user=self.user, name='vegan')
+        res = self.client.get(TAG_AUTOCOMPLETE_URL, {'q': ' '})
+        self.assertEqual(res.data, [])
+
+    def test_cached_until_data_changes(self):
+        """test suggestions are cached per data version"""
+        Tag.objects.create(user=self.user, name='vegan')
+        self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 've'})
+        with self.assertNumQueries(0):
+            self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 've'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(user=self.user, name='veggie')
+        res = self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 've'})
+        self.assertEqual(len(res.data), 2)
+
+    def test_timeout_returns_partial_results(self):
+        """test a query over the time budget does not fail the request"""
+        Tag.objects.create(user=self.user, name='vegan')
+        with patch('recipe.autocomplete._set_timeout', side_effect=OperationalError):
+            res = self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 've'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [])
+
+    def test_timed_out_results_not_cached(self):
+        """test a partial answer is not served to the next request"""
+        Tag.objects.create(user=self.user, name='vegan')
+        with patch('recipe.autocomplete._set_timeout', side_effect=OperationalError):
+            self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 've'})
+        res = self.client.get(TAG_AUTOCOMPLETE_URL, {'q': 've'})
+        self.assertEqual([tag['name'] for tag in res.data], ['vegan'])
@@ -0,0 +1,153 @@
+"""
+Tests for the incremental change feed.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import changes, routers
+from core.models import Change, ChangeLog, Recipe, Tag
+
+CHANGES_URL = reverse('recipe:changes')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class ChangesApiTests(TestCase):
+    """Test clients sync from the change log."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, since, **params):
+        res = self.client.get(CHANGES_URL, {'since': since, **params})
+        self.assertEqual(res.status_code, 200)
+        return res.data
+
+    def test_read_from_primary(self):
+        """test the log is read where the cursor came from, not a lagging replica"""
+        read, primary = changes.read, []
+
+        def spy(*args):
+            primary.append(routers._primary.get())
+            return read(*args)
+
+        with mock.patch.object(changes, 'read', spy):
+            self.sync(0)
+        self.assertEqual(primary, [True])
+
+    def create_recipe(self, **payload):
+        payload = {'title': 'soup', 'time_minutes': 5, 'price': Decimal('1.00'), **payload}
+        return self.client.post(RECIPES_URL, payload, format='json').data
+
+    def test_login_required(self):
+        """test the feed needs authentication"""
+        res = APIClient().get(CHANGES_URL, {'since': 0})
+        self.assertEqual(res.status_code, 401)
+
+    def test_creates_and_links_in_order(self):
+        """test a new recipe shows up with its tag and link"""
+        recipe = self.create_recipe(tags=[{'name': 'quick'}])
+        tag = Tag.objects.get()
+        data = self.sync(0)
+        self.assertFalse(data['resync'])
+        self.assertEqual([(c['type'], c['deleted']) for c in data['changes']], [
+            ('recipe', False), ('tag', False), ('recipe_tag', False),
+        ])
+        self.assertEqual(data['changes'][0]['data']['title'], 'soup')
+        self.assertNotIn('tags', data['changes'][0]['data'])
+        self.assertEqual(data['changes'][2], {
+            'type': 'recipe_tag', 'recipe': recipe['id'], 'tag': tag.id, 'deleted': False,
+        })
+        self.assertEqual(self.sync(data['cursor'])['changes'], [])
+
+    def test_updates_collapsed_to_current_state(self):
+        """test several edits of one recipe come back as one entry"""
+        recipe = self.create_recipe()
+        cursor = self.sync(0)['cursor']
+        for title in ('stew', 'broth'):
+            self.client.patch(detail_url(recipe['id']), {'title': title}, format='json')
+        data = self.sync(cursor)
+        self.assertEqual(len(data['changes']), 1)
+        self.assertEqual(data['changes'][0]['data']['title'], 'broth')
+        self.assertEqual(data['cursor'], cursor + 2)
+
+    def test_delete_is_a_tombstone(self):
+        """test deleted recipes and their links are reported"""
+        recipe = self.create_recipe(tags=[{'name': 'quick'}])
+        cursor = self.sync(0)['cursor']
+        self.client.delete(detail_url(recipe['id']))
+        data = self.sync(cursor)
+        self.assertIn(
+            {'type': 'recipe', 'id': recipe['id'], 'deleted': True}, data['changes'],
+        )
+        self.assertIn(
+            ('recipe_tag', True), [(c['type'], c['deleted']) for c in data['changes']],
+        )
+
+    def test_tag_edits_logged(self):
+        """test tag updates through the tag endpoint are logged"""
+        tag = Tag.objects.create(user=self.user, name='quick')
+        cursor = self.sync(0)['cursor']
+        self.client.patch(reverse('recipe:tag-detail', args=[tag.id]), {'name': 'fast'})
+        data = self.sync(cursor)
+        self.assertEqual(data['changes'][0]['data']['name'], 'fast')
+
+    def test_paging(self):
+        """test limit splits the log and more says there is another page"""
+        for title in 'abc':
+            self.create_recipe(title=title)
+        first = self.sync(0, limit=2)
+        self.assertTrue(first['more'])
+        second = self.sync(first['cursor'], limit=2)
+        self.assertFalse(second['more'])
+        titles = [c['data']['title'] for c in first['changes'] + second['changes']]
+        self.assertEqual(titles, ['a', 'b', 'c'])
+
+    def test_other_users_changes_hidden(self):
+        """test each user reads their own log"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        Recipe.objects.create(user=other, title='x', time_minutes=1, price='1')
+        self.assertEqual(self.sync(0)['changes'], [])
+
+    def test_compacted_cursor_resyncs(self):
+        """test a cursor older than the retained entries asks for a resync"""
+        self.create_recipe(title='a')
+        self.create_recipe(title='b')
+        Change.objects.filter(seq=1).update(created=timezone.now() - timedelta(days=365))
+        self.assertEqual(changes.compact(), 1)
+        self.assertEqual(ChangeLog.objects.get(user=self.user).floor, 1)
+        data = self.sync(0)
+        self.assertTrue(data['resync'])
+        self.assertEqual(data['cursor'], 2)
+        self.assertFalse(self.sync(1)['resync'])
+
+    def test_compaction_drops_superseded_entries(self):
+        """test only the last entry per object is kept"""
+        recipe = self.create_recipe()
+        self.client.patch(detail_url(recipe['id']), {'title': 'stew'}, format='json')
+        self.assertEqual(changes.compact(), 1)
+        self.assertEqual(Change.objects.get().seq, 2)
+        self.assertFalse(self.sync(0)['resync'])
+
+    def test_invalid_cursor(self):
+        """test since is required"""
+        res = self.client.get(CHANGES_URL)
+        self.assertEqual(res.status_code, 400)
+
+    def test_user_delete_not_logged(self):
+        """test deleting a user doesn't write entries for its cascade"""
+        self.create_recipe(tags=[{'name': 'quick'}])
+        self.user.delete()
+        self.assertFalse(Change.objects.exists())
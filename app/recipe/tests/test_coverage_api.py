@@ -0,0 +1,105 @@
+"""
+Tests for the "what can I cook" coverage ranking.
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, SimpleTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Ingredient
+from recipe import coverage
+
+COOK_URL = reverse('recipe:recipe-what-can-i-cook')
+
+
+def create_recipe(user, title, ingredients):
+    """create a recipe linked to the given ingredients"""
+    recipe = Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=Decimal('5.00'),
+    )
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+class CoverageIndexTests(SimpleTestCase):
+    """Test the bit matrix index directly."""
+
+    def test_rank_orders_by_coverage(self):
+        """test recipes rank by share of owned ingredients"""
+        index = coverage.CoverageIndex()
+        index.add_links([(1, 10), (1, 11), (2, 10), (2, 12), (2, 13), (3, 13)])
+        results = index.rank([10, 11, 12], limit=5)
+        self.assertEqual([r['id'] for r in results], [1, 2])
+        self.assertEqual(results[0]['missing'], [])
+        self.assertEqual(results[1]['missing'], [13])
+        self.assertAlmostEqual(results[1]['coverage'], 0.6667)
+
+    def test_grows_past_one_word(self):
+        """test indexes with more than 64 ingredients and many rows"""
+        index = coverage.CoverageIndex()
+        index.add_links([(r, i) for r in range(40) for i in range(r, r + 100)])
+        results = index.rank(range(120, 130), limit=3)
+        self.assertEqual([r['owned'] for r in results], [10, 10, 10])
+        self.assertEqual(results[0]['id'], 39)
+        self.assertEqual(len(results[0]['missing']), 90)
+
+    def test_remove_links(self):
+        """test removed links stop counting"""
+        index = coverage.CoverageIndex()
+        index.add_links([(1, 10), (1, 11)])
+        index.remove_links([(1, 10), (1, 11), (9, 10)])
+        self.assertEqual(index.rank([10, 11], limit=5), [])
+
+
+class WhatCanICookApiTests(TestCase):
+    """Test the what-can-i-cook action."""
+
+    def setUp(self):
+        coverage.clear()
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        names = ['rice', 'egg', 'milk', 'sugar']
+        self.rice, self.egg, self.milk, self.sugar = [
+            Ingredient.objects.create(user=self.user, name=n) for n in names
+        ]
+
+    def test_ranked_with_missing_ingredients(self):
+        """test results are ranked with titles and missing ids"""
+        pudding = create_recipe(self.user, 'pudding', [self.rice, self.milk, self.sugar])
+        omelette = create_recipe(self.user, 'omelette', [self.egg, self.milk])
+        create_recipe(self.user, 'candy', [self.sugar])
+        res = self.client.get(COOK_URL, {'have': f'{self.egg.id},{self.milk.id},{self.rice.id}'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [omelette.id, pudding.id])
+        self.assertEqual(res.data[0]['title'], 'omelette')
+        self.assertEqual(res.data[1]['missing'], [self.sugar.id])
+
+    def test_index_follows_committed_changes(self):
+        """test link changes update a built index after commit"""
+        recipe = create_recipe(self.user, 'omelette', [self.egg])
+        self.client.get(COOK_URL, {'have': f'{self.egg.id}'})
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.ingredients.add(self.milk)
+        res = self.client.get(COOK_URL, {'have': f'{self.egg.id}'})
+        self.assertEqual(res.data[0]['missing'], [self.milk.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        res = self.client.get(COOK_URL, {'have': f'{self.egg.id}'})
+        self.assertEqual(res.data, [])
+
+    def test_limited_to_user(self):
+        """test other users' recipes are never ranked"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        create_recipe(other, 'omelette', [self.egg])
+        res = self.client.get(COOK_URL, {'have': f'{self.egg.id}'})
+        self.assertEqual(res.data, [])
+
+    def test_invalid_have(self):
+        """test a missing or malformed have parameter is rejected"""
+        self.assertEqual(self.client.get(COOK_URL).status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(COOK_URL, {'have': 'egg'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,88 @@
+"""
+Tests for the recipe facets API.
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+from recipe.facets import compute_facets
+
+FACETS_URL = reverse('recipe:recipe-facets')
+
+
+def create_recipe(user, **params):
+    """create and return a sample recipe"""
+    defaults = {'title': 'sample recipe', 'time_minutes': 10, 'price': Decimal('5.00')}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class FacetsApiTests(TestCase):
+    """Test facet counts for filtered recipes."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='vegan')
+        self.quick = Tag.objects.create(user=self.user, name='quick')
+        self.tofu = Ingredient.objects.create(user=self.user, name='tofu')
+        r1 = create_recipe(self.user, price=Decimal('2.00'), time_minutes=10)
+        r2 = create_recipe(self.user, price=Decimal('4.00'), time_minutes=20)
+        r3 = create_recipe(self.user, price=Decimal('9.50'), time_minutes=60)
+        r1.tags.add(self.vegan, self.quick)
+        r2.tags.add(self.vegan)
+        r2.ingredients.add(self.tofu)
+        r3.ingredients.add(self.tofu)
+
+    def test_facets_for_all_recipes(self):
+        """test counts and stats over every recipe of the user"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        create_recipe(other, price=Decimal('99.00'))
+        res = self.client.get(FACETS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 3)
+        self.assertEqual(res.data['tags'], [
+            {'id': self.vegan.id, 'count': 2},
+            {'id': self.quick.id, 'count': 1},
+        ])
+        self.assertEqual(res.data['ingredients'], [{'id': self.tofu.id, 'count': 2}])
+        self.assertEqual(res.data['price']['min'], Decimal('2.00'))
+        self.assertEqual(res.data['price']['max'], Decimal('9.50'))
+        self.assertEqual(res.data['price']['p50'], Decimal('4.00'))
+        self.assertEqual(res.data['time_minutes']['p25'], 15.0)
+
+    def test_facets_follow_filters(self):
+        """test facets use the same filters as the recipe list"""
+        res = self.client.get(FACETS_URL, {'tags': f'{self.vegan.id}'})
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(res.data['ingredients'], [{'id': self.tofu.id, 'count': 1}])
+        self.assertEqual(res.data['time_minutes']['max'], 20)
+
+    def test_empty_facets(self):
+        """test facets for a filter matching nothing"""
+        res = self.client.get(FACETS_URL, {'tags': '0'})
+        self.assertEqual(res.data['count'], 0)
+        self.assertIsNone(res.data['price'])
+
+    def test_facets_cached_until_data_changes(self):
+        """test cached facets are reused until the user writes"""
+        self.client.get(FACETS_URL)
+        with self.assertNumQueries(0):
+            self.client.get(FACETS_URL)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_recipe(self.user, price=Decimal('1.00'))
+        res = self.client.get(FACETS_URL)
+        self.assertEqual(res.data['count'], 4)
+
+    def test_compute_facets_single_query(self):
+        """test facets are computed in one query"""
+        with self.assertNumQueries(1):
+            compute_facets(Recipe.objects.filter(user=self.user))
@@ -95,6 +95,7 @@ class PrivateIngredientAPITests(TestCase):
 
         )
         recipe.ingredients.add(in1)
+        in1.refresh_from_db()
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1 })
         s1 = IngredientSerializer(in1)
         s2 = IngredientSerializer(in2)
@@ -0,0 +1,124 @@
+"""
+Tests for the tag and ingredient add/remove actions.
+"""
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+from core.signals import recipe_links_changed
+
+
+def links_url(recipe_id, field, op):
+    return reverse('recipe:recipe-links', args=[recipe_id, field, op])
+
+
+def bulk_url(field, op):
+    return reverse('recipe:recipe-bulk-links', args=[field, op])
+
+
+def create_recipe(user, title='soup'):
+    return Recipe.objects.create(user=user, title=title, time_minutes=5, price='1.00')
+
+
+class RecipeLinksApiTests(TestCase):
+    """Test links are changed with set-based statements."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(self.user)
+        self.changes = []
+        recipe_links_changed.connect(self.record)
+        self.addCleanup(recipe_links_changed.disconnect, self.record)
+
+    def record(self, sender, field, added, removed, **kwargs):
+        self.changes.append((field, sorted(added), sorted(removed)))
+
+    def test_add_tags_by_name(self):
+        """test adding creates missing tags and skips existing links"""
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        self.recipe.tags.add(vegan)
+        self.changes.clear()
+        res = self.client.post(
+            links_url(self.recipe.id, 'tags', 'add'), {'names': ['vegan', 'quick']}, format='json',
+        )
+        self.assertEqual(res.status_code, 200)
+        quick = Tag.objects.get(name='quick')
+        self.assertEqual(res.data, {'tags': [vegan.id, quick.id], 'changed': 1})
+        self.assertEqual(self.changes, [('tags', [(self.recipe.id, quick.id)], [])])
+        quick.refresh_from_db()
+        self.assertEqual(quick.recipe_count, 1)
+
+    def test_remove_ingredients(self):
+        """test removing unlinks and leaves unknown names alone"""
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.recipe.ingredients.add(salt)
+        self.changes.clear()
+        res = self.client.post(
+            links_url(self.recipe.id, 'ingredients', 'remove'),
+            {'names': ['salt', 'pepper']}, format='json',
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['changed'], 1)
+        self.assertFalse(self.recipe.ingredients.exists())
+        self.assertFalse(Ingredient.objects.filter(name='pepper').exists())
+        self.assertEqual(self.changes, [('ingredients', [], [(self.recipe.id, salt.id)])])
+        salt.refresh_from_db()
+        self.assertEqual(salt.recipe_count, 0)
+
+    def test_other_users_recipe_not_found(self):
+        """test the detail action is limited to the user's recipes"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        recipe = create_recipe(other)
+        res = self.client.post(
+            links_url(recipe.id, 'tags', 'add'), {'names': ['x']}, format='json',
+        )
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(recipe.tags.exists())
+
+    def test_bulk_add_is_one_statement(self):
+        """test many recipes are linked with a single insert"""
+        recipes = [self.recipe] + [create_recipe(self.user, f'r{n}') for n in range(20)]
+        tags = [Tag.objects.create(user=self.user, name=name) for name in ('a', 'b')]
+        payload = {'recipe_ids': [r.id for r in recipes], 'names': ['a', 'b']}
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.post(bulk_url('tags', 'add'), payload, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['changed'], 42)
+        inserts = [q['sql'] for q in queries if 'INSERT INTO "core_recipe_tags"' in q['sql']]
+        self.assertEqual(len(inserts), 1)
+        for tag in tags:
+            tag.refresh_from_db()
+            self.assertEqual(tag.recipe_count, 21)
+
+    def test_bulk_ignores_other_users_recipes(self):
+        """test recipe ids of other users are skipped"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        recipe = create_recipe(other)
+        payload = {'recipe_ids': [self.recipe.id, recipe.id], 'names': ['a']}
+        res = self.client.post(bulk_url('tags', 'add'), payload, format='json')
+        self.assertEqual(res.data['changed'], 1)
+        self.assertFalse(recipe.tags.exists())
+
+    def test_bulk_remove(self):
+        """test removing from many recipes deletes only existing links"""
+        tag = Tag.objects.create(user=self.user, name='a')
+        second = create_recipe(self.user, 'stew')
+        self.recipe.tags.add(tag)
+        self.changes.clear()
+        payload = {'recipe_ids': [self.recipe.id, second.id], 'names': ['a']}
+        res = self.client.post(bulk_url('tags', 'remove'), payload, format='json')
+        self.assertEqual(res.data['changed'], 1)
+        self.assertEqual(self.changes, [('tags', [], [(self.recipe.id, tag.id)])])
+
+    def test_invalid_payload(self):
+        """test names and recipe ids are required"""
+        res = self.client.post(bulk_url('tags', 'add'), {'names': []}, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('names', res.data)
+        self.assertIn('recipe_ids', res.data)
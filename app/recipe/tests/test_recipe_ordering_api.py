@@ -0,0 +1,196 @@
+"""
+Tests for recipe range filters, ordering and cursor pagination.
+"""
+import re
+import unittest
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+from recipe.pagination import RecipeCursorPagination
+from recipe.views import RecipeViewSet
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def create_recipe(user, title, price, time_minutes):
+    """create and return a sample recipe"""
+    return Recipe.objects.create(
+        user=user, title=title, price=Decimal(price), time_minutes=time_minutes,
+    )
+
+
+def titles(res):
+    rows = res.data['results'] if isinstance(res.data, dict) else res.data
+    return [row['title'] for row in rows]
+
+
+class RecipeOrderingApiTests(TestCase):
+    """Test filtering and sorting the recipe list."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        create_recipe(self.user, 'stew', '12.00', 90)
+        create_recipe(self.user, 'salad', '6.00', 10)
+        create_recipe(self.user, 'toast', '2.00', 5)
+        create_recipe(self.user, 'pasta', '6.00', 25)
+        create_recipe(self.user, 'curry', '9.50', 40)
+
+    def test_range_filters_cheapest_first(self):
+        """test under 30 minutes and under 10, cheapest first"""
+        res = self.client.get(RECIPES_URL, {
+            'max_time': 30, 'max_price': '10', 'ordering': 'price',
+        })
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(titles(res), ['toast', 'salad', 'pasta'])
+
+    def test_min_filters_and_descending(self):
+        """test lower bounds and descending multi-key ordering"""
+        res = self.client.get(RECIPES_URL, {
+            'min_price': '6', 'min_time': 10, 'ordering': '-price,-time_minutes',
+        })
+        self.assertEqual(titles(res), ['stew', 'curry', 'pasta', 'salad'])
+
+    def test_ordering_by_time_and_title(self):
+        """test time and title orderings"""
+        res = self.client.get(RECIPES_URL, {'ordering': 'time_minutes'})
+        self.assertEqual(titles(res), ['toast', 'salad', 'pasta', 'curry', 'stew'])
+        res = self.client.get(RECIPES_URL, {'ordering': '-title'})
+        self.assertEqual(titles(res), ['toast', 'stew', 'salad', 'pasta', 'curry'])
+
+    def test_invalid_parameters(self):
+        """test unknown orderings, mixed directions and bad bounds fail"""
+        for params in [
+            {'ordering': 'user'},
+            {'ordering': 'price,-time_minutes'},
+            {'max_price': 'cheap'},
+            {'min_time': '1.5'},
+        ]:
+            res = self.client.get(RECIPES_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_unpaginated_by_default(self):
+        """test the list stays a plain array without pagination params"""
+        res = self.client.get(RECIPES_URL)
+        self.assertIsInstance(res.data, list)
+        self.assertEqual(len(res.data), 5)
+
+    def test_cursor_pagination_follows_ordering(self):
+        """test paging by price visits every recipe once, ties included"""
+        seen = []
+        res = self.client.get(RECIPES_URL, {'ordering': '-price', 'page_size': 2})
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            seen += titles(res)
+            if not res.data['next']:
+                break
+            res = self.client.get(res.data['next'])
+        self.assertEqual(seen, ['stew', 'curry', 'pasta', 'salad', 'toast'])
+
+    def test_cursor_pagination_with_filters(self):
+        """test cursors keep the filters of the first page"""
+        tag = Tag.objects.create(user=self.user, name='quick')
+        for recipe in Recipe.objects.filter(time_minutes__lte=25):
+            recipe.tags.add(tag)
+        res = self.client.get(RECIPES_URL, {
+            'tags': f'{tag.id}', 'ordering': 'title', 'page_size': 2,
+        })
+        self.assertEqual(titles(res), ['pasta', 'salad'])
+        res = self.client.get(res.data['next'])
+        self.assertEqual(titles(res), ['toast'])
+        self.assertIsNone(res.data['next'])
+
+    def test_paginated_count(self):
+        """test pages report the total of the filtered list"""
+        res = self.client.get(RECIPES_URL, {'max_time': 30, 'page_size': 2})
+        self.assertEqual(res.data['count'], 3)
+        self.assertFalse(res.data['count_is_estimate'])
+        res = self.client.get(res.data['next'])
+        self.assertEqual(res.data['count'], 3)
+
+    def test_unfiltered_count_from_counter(self):
+        """test the maintained per-user counter serves unfiltered totals"""
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        self.assertEqual(res.data['count'], 5)
+        get_user_model().objects.filter(pk=self.user.pk).update(recipe_count=42)
+        res = self.client.get(RECIPES_URL, {'page_size': 2, 'ordering': 'title'})
+        self.assertEqual(res.data['count'], 42)
+
+    def test_count_estimated_above_threshold(self):
+        """test large totals are flagged when they come from the planner"""
+        with self.settings(COUNT_ESTIMATE_THRESHOLD=2):
+            res = self.client.get(RECIPES_URL, {'min_price': '5', 'page_size': 2})
+        self.assertGreaterEqual(res.data['count'], 3)
+        self.assertEqual(res.data['count_is_estimate'], connection.vendor == 'postgresql')
+
+    def test_invalid_cursor(self):
+        """test a tampered cursor is rejected"""
+        res = self.client.get(RECIPES_URL, {'cursor': 'bm9wZQ=='})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+# a sort node of the plan, incremental or not
+SORT_NODE = re.compile(r'\bSort\s+\(')
+
+
+class RecipeOrderingPlanTests(TestCase):
+    """Test every supported ordering is planned on its index."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        if connection.vendor == 'postgresql':
+            # a user with enough recipes among others' that sorting them would
+            # cost more than reading a page in index order
+            User = get_user_model()
+            others = User.objects.bulk_create(
+                User(email=f'user{i}@example.com') for i in range(99)
+            )
+            Recipe.objects.bulk_create(
+                Recipe(
+                    user=self.user if i % 5 == 0 else others[i % len(others)],
+                    title=f'recipe {i}', price=Decimal(i % 50), time_minutes=i % 120,
+                )
+                for i in range(20000)
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(Recipe._meta.db_table)}')
+
+    def plan(self, **params):
+        """the plan of a page, the query RecipeCursorPagination runs"""
+        request = Request(RequestFactory().get(RECIPES_URL, params))
+        request.user = self.user
+        view = RecipeViewSet(request=request, action='list', format_kwarg=None)
+        page_size = RecipeCursorPagination.page_size
+        return view.get_queryset()[:page_size + 1].explain()
+
+    def assertNoSort(self, plan, params):
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan.upper(), params)
+        else:
+            self.assertIsNone(SORT_NODE.search(plan), (params, plan))
+
+    @unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'plan format per vendor')
+    def test_orderings_use_indexes(self):
+        """test each ordering with range filters reads a page from its index"""
+        cases = [
+            # a backward scan of the primary key filtering on the user does as well
+            ({}, ('recipe_user_id_idx', 'core_recipe_pkey')),
+            ({'ordering': 'price', 'max_price': '10', 'max_time': 30}, 'recipe_user_price_idx'),
+            ({'ordering': '-price,-time_minutes'}, 'recipe_user_price_idx'),
+            ({'ordering': 'time_minutes', 'max_time': 30}, 'recipe_user_time_idx'),
+            ({'ordering': '-title'}, 'recipe_user_title_idx'),
+        ]
+        for params, index in cases:
+            plan = self.plan(**params)
+            indexes = (index,) if isinstance(index, str) else index
+            self.assertTrue(any(name in plan for name in indexes), (params, plan))
+            self.assertNoSort(plan, params)
@@ -0,0 +1,96 @@
+"""
+Tests for diff-based recipe updates.
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+from core.signals import recipe_links_changed
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def writes(queries):
+    return [
+        query['sql'] for query in queries
+        if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+    ]
+
+
+class RecipeUpdateTests(TestCase):
+    """Test updates only write what changed."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='soup', time_minutes=10, price=Decimal('2.50'),
+        )
+        self.tags = {
+            name: Tag.objects.create(user=self.user, name=name) for name in ['a', 'b', 'c']
+        }
+        self.recipe.tags.add(*self.tags.values())
+        self.changes = []
+        recipe_links_changed.connect(self.record)
+        self.addCleanup(recipe_links_changed.disconnect, self.record)
+
+    def record(self, sender, field, added, removed, **kwargs):
+        self.changes.append((field, sorted(added), sorted(removed)))
+
+    def test_one_tag_edit_writes_the_difference(self):
+        """test replacing one tag removes and adds one link each"""
+        res = self.client.patch(
+            detail_url(self.recipe.id),
+            {'tags': [{'name': 'a'}, {'name': 'b'}, {'name': 'd'}]}, format='json',
+        )
+        self.assertEqual(res.status_code, 200)
+        new = Tag.objects.get(name='d')
+        recipe_id = self.recipe.id
+        self.assertEqual(self.changes, [
+            ('tags', [], [(recipe_id, self.tags['c'].id)]),
+            ('tags', [(recipe_id, new.id)], []),
+        ])
+        self.assertEqual(
+            set(self.recipe.tags.values_list('name', flat=True)), {'a', 'b', 'd'},
+        )
+
+    def test_noop_update_skips_writes(self):
+        """test sending the current values writes nothing"""
+        payload = {
+            'title': 'soup', 'time_minutes': 10, 'price': '2.5',
+            'tags': [{'name': 'c'}, {'name': 'b'}, {'name': 'a'}],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.patch(detail_url(self.recipe.id), payload, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(writes(queries), [])
+        self.assertEqual(self.changes, [])
+
+    def test_scalar_change_updates_its_column(self):
+        """test a title edit updates only the title"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(detail_url(self.recipe.id), {'title': 'stew'}, format='json')
+        statements = [sql for sql in writes(queries) if sql.startswith('UPDATE "core_recipe"')]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('"title"', statements[0])
+        self.assertNotIn('"price"', statements[0])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'stew')
+
+    def test_duplicate_names_linked_once(self):
+        """test a name repeated in the payload makes one link"""
+        res = self.client.patch(
+            detail_url(self.recipe.id), {'tags': [{'name': 'x'}, {'name': 'x'}]}, format='json',
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(self.recipe.tags.values_list('name', flat=True)), ['x'])
+        self.assertEqual(Tag.objects.filter(name='x').count(), 1)
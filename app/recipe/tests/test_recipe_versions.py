@@ -0,0 +1,130 @@
+"""
+Tests for optimistic concurrency control on recipes.
+"""
+import io
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core.models import Recipe, StaleVersion, Tag
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def image_file():
+    data = io.BytesIO()
+    Image.new('RGB', (4, 4)).save(data, format='JPEG')
+    data.name = 'photo.jpg'
+    data.seek(0)
+    return data
+
+
+class RecipeVersionTests(TestCase):
+    """Test writes are refused when the client's version is stale."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='soup', time_minutes=10, price=Decimal('2.50'),
+        )
+
+    def patch(self, payload, **headers):
+        return self.client.patch(detail_url(self.recipe.id), payload, format='json', **headers)
+
+    def test_retrieve_sends_version_etag(self):
+        """test the detail response carries the version as ETag"""
+        res = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(res.data['version'], 1)
+        self.assertEqual(res['ETag'], '"1"')
+
+    def test_matching_if_match_updates(self):
+        """test an update at the current version applies and bumps it"""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.patch({'title': 'stew'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['ETag'], '"2"')
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "core_recipe"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"version" = ', updates[0].split('WHERE')[1])
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.title, self.recipe.version), ('stew', 2))
+
+    def test_stale_if_match_refused(self):
+        """test an update based on an older version gets 412"""
+        self.patch({'title': 'stew'})
+        res = self.patch({'title': 'broth'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(res.status_code, 412)
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.title, self.recipe.version), ('stew', 2))
+
+    def test_version_field_checked(self):
+        """test the version may be sent in the body instead"""
+        res = self.patch({'title': 'stew', 'version': 3})
+        self.assertEqual(res.status_code, 412)
+        res = self.patch({'title': 'stew', 'version': 1})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['version'], 2)
+
+    def test_concurrent_write_loses_race(self):
+        """test the conditional UPDATE catches a write after the read"""
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        Recipe.objects.filter(pk=recipe.pk).update(version=5)
+        recipe.title = 'stew'
+        with self.assertRaises(StaleVersion), transaction.atomic():
+            recipe.save_versioned(['title'], expected=1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'soup')
+
+    def test_stale_tag_change_writes_nothing(self):
+        """test a refused update leaves the links as they were"""
+        Recipe.objects.filter(pk=self.recipe.pk).update(version=2)
+        res = self.client.put(detail_url(self.recipe.id), {
+            'title': 'soup', 'time_minutes': 10, 'price': '2.50',
+            'tags': [{'name': 'new'}], 'version': 2,
+        }, format='json', HTTP_IF_MATCH='W/"1"')
+        self.assertEqual(res.status_code, 412)
+        self.assertFalse(self.recipe.tags.exists())
+        self.assertFalse(Tag.objects.exists())
+
+    def test_without_precondition_still_bumps(self):
+        """test clients that don't send a version still advance it"""
+        res = self.patch({'tags': [{'name': 'a'}]})
+        self.assertEqual(res.data['version'], 2)
+        res = self.patch({'title': 'stew'}, HTTP_IF_MATCH='*')
+        self.assertEqual(res.data['version'], 3)
+
+    def test_link_action_checks_version(self):
+        """test tag actions honour If-Match and bump the version"""
+        url = reverse('recipe:recipe-links', args=[self.recipe.id, 'tags', 'add'])
+        res = self.client.post(url, {'names': ['a']}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(res.status_code, 200)
+        res = self.client.post(url, {'names': ['b']}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(res.status_code, 412)
+        self.assertEqual(list(self.recipe.tags.values_list('name', flat=True)), ['a'])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.version, 2)
+
+    def test_upload_image_checks_version(self):
+        """test a stale image upload is refused"""
+        url = reverse('recipe:recipe-upload-image', args=[self.recipe.id])
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            stale = self.client.post(
+                url, {'image': image_file()}, format='multipart', HTTP_IF_MATCH='"7"',
+            )
+            res = self.client.post(
+                url, {'image': image_file()}, format='multipart', HTTP_IF_MATCH='"1"',
+            )
+        self.assertEqual(stale.status_code, 412)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['version'], 2)
@@ -0,0 +1,101 @@
+"""
+Tests for similar recipe recommendations.
+"""
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient, RecipeSignature, RecipeBucket
+from recipe import similarity
+
+
+def similar_url(recipe_id):
+    """create and return a similar recipes url"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+class SimilarRecipesApiTests(TestCase):
+    """Test the similar action."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com', 'testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'ingredient {i}') for i in range(8)
+        ]
+        self.tag = Tag.objects.create(user=self.user, name='dinner')
+
+    def create_recipe(self, title, ingredient_indexes, tags=()):
+        recipe = Recipe.objects.create(
+            user=self.user, title=title, time_minutes=10, price=Decimal('5.00'),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.ingredients.add(*[self.ingredients[i] for i in ingredient_indexes])
+            recipe.tags.add(*tags)
+        return recipe
+
+    def test_signature_stored_on_commit(self):
+        """test link changes store a compact signature and buckets"""
+        recipe = self.create_recipe('stew', [0, 1, 2])
+        signature = RecipeSignature.objects.get(recipe=recipe)
+        self.assertEqual(len(signature.minhash), similarity.NUM_PERM * 4)
+        self.assertEqual(
+            RecipeBucket.objects.filter(recipe=recipe).count(), similarity.BANDS,
+        )
+
+    def test_similar_ranked_by_exact_jaccard(self):
+        """test similar recipes come back best first with exact scores"""
+        stew = self.create_recipe('stew', [0, 1, 2, 3], [self.tag])
+        close = self.create_recipe('stew 2', [0, 1, 2, 3])
+        nearer = self.create_recipe('stew 3', [0, 1, 2, 3], [self.tag])
+        self.create_recipe('cake', [5, 6, 7])
+        res = self.client.get(similar_url(stew.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': nearer.id, 'title': 'stew 3', 'similarity': 1.0},
+            {'id': close.id, 'title': 'stew 2', 'similarity': 0.8},
+        ])
+
+    def test_signature_updates_incrementally(self):
+        """test removing links updates the stored signature"""
+        stew = self.create_recipe('stew', [0, 1])
+        other = self.create_recipe('soup', [0, 1])
+        self.assertEqual(len(self.client.get(similar_url(stew.id)).data), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.ingredients.set([self.ingredients[7]])
+        self.assertEqual(self.client.get(similar_url(stew.id)).data, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            other.ingredients.clear()
+        self.assertFalse(RecipeSignature.objects.filter(recipe=other).exists())
+
+    def test_missing_signature_built_on_demand(self):
+        """test a recipe without a stored signature still works"""
+        stew = self.create_recipe('stew', [0, 1])
+        self.create_recipe('soup', [0, 1])
+        RecipeSignature.objects.filter(recipe=stew).delete()
+        res = self.client.get(similar_url(stew.id))
+        self.assertEqual(len(res.data), 1)
+
+    def test_other_users_recipe_not_found(self):
+        """test the action is limited to the user's recipes"""
+        other = get_user_model().objects.create_user('other@example.com', 'testpass123')
+        recipe = Recipe.objects.create(
+            user=other, title='x', time_minutes=1, price=Decimal('1.00'),
+        )
+        res = self.client.get(similar_url(recipe.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild_signatures_command(self):
+        """test the rebuild command backfills every signature"""
+        stew = self.create_recipe('stew', [0, 1])
+        RecipeSignature.objects.all().delete()
+        RecipeBucket.objects.all().delete()
+        call_command('rebuild_signatures', stdout=StringIO())
+        self.assertTrue(RecipeSignature.objects.filter(recipe=stew).exists())
@@ -17,5 +17,7 @@ router.register('ingredients' ,views.IngredientViewSet )
 app_name = 'recipe'
 
 urlpatterns = [
+    path('changes/', views.ChangesView.as_view(), name='changes'),
+    path('events/ticket/', views.EventTicketView.as_view(), name='events-ticket'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
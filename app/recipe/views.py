@@ -1,41 +1,147 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.utils.cache import parse_etags
+from django.utils.http import urlencode
 from rest_framework import (viewsets, mixins, status)
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
-from core.models import (Recipe, Tag, Ingredient)
-from recipe import serializers
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from core.authentication import ExpiringTokenAuthentication
+from core.idempotency import IdempotentMixin
+from core import changes, events, singleflight
+from core.models import (Change, Recipe, StaleVersion, Tag, Ingredient, changes_settings)
+from core.routers import use_primary
+from core.singleflight import SingleFlightListMixin
+from core.versions import get_data_version
+from recipe import coverage, links, serializers, similarity
+from recipe.autocomplete import autocomplete
+from recipe.facets import compute_facets
+from recipe.pagination import RecipeCursorPagination
 from drf_spectacular.utils import (extend_schema_view,
                                    extend_schema,
                                    OpenApiParameter,
                                    OpenApiTypes)
 
 
+RECIPE_FILTER_PARAMETERS = [
+    OpenApiParameter(
+        'tags',
+        OpenApiTypes.STR,
+        description='comma separated list of tags',
+    ),
+    OpenApiParameter(
+        'ingredients',
+        OpenApiTypes.STR,
+        description='comma separated list of ingredients ids to filter',
+    ),
+    OpenApiParameter('min_price', OpenApiTypes.DECIMAL, description='lowest price'),
+    OpenApiParameter('max_price', OpenApiTypes.DECIMAL, description='highest price'),
+    OpenApiParameter('min_time', OpenApiTypes.INT, description='shortest time in minutes'),
+    OpenApiParameter('max_time', OpenApiTypes.INT, description='longest time in minutes'),
+]
+
+# query parameter -> lookup
+RECIPE_RANGE_FILTERS = {
+    'min_price': 'price__gte',
+    'max_price': 'price__lte',
+    'min_time': 'time_minutes__gte',
+    'max_time': 'time_minutes__lte',
+}
+
+# ordering keys -> columns, each matching a (user, ...) index on Recipe.
+# prefix the keys with '-' for descending, mixed directions can't use them.
+RECIPE_ORDERINGS = {
+    'id': ('id',),
+    'price': ('price', 'time_minutes', 'id'),
+    'price,time_minutes': ('price', 'time_minutes', 'id'),
+    'time_minutes': ('time_minutes', 'price', 'id'),
+    'time_minutes,price': ('time_minutes', 'price', 'id'),
+    'title': ('title', 'id'),
+}
+
+LINK_MODELS = {'tags': Tag, 'ingredients': Ingredient}
+LINK_PATH = r'(?P<field>tags|ingredients)/(?P<op>add|remove)'
+LINK_PARAMETERS = [
+    OpenApiParameter('field', OpenApiTypes.STR, OpenApiParameter.PATH, enum=list(LINK_MODELS)),
+    OpenApiParameter('op', OpenApiTypes.STR, OpenApiParameter.PATH, enum=['add', 'remove']),
+]
+
+
 @extend_schema_view(
     list=extend_schema(
-        parameters=[
+        parameters=RECIPE_FILTER_PARAMETERS + [
             OpenApiParameter(
-                'tags',
+                'ordering',
                 OpenApiTypes.STR,
-                description='comma separated list of tags',
+                enum=[f'{sign}{key}' for key in RECIPE_ORDERINGS for sign in ('', '-')],
+                description='sort order, -id by default',
             ),
+        ],
+    ),
+    facets=extend_schema(
+        parameters=RECIPE_FILTER_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT},
+    ),
+    what_can_i_cook=extend_schema(
+        parameters=[
             OpenApiParameter(
-                'ingredients',
+                'have',
                 OpenApiTypes.STR,
-                description='comma separated list of ingredients ids to filter',
-            )
-        ]
-    )
+                description='comma separated list of ingredient ids the user has',
+                required=True,
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='number of recipes to return (max 100)',
+            ),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+    ),
+    similar=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='number of recipes to return (max 50)',
+            ),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+    ),
+    change_links=extend_schema(
+        operation_id='recipe_recipes_links',
+        parameters=LINK_PARAMETERS,
+        request=serializers.RecipeLinksSerializer,
+        responses={200: OpenApiTypes.OBJECT},
+    ),
+    bulk_change_links=extend_schema(
+        operation_id='recipe_recipes_bulk_links',
+        parameters=LINK_PARAMETERS,
+        request=serializers.BulkRecipeLinksSerializer,
+        responses={200: OpenApiTypes.OBJECT},
+    ),
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(SingleFlightListMixin, IdempotentMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows recipes to be viewed or edited.
     """
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [ExpiringTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeCursorPagination
+    throttle_scopes = dict.fromkeys(
+        ['create', 'update', 'partial_update', 'destroy', 'upload_image',
+         'change_links', 'bulk_change_links'],
+        'recipe-write',
+    )
 
     def __params_to_ints(self, qs):
         """Convert a list of strings to integers."""
@@ -49,16 +155,117 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ingredients = self.request.query_params.get('ingredients')
         queryset = self.queryset
 
+        # semi-joins instead of joins, so no DISTINCT and the ordering index is usable
         if tags:
             tag_ids = self.__params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = queryset.filter(id__in=Recipe.tags.through.objects.filter(
+                tag_id__in=tag_ids).values('recipe_id'))
         if ingredients:
             ingredient_ids = self.__params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = queryset.filter(id__in=Recipe.ingredients.through.objects.filter(
+                ingredient_id__in=ingredient_ids).values('recipe_id'))
+        queryset = queryset.filter(**self._range_filters())
 
         return queryset.filter(
             user=self.request.user
-        ).order_by('-id').distinct()  # Changed from 'disticnt' to 'distinct'
+        ).order_by(*self._ordering())
+
+    def get_unfiltered_count(self):
+        """The user's maintained recipe count when no filter applies."""
+        params = self.request.query_params
+        if any(params.get(name) for name in ('tags', 'ingredients', *RECIPE_RANGE_FILTERS)):
+            return None
+        return get_user_model().objects.filter(
+            pk=self.request.user.pk,
+        ).values_list('recipe_count', flat=True).first()
+
+    def _range_filters(self):
+        """Validated price and time_minutes bounds from the query string."""
+        lookups = {}
+        for param, lookup in RECIPE_RANGE_FILTERS.items():
+            value = self.request.query_params.get(param)
+            if value in (None, ''):
+                continue
+            field = Recipe._meta.get_field(lookup.split('__')[0])
+            try:
+                lookups[lookup] = field.to_python(value)
+            except DjangoValidationError:
+                raise ValidationError({param: 'must be a number.'})
+        return lookups
+
+    def _ordering(self):
+        """Columns to order by, only combinations whose pages an index serves."""
+        param = self.request.query_params.get('ordering', '-id')
+        keys = [key.strip() for key in param.split(',')]
+        descending = {key.startswith('-') for key in keys}
+        columns = RECIPE_ORDERINGS.get(','.join(key.lstrip('-') for key in keys))
+        if columns is None or len(descending) != 1:
+            raise ValidationError({'ordering': f'unsupported ordering {param!r}.'})
+        sign = '-' if descending.pop() else ''
+        return [sign + column for column in columns]
+
+    def _facets_cache_key(self):
+        """Key facets by user, data version and the normalized filters."""
+        params = urlencode(sorted(self.request.query_params.lists()), doseq=True)
+        digest = hashlib.md5(params.encode()).hexdigest()
+        user_id = self.request.user.id
+        return f'recipe-facets:{user_id}:{get_data_version(user_id)}:{digest}'
+
+    @action(methods=['GET'], detail=False)
+    def facets(self, request):
+        """Tag and ingredient counts and price/time stats for the filtered recipes."""
+        def compute():
+            # cached under the current version, so read what that version wrote
+            with use_primary():
+                return compute_facets(self.get_queryset())
+
+        data = singleflight.cached(
+            self._facets_cache_key(), settings.RECIPE_FACETS_CACHE_TIMEOUT, compute,
+        )
+        return Response(data)
+
+    @action(methods=['GET'], detail=False, url_path='what-can-i-cook')
+    def what_can_i_cook(self, request):
+        """Rank recipes by how many of their ingredients the user already has."""
+        try:
+            have = self.__params_to_ints(request.query_params['have'])
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except (KeyError, ValueError):
+            raise ValidationError('have must be a comma separated list of ingredient ids.')
+        if limit < 1:
+            raise ValidationError('limit must be positive.')
+
+        results = coverage.get_index(request.user.id).rank(have, limit)
+        titles = dict(
+            Recipe.objects.filter(
+                user=request.user, id__in=[r['id'] for r in results],
+            ).values_list('id', 'title')
+        )
+        for result in results:
+            result['title'] = titles.get(result['id'])
+        return Response(results)
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Recipes with the most similar tags and ingredients."""
+        recipe = self.get_object()
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            raise ValidationError('limit must be an integer.')
+        if limit < 1:
+            raise ValidationError('limit must be positive.')
+
+        ranked = similarity.similar_recipes(recipe, limit)
+        titles = dict(
+            Recipe.objects.filter(
+                user=request.user, id__in=[pk for _, pk in ranked],
+            ).values_list('id', 'title')
+        )
+        return Response([
+            {'id': pk, 'title': titles.get(pk), 'similarity': round(score, 4)}
+            for score, pk in ranked
+        ])
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
@@ -66,12 +273,45 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'change_links':
+            return serializers.RecipeLinksSerializer
+        elif self.action == 'bulk_change_links':
+            return serializers.BulkRecipeLinksSerializer
 
         return self.serializer_class
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def _if_match(self):
+        """The version in the If-Match header, None when absent or *."""
+        header = self.request.headers.get('If-Match')
+        if self.request.method in SAFE_METHODS or not header:
+            return None
+        etags = parse_etags(header)
+        if etags == ['*']:
+            return None
+        try:
+            # ETags are the quoted version, see finalize_response
+            version, = (int(etag.lstrip('W/').strip('"')) for etag in etags)
+        except ValueError:
+            raise serializers.PreconditionFailed()
+        return version
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        version = self._if_match()
+        if version is not None:
+            context['if_match'] = version
+        return context
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        data = getattr(response, 'data', None)
+        version = data.get('version') if isinstance(data, dict) else None
+        if self.detail and response.status_code < 300 and version:
+            response['ETag'] = f'"{version}"'
+        return super().finalize_response(request, response, *args, **kwargs)
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """Uploading image to recipe."""
@@ -83,6 +323,46 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def _change_links(self, field, op, recipe_ids, names, expected=None):
+        """
+        Add or remove the named tags or ingredients with one statement, then
+        bump the changed recipes' versions with another.
+        """
+        user = self.request.user
+        with transaction.atomic():
+            target_ids = links.resolve(LINK_MODELS[field], user, names, create=op == 'add')
+            change = links.add_links if op == 'add' else links.remove_links
+            pairs = change(user.id, field, recipe_ids, target_ids)
+            if pairs:
+                try:
+                    Recipe.objects.bump_versions({pk for pk, _ in pairs}, expected)
+                except StaleVersion:
+                    # rolls the links back with the transaction
+                    raise serializers.PreconditionFailed()
+        return Response({field: target_ids, 'changed': len(pairs)})
+
+    @action(methods=['POST'], detail=True, url_path=LINK_PATH, url_name='links')
+    def change_links(self, request, pk=None, field=None, op=None):
+        """Add or remove tags or ingredients on the recipe by name."""
+        recipe = self.get_object()
+        expected = self._if_match()
+        if expected is not None and expected != recipe.version:
+            raise serializers.PreconditionFailed()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return self._change_links(
+            field, op, [recipe.id], serializer.validated_data['names'], expected,
+        )
+
+    @action(methods=['POST'], detail=False, url_path=LINK_PATH, url_name='bulk-links')
+    def bulk_change_links(self, request, field=None, op=None):
+        """Add or remove tags or ingredients on many of the user's recipes."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        recipe_ids = list(dict.fromkeys(data['recipe_ids']))
+        return self._change_links(field, op, recipe_ids, data['names'])
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -93,14 +373,31 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 description='filter by items assigned to recipes.'
             )
         ]
-    )
+    ),
+    autocomplete=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'q',
+                OpenApiTypes.STR,
+                description='prefix or fragment of the name',
+                required=True,
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='number of suggestions to return',
+            ),
+        ]
+    ),
 )
-class BaseRecipeAttrViewSet(mixins.DestroyModelMixin,
+class BaseRecipeAttrViewSet(SingleFlightListMixin,
+                            IdempotentMixin,
+                            mixins.DestroyModelMixin,
                             mixins.UpdateModelMixin,
                             mixins.ListModelMixin,
                             viewsets.GenericViewSet):
     """Base viewset for recipe attributes."""
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [ExpiringTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -110,8 +407,48 @@ class BaseRecipeAttrViewSet(mixins.DestroyModelMixin,
         )
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
-        return queryset.filter(user=self.request.user).order_by('name').distinct()  # Changed from 'disticnt' to 'distinct'
+            queryset = queryset.filter(recipe_count__gt=0)
+        return queryset.filter(user=self.request.user).order_by('name')
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        # in one transaction with its change log entry
+        serializer.save()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        """Suggest names matching q, most used first."""
+        conf = settings.AUTOCOMPLETE
+        term = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', conf['LIMIT'])), conf['MAX_LIMIT'])
+        except ValueError:
+            raise ValidationError('limit must be an integer.')
+        if limit < 1:
+            raise ValidationError('limit must be positive.')
+
+        user_id = request.user.id
+        digest = hashlib.md5(term.strip().lower().encode()).hexdigest()
+        key = (
+            f'autocomplete:{self.queryset.model._meta.model_name}:{user_id}:'
+            f'{get_data_version(user_id)}:{limit}:{digest}'
+        )
+
+        def compute():
+            with use_primary():
+                queryset = self.queryset.filter(user=request.user)
+                results, complete = autocomplete(queryset, term, limit)
+                data = self.get_serializer(results, many=True).data
+            if not complete:
+                # timed out, the next request may do better
+                raise singleflight.NotCached(data)
+            return data
+
+        return Response(singleflight.cached(key, conf['CACHE_TIMEOUT'], compute))
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
@@ -123,3 +460,104 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     """Manage ingredients in the database."""
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
+
+
+class ChangesView(APIView):
+    """
+    The user's recipe, tag, ingredient and link changes after a cursor,
+    see core/changes.py.
+    """
+    authentication_classes = [ExpiringTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    kinds = {
+        Change.RECIPE: (Recipe, serializers.RecipeChangeSerializer),
+        Change.TAG: (Tag, serializers.TagSerializer),
+        Change.INGREDIENT: (Ingredient, serializers.IngredientSerializer),
+    }
+    link_targets = {Change.RECIPE_TAG: 'tag', Change.RECIPE_INGREDIENT: 'ingredient'}
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'since',
+                OpenApiTypes.INT,
+                description='cursor returned by the previous call, 0 for the first',
+                required=True,
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='number of log entries to read',
+            ),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    def get(self, request):
+        """Changes since the cursor, or resync when it is too old."""
+        conf = changes_settings()
+        try:
+            since = int(request.query_params['since'])
+            limit = min(int(request.query_params.get('limit', conf['PAGE_SIZE'])),
+                        conf['MAX_PAGE_SIZE'])
+        except (KeyError, ValueError):
+            raise ValidationError('since must be the cursor of the previous call.')
+        if since < 0 or limit < 1:
+            raise ValidationError('since and limit must be positive.')
+
+        # a replica behind the one that served the cursor would ask for a resync
+        with use_primary():
+            page = changes.read(request.user.id, since, limit)
+            data = {
+                'cursor': page.cursor,
+                'more': page.more,
+                'resync': page.resync,
+                'changes': self._render(page.entries),
+            }
+        return Response(data)
+
+    def _render(self, entries):
+        """Entries with the current data of the changed objects, one query per kind."""
+        data = {}
+        for kind, (model, serializer_class) in self.kinds.items():
+            ids = [e.object_id for e in entries if e.kind == kind and not e.deleted]
+            if ids:
+                objects = model.objects.filter(user=self.request.user, pk__in=ids)
+                data[kind] = {
+                    item['id']: item for item in serializer_class(
+                        objects, many=True, context={'request': self.request},
+                    ).data
+                }
+
+        results = []
+        for entry in entries:
+            if entry.kind in self.link_targets:
+                results.append({
+                    'type': entry.kind,
+                    'recipe': entry.object_id,
+                    self.link_targets[entry.kind]: entry.target_id,
+                    'deleted': entry.deleted,
+                })
+                continue
+            item = data.get(entry.kind, {}).get(entry.object_id)
+            result = {'type': entry.kind, 'id': entry.object_id, 'deleted': item is None}
+            if item is not None:
+                result['data'] = item
+            results.append(result)
+        return results
+
+
+class EventTicketView(APIView):
+    """
+    A short-lived ticket opening the user's change stream, for clients that
+    can't send the token header, see core/events.py.
+    """
+    authentication_classes = [ExpiringTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(request=None, responses={200: OpenApiTypes.OBJECT})
+    def post(self, request):
+        """Issue a stream ticket."""
+        return Response({
+            'ticket': events.issue_ticket(request.user),
+            'expires_in': events.events_settings()['TICKET_TTL'],
+        })
@@ -39,6 +39,13 @@ class AuthTokenSerializer(serializers.Serializer):
         style={'input_type': 'password'},
         trim_whitespace=False
     )
+    device = serializers.CharField(
+        max_length=64,
+        required=False,
+        default='',
+        allow_blank=True,
+    )
+
     def validate(self, attrs):
         """Validate and authenticate the user."""
         email = attrs.get('email')
@@ -0,0 +1,110 @@
+"""
+tests for expiring auth tokens
+"""
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import AuthToken
+
+TOKEN_URL = reverse('user:token')
+ME_URL = reverse('user:me')
+
+
+def create_user(**params):
+    """create and return a new user"""
+    return get_user_model().objects.create_user(**params)
+
+
+class TokenApiTests(TestCase):
+    """Test issuing and using expiring tokens"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='test@example.com', password='testpass123')
+
+    def login(self, **extra):
+        payload = {'email': 'test@example.com', 'password': 'testpass123'}
+        payload.update(extra)
+        return self.client.post(TOKEN_URL, payload)
+
+    def test_token_has_expiry(self):
+        """test a login returns the token expiry"""
+        res = self.login()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        token = AuthToken.objects.get(key=res.data['token'])
+        self.assertEqual(res.data['expires'], token.expires)
+        self.assertGreater(token.expires, timezone.now())
+
+    def test_token_per_device(self):
+        """test each device gets its own token and logins reuse it"""
+        phone = self.login(device='phone').data['token']
+        laptop = self.login(device='laptop').data['token']
+        again = self.login(device='phone').data['token']
+        self.assertNotEqual(phone, laptop)
+        self.assertEqual(phone, again)
+        self.assertEqual(AuthToken.objects.filter(user=self.user).count(), 2)
+
+    def test_expired_token_rotated_on_login(self):
+        """test logging in again replaces an expired token"""
+        token = AuthToken.objects.issue(self.user)
+        AuthToken.objects.filter(pk=token.pk).update(expires=timezone.now())
+        res = self.login()
+        self.assertNotEqual(res.data['token'], token.key)
+
+    def test_authenticate_with_token(self):
+        """test a live token authenticates requests"""
+        token = AuthToken.objects.issue(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_expired_token_rejected(self):
+        """test an expired token is refused"""
+        token = AuthToken.objects.issue(self.user)
+        AuthToken.objects.filter(pk=token.pk).update(
+            expires=timezone.now() - timedelta(seconds=1),
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_sliding_renewal(self):
+        """test using an old token slides its expiry forward"""
+        token = AuthToken.objects.issue(self.user)
+        stale = timezone.now() + timedelta(hours=2)
+        AuthToken.objects.filter(pk=token.pk).update(expires=stale)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.client.get(ME_URL)
+        token.refresh_from_db()
+        self.assertGreater(token.expires, stale)
+
+    def test_recent_token_not_rewritten(self):
+        """test a freshly renewed token is not written on every request"""
+        token = AuthToken.objects.issue(self.user)
+        self.assertFalse(token.renew())
+
+    def test_purge_expired_tokens(self):
+        """test purging deletes expired tokens in batches"""
+        for i in range(5):
+            AuthToken.objects.issue(self.user, device=f'device{i}')
+        AuthToken.objects.filter(device__in=['device0', 'device1', 'device2']).update(
+            expires=timezone.now() - timedelta(days=1),
+        )
+        deleted = AuthToken.objects.purge_expired(batch_size=2)
+        self.assertEqual(deleted, 3)
+        self.assertEqual(AuthToken.objects.count(), 2)
+
+    def test_purge_tokens_command(self):
+        """test the purge_tokens management command"""
+        token = AuthToken.objects.issue(self.user)
+        AuthToken.objects.filter(pk=token.pk).update(expires=timezone.now())
+        call_command('purge_tokens', stdout=StringIO())
+        self.assertFalse(AuthToken.objects.exists())
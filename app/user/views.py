@@ -1,7 +1,8 @@
 """
 views for the user api
 """
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
+from rest_framework.response import Response
 from user.serializers import (
 UserSerializer,
 AuthTokenSerializer
@@ -9,8 +10,15 @@ AuthTokenSerializer
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
+from django.db import transaction
 
-class CreateUserView(generics.CreateAPIView):
+from core import invalidation
+from core.authentication import ExpiringTokenAuthentication
+from core.idempotency import IdempotentMixin
+from core.models import AuthToken
+
+
+class CreateUserView(IdempotentMixin, generics.CreateAPIView):
     """create a new user in the system"""
 
     serializer_class = UserSerializer
@@ -19,12 +27,30 @@ class CreateTokenView(ObtainAuthToken):
     """create a new auth token for the user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    # ObtainAuthToken turns throttling off, password guesses are limited per IP
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    throttle_scope = 'token'
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = AuthToken.objects.issue(
+            serializer.validated_data['user'],
+            device=serializer.validated_data['device'],
+        )
+        return Response({'token': token.key, 'expires': token.expires})
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
     def get_object(self):
         """retrive and return authenticated user"""
-        return self.request.user
\ No newline at end of file
+        return self.request.user
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        user = serializer.save()
+        # drops what every process keeps about the user
+        invalidation.invalidate('user', user.pk)
@@ -0,0 +1,16 @@
+#!/bin/sh
+
+set -e
+
+python manage.py wait_for_db
+python manage.py migrate --noinput
+
+# settings in gunicorn.conf.py, exec so the master gets the stop signal
+if [ "${SERVER:-wsgi}" = "asgi" ]; then
+    # app.asgi also serves the change notification stream (core/events.py),
+    # the workers reach each other's streams through PostgreSQL
+    export EVENTS_BACKEND="${EVENTS_BACKEND:-postgres}"
+    export GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker
+    exec gunicorn app.asgi
+fi
+exec gunicorn app.wsgi